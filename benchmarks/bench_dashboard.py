@@ -0,0 +1,84 @@
+"""Benchmarks dashboard render time as the lead table grows.
+
+    python benchmarks/bench_dashboard.py --leads 1000 10000 100000 --reruns 5
+
+Seeds a lead store with ``--leads`` leads spread over every status, then
+renders ``src/dashboard.py`` headlessly with Streamlit's AppTest: one cold
+run, then ``--reruns`` reruns without writes (served from the version-keyed
+caches) and reruns after a single status change (counters are read again and
+only the displayed page is re-queried). Render time should stay roughly flat
+across sizes.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import pandas as pd
+from storage import (LeadStore, STATUS_NEW, STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED, STATUS_SENT,
+                     STATUS_REPLIED)
+
+STATUSES = [STATUS_NEW, STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED, STATUS_SENT, STATUS_REPLIED]
+
+def seed(path, n):
+    with LeadStore(path) as store:
+        for start in range(0, n, 50000):
+            chunk = range(start, min(n, start + 50000))
+            store.upsert_leads(pd.DataFrame({
+                "full_name": [f"Lead {i}" for i in chunk],
+                "company": [f"Company {i % 500}" for i in chunk],
+                "headline": "Software Engineer",
+                "profile_url": [f"https://www.linkedin.com/in/lead-{i}" for i in chunk],
+                "draft_msg": "Hi there, would love to chat about your work.",
+                "status": [STATUSES[i % len(STATUSES)] for i in chunk],
+                "reply_category": ["interested" if i % len(STATUSES) == 5 else None for i in chunk],
+            }))
+
+def timed_run(app):
+    start = time.perf_counter()
+    app.run()
+    elapsed = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--reruns", type=int, default=5)
+    args = parser.parse_args()
+
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    print(f"{'leads':>8} {'cold':>9} {'cached':>9} {'after write':>12}")
+    for n in args.leads:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "leads.db")
+            seed(path, n)
+            os.environ["LEADS_DB"] = path
+            os.environ["METRICS_FILE"] = ""
+            for module in ("storage", "metrics"):
+                sys.modules.pop(module, None) # pick up the environment above
+            st.cache_resource.clear()
+            st.cache_data.clear()
+
+            app = AppTest.from_file(os.path.join(ROOT, "src", "dashboard.py"), default_timeout=120)
+            cold = timed_run(app)
+            total = next(m.value for m in app.metric if m.label == "Total Leads")
+            assert int(total) == n, f"dashboard shows {total} leads, expected {n}"
+            cached = statistics.median(timed_run(app) for _ in range(args.reruns))
+            after_write = []
+            with LeadStore(path) as writer:
+                for i in range(args.reruns):
+                    writer.set_status(i + 1, STATUS_APPROVED)
+                    after_write.append(timed_run(app))
+            print(f"{n:>8} {cold * 1000:>7.0f}ms {cached * 1000:>7.0f}ms {statistics.median(after_write) * 1000:>10.0f}ms")
+
+if __name__ == "__main__":
+    main()
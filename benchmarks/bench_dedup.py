@@ -0,0 +1,98 @@
+"""Benchmarks incremental lead de-duplication on a large synthetic history.
+
+    python benchmarks/bench_dedup.py --history 1000000 --batch 10000
+
+Seeds a LeadIndex with ``--history`` leads, then checks a new scrape batch in
+which ``--dup-rate`` of the rows are URL variants of leads already in the
+history, or the same person again without a profile URL (e.g. from a CSV). Compares against the old
+approach: concat the whole history with the batch and drop_duplicates on the
+raw profile_url.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pandas as pd
+from dedup_index import LeadIndex
+
+FIRST = ["Ada", "Grace", "Alan", "Linus", "Margaret", "Dennis", "Barbara", "Ken", "Frances", "Edsger", "José", "Zoë"]
+COMPANIES = [f"Company {i}" for i in range(2000)]
+SCHOOLS = [f"University {i}" for i in range(300)]
+
+def synthetic_history(n, rng):
+    return pd.DataFrame({
+        "full_name": [f"{rng.choice(FIRST)} Surname{rng.randrange(n // 4 + 1)}" for _ in range(n)],
+        "headline": "Software Engineer",
+        "company": [rng.choice(COMPANIES) for _ in range(n)],
+        "school": [rng.choice(SCHOOLS) for _ in range(n)],
+        "profile_url": [f"https://www.linkedin.com/in/person-{i}" for i in range(n)],
+    })
+
+def variant(lead, rng):
+    """A duplicate of ``lead`` as a scraper might see it again."""
+    lead = dict(lead)
+    kind = rng.randrange(4)
+    if kind == 0:
+        lead["profile_url"] += "/"
+    elif kind == 1:
+        lead["profile_url"] += "?miniProfileUrn=urn%3Ali%3Afs_miniProfile%3Aabc"
+    elif kind == 2:
+        lead["profile_url"] = lead["profile_url"].replace("www.", "m.")
+    else:
+        lead["profile_url"] = ""
+        lead["full_name"] = lead["full_name"].upper() + ", MBA"
+    return lead
+
+def synthetic_batch(history, size, dup_rate, rng):
+    n = len(history)
+    rows = []
+    for i in range(size):
+        if rng.random() < dup_rate:
+            rows.append(variant(history.iloc[rng.randrange(n)].to_dict(), rng))
+        else:
+            rows.append({
+                "full_name": f"{rng.choice(FIRST)} Newname{i}", "headline": "Engineer",
+                "company": rng.choice(COMPANIES), "school": rng.choice(SCHOOLS),
+                "profile_url": f"https://www.linkedin.com/in/new-{i}",
+            })
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history", type=int, default=1000000)
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--dup-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    history = synthetic_history(args.history, rng)
+    batch = synthetic_batch(history, args.batch, args.dup_rate, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with LeadIndex(os.path.join(tmp, "lead_index.sqlite")) as index:
+            start = time.perf_counter()
+            index.add_many(history)
+            seeded = time.perf_counter() - start
+
+            start = time.perf_counter()
+            new_leads = index.filter_new(batch)
+            checked = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy = pd.concat([history, batch], ignore_index=True).drop_duplicates(subset=['profile_url'], keep='first')
+    legacy_time = time.perf_counter() - start
+
+    print(f"seed index with {args.history} leads: {seeded:.1f}s (one-off)")
+    print(f"index check of {args.batch}-lead batch: {checked:.2f}s ({args.batch / checked:.0f} leads/sec), "
+          f"{args.batch - len(new_leads)} duplicates found")
+    print(f"legacy concat + drop_duplicates: {legacy_time:.2f}s, "
+          f"{args.batch - (len(legacy) - args.history)} duplicates found")
+
+if __name__ == "__main__":
+    main()
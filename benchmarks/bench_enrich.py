@@ -0,0 +1,57 @@
+"""Measures Apollo enrichment throughput against a local mock Apollo endpoint.
+
+    python benchmarks/bench_enrich.py --leads 1000 --latency 0.1 --workers 8
+
+Runs enrichment twice over the same leads: once cold, once against the warm
+lookup cache from the first pass.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pandas as pd
+from fakes import FakeApollo
+from lead_gen import ApolloCache, ApolloClient, enrich_with_apollo
+
+def synthetic_leads(n, duplicate_rate):
+    unique = max(1, int(n * (1 - duplicate_rate)))
+    return pd.DataFrame([
+        {"full_name": f"Lead {i % unique}", "company": f"Company {i % unique % 50}", "email": None}
+        for i in range(n)
+    ])
+
+def run_pass(server, cache_path, args):
+    leads_df = synthetic_leads(args.leads, args.duplicate_rate)
+    client = ApolloClient(api_key="test", url=f"{server.url}/v1/people/search", workers=args.workers,
+                          rpm=args.rpm, backoff_base=0.05)
+    with ApolloCache(cache_path) as cache:
+        start = time.perf_counter()
+        enrich_with_apollo(leads_df, client=client, cache=cache)
+        elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed, leads_df['email'].notna().sum()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--leads", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per fake Apollo request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--duplicate-rate", type=float, default=0.1, help="fraction of leads that repeat a lookup")
+    parser.add_argument("--rpm", type=int, default=10**6)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, FakeApollo(latency=args.latency, error_rate=args.error_rate) as server:
+        cache_path = os.path.join(tmp, "apollo_cache.sqlite")
+        for label in ("cold", "warm"):
+            before = server.requests
+            elapsed, enriched = run_pass(server, cache_path, args)
+            print(f"{label}: {args.leads} leads in {elapsed:.2f}s -> {args.leads / elapsed:.1f} leads/sec "
+                  f"({server.requests - before} Apollo requests, {enriched} emails)")
+
+if __name__ == "__main__":
+    main()
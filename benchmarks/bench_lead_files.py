@@ -0,0 +1,71 @@
+"""Compares load time, memory and file size of lead files as CSV and Parquet.
+
+    python benchmarks/bench_lead_files.py --leads 1000000
+
+Writes ``--leads`` synthetic leads (repetitive status/company/school/headline
+values, like real scrapes) as CSV and Parquet, then times reading them back:
+the old plain ``pd.read_csv``, ``load_df`` on the CSV (categorical dtypes),
+``load_df`` on the Parquet file, and ``load_df`` with only the columns the
+dashboard's lead table shows.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pandas as pd
+from storage import load_df, save_df, STATUS_NEW, STATUS_PENDING, STATUS_APPROVED, STATUS_SENT
+
+DASHBOARD_COLUMNS = ["full_name", "company", "headline", "school", "email", "status"]
+HEADLINES = ["Software Engineer", "Senior Software Engineer", "Engineering Manager", "Data Scientist", "Product Manager",
+             "Staff Engineer", "SRE", "ML Engineer"]
+
+def synthetic_leads(n, rng):
+    return pd.DataFrame({
+        "full_name": [f"Person {i}" for i in range(n)],
+        "headline": [rng.choice(HEADLINES) for _ in range(n)],
+        "company": [f"Company {rng.randrange(2000)}" for _ in range(n)],
+        "school": [f"University {rng.randrange(300)}" for _ in range(n)],
+        "profile_url": [f"https://www.linkedin.com/in/person-{i}" for i in range(n)],
+        "email": [f"person{i}@company{i % 2000}.com" if i % 3 else None for i in range(n)],
+        "status": [rng.choice([STATUS_NEW, STATUS_PENDING, STATUS_APPROVED, STATUS_SENT]) for _ in range(n)],
+        "draft_msg": [f"Hi Person {i}, I'd love to hear about your work." if i % 2 else None for i in range(n)],
+    })
+
+def measure(label, load, size_bytes):
+    start = time.perf_counter()
+    df = load()
+    elapsed = time.perf_counter() - start
+    memory = df.memory_usage(deep=True).sum()
+    print(f"  {label:<34} {elapsed:7.2f}s  {memory / 2**20:8.1f} MiB in memory  {size_bytes / 2**20:7.1f} MiB on disk  {len(df.columns)} columns")
+    return elapsed, memory
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    leads = synthetic_leads(args.leads, random.Random(args.seed))
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "leads.csv")
+        parquet_path = os.path.join(tmp, "leads.parquet")
+        save_df(leads, csv_path)
+        save_df(leads, parquet_path)
+        csv_size, parquet_size = os.path.getsize(csv_path), os.path.getsize(parquet_path)
+
+        print(f"{args.leads} leads:")
+        base_time, base_memory = measure("pd.read_csv (default dtypes)", lambda: pd.read_csv(csv_path), csv_size)
+        measure("load_df(csv)", lambda: load_df(csv_path), csv_size)
+        parquet_time, parquet_memory = measure("load_df(parquet)", lambda: load_df(parquet_path), parquet_size)
+        projected_time, projected_memory = measure("load_df(parquet, dashboard columns)",
+                                                   lambda: load_df(parquet_path, columns=DASHBOARD_COLUMNS), parquet_size)
+        print(f"Parquet vs plain CSV: {base_time / parquet_time:.1f}x faster, {base_memory / parquet_memory:.1f}x less memory; "
+              f"with projection {base_time / projected_time:.1f}x faster, {base_memory / projected_memory:.1f}x less memory")
+
+if __name__ == "__main__":
+    main()
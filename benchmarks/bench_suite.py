@@ -0,0 +1,247 @@
+"""Offline throughput suite: lead generation, drafting, sending and reply triage against local fakes.
+
+    python benchmarks/bench_suite.py                                   # 100 and 1000 leads
+    python benchmarks/bench_suite.py --sizes 100 1000 10000 100000 --latency 0.05 --error-rate 0.02
+    python benchmarks/bench_suite.py --only drafts sends --compare benchmarks/results/<baseline>.json
+
+Every external service is replaced by a fake from ``fakes.py`` with the same
+``--latency`` per request and ``--error-rate`` of injected failures:
+
+- leads:  de-dup + Apollo enrichment + store upsert (``lead_gen.py``), FakeApollo
+- scrape: paginated search scraping (``lead_gen.py``), FakeLinkedIn; skipped without Chromium
+- drafts: concurrent draft generation into the store (``personalize.py``), FakeOpenAI
+- sends:  scheduled email delivery with journaling (``sender.py``), FakeSMTP
+- triage: incremental Gmail sync + tiered triage + reply matching (``inbox_listener.py``), FakeGmail + FakeOpenAI
+
+Results are written as JSON to ``benchmarks/results/<commit>.json`` (or
+``--output``); ``--compare`` prints the change against an earlier results file
+and exits non-zero if any rate dropped by more than ``--tolerance``.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+os.environ.setdefault("METRICS_FILE", "") # timings of fake services shouldn't land in the real metrics.sqlite
+
+import pandas as pd
+from fakes import FakeApollo, FakeGmail, FakeLinkedIn, FakeOpenAI, FakeSMTP, make_http_completer, make_sync_http_completer
+from storage import LeadStore, STATUS_APPROVED, STATUS_NEW, STATUS_SENT
+
+BENCHMARKS = ["leads", "scrape", "drafts", "sends", "triage"]
+REPLIES = [
+    ("I am currently out of the office until Monday with limited access to email.", {"Subject": "Automatic reply: Hello"}),
+    ("Not interested, thanks.", {}),
+    ("Sure, happy to chat! What times work for you?", {}),
+    ("Swamped this month, reach out next quarter.", {}),
+    ("Thanks for reaching out. Could you share a bit more about what you'd like to discuss and your background?", {}),
+]
+
+def synthetic_leads(n, duplicate_rate=0.1):
+    unique = max(1, int(n * (1 - duplicate_rate)))
+    return pd.DataFrame([
+        {"full_name": f"Lead {i % unique}", "headline": "Software Engineer", "company": f"Company {i % unique % 50}",
+         "school": "State University", "email": None,
+         "profile_url": f"https://www.linkedin.com/in/lead-{i % unique}" + ("/" if i >= unique else "")}
+        for i in range(n)
+    ])
+
+def seeded_store(path, n, status, with_email=False):
+    store = LeadStore(path)
+    leads = synthetic_leads(n, duplicate_rate=0)
+    if with_email:
+        leads['email'] = [f"lead{i}@company{i % 50}.com" for i in range(n)]
+    store.upsert_leads(leads, status=status)
+    return store
+
+def bench_leads(size, args, tmp):
+    from dedup_index import LeadIndex
+    from lead_gen import ApolloCache, ApolloClient, deduplicate_leads, enrich_with_apollo
+
+    scraped = synthetic_leads(size)
+    with FakeApollo(latency=args.latency, error_rate=args.error_rate) as apollo, \
+            LeadIndex(os.path.join(tmp, "index.sqlite")) as index, \
+            ApolloCache(os.path.join(tmp, "apollo.sqlite")) as cache, \
+            LeadStore(os.path.join(tmp, "leads.db")) as store:
+        client = ApolloClient(api_key="bench", url=f"{apollo.url}/v1/people/search", workers=args.workers,
+                              rpm=10**9, backoff_base=0.01)
+        start = time.perf_counter()
+        new_leads = deduplicate_leads(scraped, index)
+        enriched = enrich_with_apollo(new_leads, client=client, cache=cache)
+        store.upsert_leads(enriched)
+        elapsed = time.perf_counter() - start
+        client.close()
+        return elapsed, size, {"unique": len(new_leads), "apollo_requests": apollo.requests, "apollo_errors": apollo.errors}
+
+def chromium_available():
+    try:
+        from playwright.sync_api import sync_playwright
+        with sync_playwright() as p:
+            p.chromium.launch().close()
+        return True
+    except Exception:
+        return False
+
+def bench_scrape(size, args, tmp):
+    from playwright.sync_api import sync_playwright
+    from lead_gen import LinkedInScraper
+
+    with FakeLinkedIn(total=size, latency=args.latency, error_rate=args.error_rate) as linkedin, sync_playwright() as p:
+        with LinkedInScraper(p, tabs=args.tabs, max_pages=size // 10 + 2, login=False, base_url=linkedin.url) as scraper:
+            start = time.perf_counter()
+            count = sum(1 for _ in scraper.scrape(f"{linkedin.url}/search/results/people/?keywords=bench"))
+            elapsed = time.perf_counter() - start
+        return elapsed, count, {"pages": scraper.stats["pages"], "requests": linkedin.requests}
+
+def bench_drafts(size, args, tmp):
+    from personalize import DraftGenerator, generate_drafts
+
+    with FakeOpenAI(latency=args.latency, error_rate=args.error_rate) as openai_server, \
+            seeded_store(os.path.join(tmp, "leads.db"), size, STATUS_NEW) as store:
+        generator = DraftGenerator(complete=make_http_completer(openai_server.url), concurrency=args.concurrency,
+                                   rpm=10**9, tpm=10**12, backoff_base=0.01, batch_size=args.draft_batch_size)
+        leads_df = store.leads(status=STATUS_NEW).set_index('id')
+        start = time.perf_counter()
+        generate_drafts(leads_df, generator, store=store)
+        elapsed = time.perf_counter() - start
+        return elapsed, generator.stats["completed"], {
+            "requests": openai_server.requests, "retries": generator.stats["retries"], "failed": generator.stats["failed"],
+        }
+
+def bench_sends(size, args, tmp):
+    from outbound import OutboundScheduler
+    from sender import EmailTransport
+
+    with FakeSMTP(latency=args.latency, error_rate=args.error_rate) as smtp, \
+            seeded_store(os.path.join(tmp, "leads.db"), size, STATUS_APPROVED, with_email=True) as store:
+        @contextmanager
+        def connect():
+            with EmailTransport(user="bench@example.com", password="x", host=smtp.host, port=smtp.port, pool_size=1,
+                                smtp_ssl=False, smtp_starttls=False, smtp_skip_login=True) as transport:
+                yield lambda job: transport.send(job['to'], "Hello", job['body'])
+
+        scheduler = OutboundScheduler(store)
+        scheduler.add_channel("email", connect, [scheduler.quota("email", args.send_rpm, capacity=args.send_rpm)],
+                              workers=args.workers)
+        outbox = store.leads(status=STATUS_APPROVED)
+        jobs = [{"lead_id": row.id, "channel": "email", "to": row.email, "body": "Hi"} for row in outbox.itertuples()]
+        start = time.perf_counter()
+        stats = scheduler.run(jobs)["email"]
+        elapsed = time.perf_counter() - start
+        return elapsed, stats["sent"], {"failed": stats["failed"]}
+
+def bench_triage(size, args, tmp):
+    from inbox_listener import GmailSyncState, fetch_new_messages, message_headers, parse_message, record_reply
+    from reply_index import ReplyIndex
+    from triage import ReplyTriage, TriageCache
+
+    gmail = FakeGmail(latency=args.latency, error_rate=args.error_rate)
+    for i in range(size):
+        body, headers = REPLIES[i % len(REPLIES)]
+        gmail.deliver(f"m{i}", f"lead{i}@company{i % 50}.com", f"{body} (ref {i % 200})", headers)
+
+    with FakeOpenAI(latency=args.latency) as openai_server, \
+            seeded_store(os.path.join(tmp, "leads.db"), size, STATUS_SENT, with_email=True) as store, \
+            GmailSyncState(os.path.join(tmp, "sync.sqlite")) as state, \
+            TriageCache(os.path.join(tmp, "triage.sqlite")) as cache:
+        triage = ReplyTriage(complete=make_sync_http_completer(openai_server.url), cache=cache,
+                             batch_size=args.triage_batch_size)
+        reply_index = ReplyIndex(store)
+        start = time.perf_counter()
+        messages, _ = fetch_new_messages(gmail, state)
+        categories = triage.triage_many([(parse_message(msg)[1], message_headers(msg)) for msg in messages])
+        matched = sum(record_reply(store, reply_index, msg, category) is not None
+                      for msg, category in zip(messages, categories))
+        for msg in messages:
+            state.mark_processed(msg['id'])
+        elapsed = time.perf_counter() - start
+        report = triage.report()
+        return elapsed, len(messages), {
+            "matched": matched, "gmail_round_trips": gmail.round_trips, "llm_requests": triage.llm_requests,
+            "tier_fractions": {tier: round(stats["fraction"], 3) for tier, stats in report.items()},
+        }
+
+RUNNERS = {"leads": bench_leads, "scrape": bench_scrape, "drafts": bench_drafts, "sends": bench_sends, "triage": bench_triage}
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except Exception:
+        return "unknown", False
+
+def compare(results, baseline_path, tolerance):
+    """Prints per-benchmark rate changes against ``baseline_path``; returns the regressions."""
+    with open(baseline_path) as f:
+        baseline = {(r["benchmark"], r["size"]): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        old = baseline.get((result["benchmark"], result["size"]))
+        if not old or not old["per_sec"]:
+            continue
+        change = result["per_sec"] / old["per_sec"] - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            regressions.append(result)
+        print(f"  {result['benchmark']:<7} {result['size']:>7}  {old['per_sec']:10.1f} -> {result['per_sec']:10.1f}/s  {change:+7.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per fake request / message")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake requests that fail")
+    parser.add_argument("--workers", type=int, default=8, help="Apollo threads / SMTP connections")
+    parser.add_argument("--concurrency", type=int, default=16, help="drafts in flight")
+    parser.add_argument("--draft-batch-size", type=int, default=1)
+    parser.add_argument("--triage-batch-size", type=int, default=20)
+    parser.add_argument("--tabs", type=int, default=3, help="scraper tabs")
+    parser.add_argument("--send-rpm", type=float, default=10**9, help="email quota (effectively unlimited by default)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before --compare fails")
+    args = parser.parse_args()
+
+    benchmarks = list(args.only)
+    if "scrape" in benchmarks and not chromium_available():
+        print("Skipping scrape: Chromium is not installed (python -m playwright install chromium).")
+        benchmarks.remove("scrape")
+
+    results = []
+    for name in benchmarks:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                elapsed, count, extra = RUNNERS[name](size, args, tmp)
+            result = {"benchmark": name, "size": size, "count": count, "seconds": round(elapsed, 4),
+                      "per_sec": round(count / elapsed, 2) if elapsed > 0 else 0.0, **extra}
+            results.append(result)
+            print(f"{name:<7} {size:>7} leads: {count:>7} in {elapsed:8.2f}s -> {result['per_sec']:10.1f}/s  {extra}")
+
+    commit, dirty = git_commit()
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{commit}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit, "dirty": dirty, "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "config": vars(args), "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
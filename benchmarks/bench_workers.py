@@ -0,0 +1,81 @@
+"""Measures how personalize throughput scales with the number of queue workers.
+
+    python benchmarks/bench_workers.py --leads 400 --workers 1 2 4 8 --latency 0.2 --concurrency 4
+
+For each ``--workers`` count, seeds a fresh lead store with ``--leads`` new
+leads, queues one draft job per lead on a SQLite job queue, and starts that
+many ``personalize.py --worker`` equivalents as separate processes against a
+local fake completion server. Each worker keeps ``--concurrency`` requests in
+flight, like one ECS task would, so throughput should grow close to linearly
+with the worker count until the store or the fake server saturates.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+os.environ.setdefault("METRICS_FILE", "")
+
+import pandas as pd
+from fakes import FakeOpenAI, make_http_completer
+from jobqueue import SQLiteJobQueue, Worker
+from personalize import DraftGenerator, JOB_QUEUE, draft_job_handler, enqueue_drafts
+from storage import LeadStore, STATUS_PENDING
+
+def seed(store, n):
+    store.upsert_leads(pd.DataFrame({
+        "full_name": [f"Lead {i}" for i in range(n)],
+        "headline": "Software Engineer",
+        "company": [f"Company {i % 50}" for i in range(n)],
+        "school": "State University",
+        "profile_url": [f"https://www.linkedin.com/in/lead-{i}" for i in range(n)],
+    }))
+
+def work(store_path, queue_path, url, concurrency, batch_size):
+    with LeadStore(store_path) as store, SQLiteJobQueue(queue_path) as queue:
+        generator = DraftGenerator(complete=make_http_completer(url), concurrency=concurrency,
+                                   rpm=10**6, tpm=10**9, backoff_base=0.05)
+        Worker(queue, JOB_QUEUE, draft_job_handler(store, generator), store=store, batch_size=batch_size,
+               poll_seconds=0.05).run(exit_when_idle=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, default=400)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake completion")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight per worker")
+    parser.add_argument("--batch-size", type=int, default=10, help="jobs leased per batch")
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'seconds':>8} {'drafts/s':>9} {'speedup':>8}")
+    base_rate = None
+    with FakeOpenAI(latency=args.latency) as server:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as tmp:
+                store_path, queue_path = os.path.join(tmp, "leads.db"), os.path.join(tmp, "jobs.sqlite")
+                with LeadStore(store_path) as store, SQLiteJobQueue(queue_path) as queue:
+                    seed(store, args.leads)
+                    enqueue_drafts(store, queue)
+
+                start = time.perf_counter()
+                processes = [multiprocessing.Process(target=work, args=(store_path, queue_path, server.url,
+                                                                        args.concurrency, args.batch_size))
+                             for _ in range(workers)]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+                elapsed = time.perf_counter() - start
+
+                with LeadStore(store_path) as store:
+                    drafted = store.count_by_status().get(STATUS_PENDING, 0)
+                assert drafted == args.leads, f"{drafted} of {args.leads} leads drafted"
+                rate = drafted / elapsed
+                base_rate = base_rate or rate
+                print(f"{workers:>8} {elapsed:>8.2f} {rate:>9.1f} {rate / base_rate:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""Local stand-ins for the external services the pipeline talks to.
+
+Each HTTP fake is a small server on 127.0.0.1 running in a background thread;
+the SMTP fake is an aiosmtpd server and the Gmail fake an in-process stand-in
+for the googleapiclient service object. All have configurable per-request
+latency and error injection, so throughput can be measured offline and
+reproducibly.
+"""
+import asyncio
+import base64
+import html
+import json
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+class FakeService:
+    """Base class: subclasses implement ``handle`` and return ``(status, payload)``."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, error_status=429, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _dispatch(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parsed = urlparse(self.path)
+                status, payload, headers = service._respond(
+                    self.command, parsed.path, parse_qs(parsed.query), body, self.headers
+                )
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(status)
+                content_type = "text/html" if isinstance(payload, bytes) else "application/json"
+                self.send_header("Content-Type", headers.pop("Content-Type", content_type))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _respond(self, method, path, query, body, headers):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            fail = self.error_rate and self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if fail:
+            return self.error_status, {"error": {"message": "injected failure"}}, {"Retry-After": "0"}
+        status, payload = self.handle(method, path, query, body, headers)
+        return status, payload, {}
+
+    def handle(self, method, path, query, body, headers):
+        raise NotImplementedError
+
+class FakeOpenAI(FakeService):
+    """Answers ``POST /v1/chat/completions`` with a short canned draft, cut to ``max_tokens`` like the real API."""
+
+    def handle(self, method, path, query, body, headers):
+        if not path.endswith("/chat/completions"):
+            return 404, {"error": {"message": f"unknown path {path}"}}
+        request = json.loads(body or b"{}")
+        messages = request.get("messages", [])
+        prompt = " ".join(m.get("content", "") for m in messages)
+        content = "Hi there! I'd love a quick 15-minute chat about your work."
+        system = messages[0].get("content", "") if messages else ""
+        if "JSON object mapping each lead id" in system:
+            lead_ids = json.loads(messages[-1]["content"])
+            content = json.dumps({lead_id: content for lead_id in lead_ids})
+        elif "JSON object mapping each reply id" in system:
+            reply_ids = json.loads(messages[-1]["content"])
+            content = json.dumps({reply_id: "4" for reply_id in reply_ids})
+        elif "Categorize this email reply" in prompt:
+            content = "4"
+        finish_reason = "stop"
+        if request.get("max_tokens") and len(content) // 4 > request["max_tokens"]:
+            content, finish_reason = content[:4 * request["max_tokens"]], "length"
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return 200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "model": request.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+class FakeApollo(FakeService):
+    """Answers ``GET /v1/people/search``; roughly ``hit_rate`` of names have an email."""
+
+    def __init__(self, hit_rate=0.7, **kwargs):
+        super().__init__(**kwargs)
+        self.hit_rate = hit_rate
+
+    def handle(self, method, path, query, body, headers):
+        if not path.endswith("/people/search"):
+            return 404, {"error": f"unknown path {path}"}
+        name = query.get("q_keywords", [""])[0]
+        company = query.get("organization_name", [""])[0]
+        if random.Random(name + company).random() >= self.hit_rate:
+            return 200, {"people": []}
+        handle = ".".join(name.lower().split()) or "someone"
+        domain = "".join(company.lower().split()) or "example"
+        return 200, {"people": [{"name": name, "email": f"{handle}@{domain}.com"}]}
+
+class HTTPStatusError(Exception):
+    """Non-2xx response from a fake, shaped like the openai errors the engine retries on."""
+
+    def __init__(self, status, headers):
+        super().__init__(f"HTTP {status}")
+        self.http_status = status
+        self.headers = dict(headers)
+
+def _chat_poster(base_url, api_key, max_workers):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def post(messages, model, max_tokens=None):
+        request = {"model": model, "messages": messages, **({"max_tokens": max_tokens} if max_tokens else {})}
+        response = session.post(f"{base_url}/v1/chat/completions", json=request, timeout=60)
+        if response.status_code >= 400:
+            raise HTTPStatusError(response.status_code, response.headers)
+        data = response.json()
+        choice = data["choices"][0]
+        return choice["message"]["content"].strip(), data.get("usage", {}).get("total_tokens"), choice.get("finish_reason")
+    return post
+
+def make_sync_http_completer(base_url, api_key="test"):
+    """Returns a blocking ``complete(messages, model, max_tokens) -> text`` (the shape ``ReplyTriage`` expects)."""
+    post = _chat_poster(base_url, api_key, max_workers=4)
+    return lambda messages, model, max_tokens=None: post(messages, model, max_tokens)[0]
+
+def make_http_completer(base_url, api_key="test", max_workers=64):
+    """Returns a ``complete(messages, model, max_tokens)`` coroutine that calls an OpenAI-compatible endpoint."""
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    post = _chat_poster(base_url, api_key, max_workers)
+
+    async def complete(messages, model, max_tokens=None):
+        return await asyncio.get_running_loop().run_in_executor(executor, post, messages, model, max_tokens)
+
+    return complete
+
+SEARCH_PAGE = """<!DOCTYPE html>
+<html><head><title>Search | LinkedIn</title>
+<link rel="stylesheet" href="/static/search.css"><script src="https://www.googletagmanager.com/gtm.js"></script></head>
+<body><main><ul class="reusable-search__entity-result-list">{results}</ul>{empty}</main></body></html>"""
+SEARCH_RESULT = """<li class="reusable-search__result-container"><div class="entity-result">
+<img src="/static/avatar-{n}.jpg" alt=""><a class="app-aware-link" href="/in/lead-{n}"><span dir="ltr"><span aria-hidden="true">{name}</span></span></a>
+<div class="entity-result__primary-subtitle">Software Engineer at Company {company}</div></div></li>"""
+PROFILE_PAGE = """<!DOCTYPE html>
+<html><head><title>{name} | LinkedIn</title></head><body>
+<h1>{name}</h1><button onclick="document.getElementById('form').hidden = false">Message</button>
+<div id="form" hidden><div class="msg-form__contenteditable" contenteditable="true"></div>
+<button class="msg-form__send-button" onclick="fetch('/sent', {{method: 'POST'}})">Send</button></div>
+</body></html>"""
+
+class FakeLinkedIn(FakeService):
+    """Serves search result pages (``results_per_page`` at a time, ``total`` in all), profiles with a
+    working Message form, and a logged-in ``/feed/``. ``POST /sent`` counts delivered messages."""
+
+    def __init__(self, total=100, results_per_page=10, **kwargs):
+        super().__init__(**kwargs)
+        self.total = total
+        self.results_per_page = results_per_page
+        self.sent = 0
+
+    def handle(self, method, path, query, body, headers):
+        if path.startswith("/search/"):
+            page = int(query.get("page", ["1"])[0])
+            first = (page - 1) * self.results_per_page
+            numbers = range(first, min(first + self.results_per_page, self.total))
+            results = "".join(SEARCH_RESULT.format(n=n, name=f"Lead {n}", company=n % 50) for n in numbers)
+            empty = "" if results else '<div class="search-reusable-search-no-results">No results found</div>'
+            return 200, SEARCH_PAGE.format(results=results, empty=empty).encode()
+        if path.startswith("/in/"):
+            return 200, PROFILE_PAGE.format(name=html.escape(path[4:].strip("/"))).encode()
+        if path.startswith("/feed"):
+            return 200, b"<!DOCTYPE html><html><body>Feed</body></html>"
+        if path == "/sent" and method == "POST":
+            with self._lock:
+                self.sent += 1
+            return 200, {"ok": True}
+        return 404, b"<html><body>Not found</body></html>"
+
+class FakeSMTP:
+    """aiosmtpd server that takes ``latency`` per message and refuses ``error_rate`` of them with a 451."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        if Controller is None:
+            raise RuntimeError("aiosmtpd is not installed")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.messages = 0
+        self.errors = 0
+        self.controller = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return "451 4.3.0 injected failure"
+        self.messages += 1
+        return "250 OK"
+
+    def start(self):
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.host = "127.0.0.1"
+        self.controller = Controller(self, hostname=self.host, port=self.port)
+        self.controller.start()
+
+    def stop(self):
+        if self.controller is not None:
+            self.controller.stop()
+            self.controller = None
+
+class FakeGmailError(Exception):
+    """Shaped like googleapiclient's HttpError (``.resp.status``)."""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type("Response", (), {"status": status})()
+
+class _Call:
+    def __init__(self, gmail, fn):
+        self.gmail = gmail
+        self.fn = fn
+
+    def execute(self):
+        self.gmail._round_trip()
+        return self.fn()
+
+class FakeGmail:
+    """In-process stand-in for the Gmail ``service`` object used by ``inbox_listener``.
+
+    Every ``execute()`` (and every batch) costs one ``latency`` round trip;
+    ``error_rate`` of the messages in a batch come back to the callback as
+    500 errors. Supports messages.list/get, history.list, getProfile and
+    ``new_batch_http_request``, all without pagination.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.history_id = 1
+        self.store = {}
+        self.changes = []
+        self.round_trips = 0
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def deliver(self, msg_id, sender, body, headers=None, thread_id=None):
+        self.history_id += 1
+        header_list = [{"name": "From", "value": sender}] + [{"name": k, "value": v} for k, v in (headers or {}).items()]
+        data = base64.urlsafe_b64encode(body.encode()).decode()
+        self.store[msg_id] = {"id": msg_id, "threadId": thread_id or msg_id,
+                              "payload": {"headers": header_list, "body": {"data": data}}}
+        self.changes.append((self.history_id, msg_id))
+
+    # service.users() / .messages() / .history() all resolve to this object
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return _FakeGmailHistory(self)
+
+    def getProfile(self, userId):
+        return _Call(self, lambda: {"historyId": str(self.history_id)})
+
+    def list(self, userId, q=None):
+        return _Call(self, lambda: {"messages": [{"id": msg_id} for _, msg_id in self.changes]})
+
+    def list_next(self, request, results):
+        return None
+
+    def get(self, userId, id):
+        return _Call(self, lambda: self.store[id])
+
+    def new_batch_http_request(self, callback):
+        return _FakeGmailBatch(self, callback)
+
+class _FakeGmailHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes=None, labelId=None):
+        changes = [(h, m) for h, m in self.gmail.changes if h > int(startHistoryId)]
+        return _Call(self.gmail, lambda: {
+            "history": [{"id": str(h), "messagesAdded": [{"message": {"id": m}}]} for h, m in changes],
+            "historyId": str(self.gmail.history_id),
+        })
+
+    def list_next(self, request, results):
+        return None
+
+class _FakeGmailBatch:
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.calls = []
+
+    def add(self, request, request_id):
+        self.calls.append((request_id, request))
+
+    def execute(self):
+        self.gmail._round_trip()
+        for request_id, request in self.calls:
+            if self.gmail.error_rate and self.gmail.random.random() < self.gmail.error_rate:
+                self.callback(request_id, None, FakeGmailError(500))
+            else:
+                self.callback(request_id, request.fn(), None)
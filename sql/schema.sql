@@ -1,4 +1,4 @@
-CREATE TABLE leads (
+CREATE TABLE IF NOT EXISTS leads (
     id SERIAL PRIMARY KEY,
     full_name VARCHAR(255),
     headline TEXT,
@@ -8,5 +8,102 @@ CREATE TABLE leads (
     profile_url VARCHAR(255) UNIQUE,
     email VARCHAR(255),
     last_contact TIMESTAMP,
-    status VARCHAR(50)
-);
\ No newline at end of file
+    status VARCHAR(50) NOT NULL DEFAULT 'new',
+    draft_msg TEXT,
+    reply_category VARCHAR(50),
+    replied_at TIMESTAMP,
+    email_key VARCHAR(255)
+);
+
+CREATE INDEX IF NOT EXISTS leads_status ON leads (status);
+CREATE INDEX IF NOT EXISTS leads_email ON leads (email);
+
+-- Columns added after the first release (email_key: the normalized email, set by LeadStore)
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS reply_category VARCHAR(50);
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS replied_at TIMESTAMP;
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS email_key VARCHAR(255);
+CREATE INDEX IF NOT EXISTS leads_email_key ON leads (email_key);
+
+-- Maps normalized sender addresses, Gmail thread IDs and sent Message-IDs to leads (see src/reply_index.py)
+CREATE TABLE IF NOT EXISTS reply_keys (
+    key TEXT PRIMARY KEY,
+    lead_id INTEGER NOT NULL REFERENCES leads (id)
+);
+
+-- Outbound delivery journal (see src/outbound.py)
+CREATE TABLE IF NOT EXISTS deliveries (
+    key TEXT PRIMARY KEY,
+    lead_id INTEGER NOT NULL REFERENCES leads (id),
+    channel VARCHAR(50) NOT NULL,
+    state VARCHAR(20) NOT NULL,
+    attempted_at TIMESTAMP,
+    delivered_at TIMESTAMP,
+    message_id TEXT,
+    error TEXT
+);
+
+-- Idempotency keys of finished queue jobs, shared by every worker task (see src/jobqueue.py)
+CREATE TABLE IF NOT EXISTS processed_jobs (
+    key TEXT PRIMARY KEY,
+    finished_at TIMESTAMP NOT NULL
+);
+
+-- Materialized funnel counters read by the dashboard (see LeadStore.count_by_status):
+-- 'status:<status>' and 'reply:<category>' for replied leads. LeadStore backfills them when empty.
+CREATE TABLE IF NOT EXISTS lead_stats (
+    key TEXT PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+
+-- Counter changes appended by lead writes (no shared rows to lock), folded into lead_stats by readers.
+CREATE TABLE IF NOT EXISTS lead_stat_deltas (
+    key TEXT NOT NULL,
+    delta INTEGER NOT NULL
+);
+
+-- Advanced once per statement that writes leads (see LeadStore.version).
+CREATE SEQUENCE IF NOT EXISTS lead_version;
+
+CREATE OR REPLACE FUNCTION bump_lead_stat(stat_key TEXT, delta INTEGER) RETURNS VOID AS $$
+    INSERT INTO lead_stat_deltas (key, delta) VALUES (stat_key, delta);
+$$ LANGUAGE SQL;
+
+CREATE OR REPLACE FUNCTION update_lead_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND (TG_OP = 'DELETE' OR OLD.status IS DISTINCT FROM NEW.status
+            OR OLD.reply_category IS DISTINCT FROM NEW.reply_category) THEN
+        PERFORM bump_lead_stat('status:' || OLD.status, -1);
+        IF OLD.status = 'replied' THEN
+            PERFORM bump_lead_stat('reply:' || COALESCE(OLD.reply_category, ''), -1);
+        END IF;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND (OLD.status IS DISTINCT FROM NEW.status
+            OR OLD.reply_category IS DISTINCT FROM NEW.reply_category)) THEN
+        PERFORM bump_lead_stat('status:' || NEW.status, 1);
+        IF NEW.status = 'replied' THEN
+            PERFORM bump_lead_stat('reply:' || COALESCE(NEW.reply_category, ''), 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_lead_version() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM nextval('lead_version');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'leads'::regclass AND tgname = 'leads_stats') THEN
+        CREATE TRIGGER leads_stats AFTER INSERT OR UPDATE OR DELETE ON leads
+            FOR EACH ROW EXECUTE FUNCTION update_lead_stats();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'leads'::regclass AND tgname = 'leads_version') THEN
+        CREATE TRIGGER leads_version AFTER INSERT OR UPDATE OR DELETE ON leads
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_lead_version();
+    END IF;
+END;
+$$;
@@ -0,0 +1,68 @@
+"""networking-agent: one entry point for every pipeline stage.
+
+    networking-agent scrape [SEARCH_URL ...]   # lead_gen.py
+    networking-agent enrich                    # Apollo lookups for stored leads without an email
+    networking-agent personalize [--worker]    # personalize.py
+    networking-agent review                    # streamlit run review_ui.py
+    networking-agent send [--worker]           # sender.py
+    networking-agent triage [--worker]         # inbox_listener.py
+    networking-agent dashboard                 # streamlit run dashboard.py
+
+Arguments after the subcommand go to that stage (``networking-agent send
+--help`` lists them). This module imports nothing but the standard library:
+each subcommand imports its stage module, and with it pandas, Playwright,
+openai or the Google clients, only once it runs, so ``--help`` and runs with
+nothing to do start quickly.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+def _stage(module, *fixed_args):
+    def run(argv):
+        return importlib.import_module(module).main([*fixed_args, *argv])
+    return run
+
+def _streamlit(script):
+    def run(argv):
+        # Replace this process, so Streamlit owns the terminal and its signals.
+        os.execv(sys.executable, streamlit_command(script, argv))
+    return run
+
+def streamlit_command(script, argv):
+    """The ``python -m streamlit run`` command line serving ``script`` from src/, with extra Streamlit options."""
+    return [sys.executable, "-m", "streamlit", "run", os.path.join(SRC, script), *argv]
+
+# name: (help, runner)
+COMMANDS = {
+    "scrape": ("scrape LinkedIn searches, de-dup and enrich the new leads", _stage("lead_gen")),
+    "enrich": ("look up emails for stored new leads that have none", _stage("lead_gen", "--enrich-only")),
+    "personalize": ("draft messages for new leads (or --enqueue / --worker)", _stage("personalize")),
+    "review": ("open the draft review UI", _streamlit("review_ui.py")),
+    "send": ("send approved drafts (or --enqueue / --worker)", _stage("sender")),
+    "triage": ("triage new Gmail replies (or --enqueue / --worker)", _stage("inbox_listener")),
+    "dashboard": ("open the campaign dashboard", _streamlit("dashboard.py")),
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="networking-agent", description="Run a stage of the networking agent.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND", required=True)
+    for name, (help_text, _) in COMMANDS.items():
+        commands.add_parser(name, help=help_text, add_help=False)
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS:
+        build_parser().parse_args(argv) # prints help, or the usage error, and exits
+    command, stage_args = argv[0], argv[1:]
+    if SRC not in sys.path:
+        sys.path.insert(0, SRC) # the stage modules import each other as top-level modules
+    sys.argv[0] = f"networking-agent {command}" # so the stage's --help and usage errors name the subcommand
+    return COMMANDS[command][1](stage_args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,62 +1,146 @@
-import streamlit as st
-import pandas as pd
 import os
-
-# --- File Paths ---
-LEADS_FILE = "leads_with_drafts.csv"
-OUTBOX_FILE = "outbox.csv"
-SENT_FILE = "sent.csv"
-# A file to track replies would be needed for a complete funnel
-# REPLIES_FILE = "replies.csv" 
+import time
+import streamlit as st
+import metrics
+from storage import LeadStore, STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED, STATUS_SENT, STATUS_REPLIED, STATUS_BOUNCED
+from triage import INTERESTED
 
 st.set_page_config(layout="wide")
 st.title("Networking Funnel Dashboard")
 
 # --- Load Data ---
-def load_df(file_path):
-    if os.path.exists(file_path):
-        return pd.read_csv(file_path)
-    return pd.DataFrame()
+@st.cache_resource
+def get_store():
+    """One read connection shared across Streamlit reruns (WAL lets it read while workers write)."""
+    return LeadStore()
+
+@st.cache_data(show_spinner=False)
+def funnel_counts(version):
+    """Status and reply-category counts from the store's materialized counters, cached per store version."""
+    return get_store().count_by_status(), get_store().count_by_reply_category()
 
-leads_df = load_df(LEADS_FILE)
-outbox_df = load_df(OUTBOX_FILE)
-sent_df = load_df(SENT_FILE)
-# replies_df = load_df(REPLIES_FILE) # Placeholder for reply tracking
+store = get_store()
+version = store.version() # changes on every lead write, so cached reads stay valid until a stage writes
+status_counts, reply_counts = funnel_counts(version)
 
 # --- Calculate Funnel Metrics ---
-total_leads = len(leads_df)
-messages_drafted = len(leads_df[leads_df['draft_msg'].notna()])
-messages_approved = len(outbox_df) + len(sent_df) # Approved are in outbox or already sent
-messages_sent = len(sent_df)
+total_leads = sum(status_counts.values())
+sent_statuses = (STATUS_SENT, STATUS_REPLIED, STATUS_BOUNCED)
+messages_drafted = sum(status_counts.get(s, 0) for s in (STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED) + sent_statuses)
+messages_approved = status_counts.get(STATUS_APPROVED, 0) + sum(status_counts.get(s, 0) for s in sent_statuses) # Approved are in outbox or already sent
+messages_sent = sum(status_counts.get(s, 0) for s in sent_statuses)
 
-# For replied and call booked, we'd need more data.
-# These are placeholders to illustrate the concept.
-# In a real scenario, this would come from the inbox listener and calendar integration.
-replied = 0 # len(replies_df)
-call_booked = 0 # len(replies_df[replies_df['status'] == 'call_booked'])
+# Replies are linked to leads by the inbox listener (see reply_index.py).
+replied = status_counts.get(STATUS_REPLIED, 0)
+interested = reply_counts.get(INTERESTED, 0)
+# Call booked would need a calendar integration.
 
 # --- Display Funnel ---
 st.header("Outreach Funnel")
 
-col1, col2, col3, col4 = st.columns(4)
+col1, col2, col3, col4, col5, col6 = st.columns(6)
 col1.metric("Total Leads", f"{total_leads}")
 col2.metric("Messages Drafted", f"{messages_drafted}")
 col3.metric("Messages Approved", f"{messages_approved}")
 col4.metric("Messages Sent", f"{messages_sent}")
+col5.metric("Replies", f"{replied}")
+col6.metric("Interested", f"{interested}")
 
 # --- Conversion Rates ---
 st.header("Conversion Rates")
 draft_rate = (messages_drafted / total_leads * 100) if total_leads > 0 else 0
 approval_rate = (messages_approved / messages_drafted * 100) if messages_drafted > 0 else 0
 sent_rate = (messages_sent / messages_approved * 100) if messages_approved > 0 else 0
-# reply_rate = (replied / messages_sent * 100) if messages_sent > 0 else 0
+reply_rate = (replied / messages_sent * 100) if messages_sent > 0 else 0
+interested_rate = (interested / replied * 100) if replied > 0 else 0
 
-col1, col2, col3 = st.columns(3)
+col1, col2, col3, col4, col5 = st.columns(5)
 col1.metric("Draft Rate", f"{draft_rate:.2f}%")
 col2.metric("Approval Rate", f"{approval_rate:.2f}%")
 col3.metric("Sent Rate", f"{sent_rate:.2f}%")
+col4.metric("Reply Rate", f"{reply_rate:.2f}%")
+col5.metric("Interested Rate", f"{interested_rate:.2f}%")
+
+if reply_counts:
+    st.header("Replies by Category")
+    st.bar_chart({category or "uncategorized": count for category, count in reply_counts.items()})
+
+# --- Pipeline Telemetry ---
+def metrics_mtime():
+    """Last write to the metrics file (WAL writes land in the -wal file until a checkpoint)."""
+    paths = [metrics.METRICS_FILE, metrics.METRICS_FILE + "-wal"] if metrics.METRICS_FILE else []
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0)
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_metric_events(since, mtime):
+    return metrics.load_events(metrics.METRICS_FILE, since=since)
+
+st.header("Pipeline Telemetry")
+windows = {"Last 24 hours": 1, "Last 7 days": 7, "Last 30 days": 30, "All time": None}
+window = st.selectbox("Window", list(windows), index=1)
+days = windows[window]
+# Rounded to the minute so reruns within the cache TTL reuse the same query.
+since = int(time.time() // 60 * 60 - days * 86400) if days else 0
+events = load_metric_events(since, metrics_mtime())
+
+if events.empty:
+    st.info(f"No metrics recorded yet. Worker runs write them to `{metrics.METRICS_FILE}`.")
+else:
+    spend = metrics.spend_by_stage(events)
+    summary = metrics.summarize(events)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("External Calls", f"{int(summary['calls'].sum())}")
+    col2.metric("Error Rate", f"{(summary['error_rate'] * summary['calls']).sum() / max(summary['calls'].sum(), 1) * 100:.2f}%")
+    col3.metric("OpenAI Tokens", f"{int(spend['prompt_tokens'].sum() + spend['completion_tokens'].sum())}")
+    col4.metric("OpenAI Spend", f"${spend['spend_usd'].sum():.2f}")
+
+    st.subheader("Latency, Throughput and Errors per Stage")
+    st.dataframe(summary.rename(columns={"per_sec": "calls_per_sec"}).style.format(
+        {"error_rate": "{:.1%}", "p50_ms": "{:.0f}", "p95_ms": "{:.0f}", "calls_per_sec": "{:.2f}"}
+    ))
+    if not spend.empty:
+        st.subheader("OpenAI Spend per Stage")
+        st.dataframe(spend.style.format({"spend_usd": "${:.4f}"}))
+
+    series = metrics.timeseries(events, freq="1h" if days and days <= 7 else "1D")
+    st.subheader("p95 Latency over Time (ms)")
+    st.line_chart(series.pivot_table(index="time", columns="stage", values="p95_ms"))
+    st.subheader("Calls and Errors over Time")
+    st.bar_chart(series.groupby("time")[["calls", "errors"]].sum())
+    if series["spend_usd"].sum() > 0:
+        st.subheader("OpenAI Spend over Time ($)")
+        st.bar_chart(series.pivot_table(index="time", columns="stage", values="spend_usd", aggfunc="sum"))
 
 
 # --- Detailed View ---
+LEAD_TABLE_COLUMNS = ["full_name", "company", "headline", "school", "email", "status", "reply_category", "last_contact"]
+PAGE_SIZES = [25, 50, 100, 500]
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def lead_count(version, statuses, search, reply_category):
+    return get_store().count_leads(status=statuses or None, search=search, reply_category=reply_category)
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def lead_page(version, statuses, search, reply_category, page_size, page):
+    """One page of the lead table: only the displayed columns and rows are read from the store."""
+    return get_store().leads(
+        status=statuses or None, columns=LEAD_TABLE_COLUMNS, search=search, reply_category=reply_category,
+        limit=page_size, offset=(page - 1) * page_size, newest_first=True,
+    )
+
 st.header("Lead Status Overview")
-st.dataframe(leads_df)
+col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+statuses = tuple(col1.multiselect("Status", sorted(status_counts)))
+search = col2.text_input("Search name, company, headline, school or email").strip()
+categories = ["All"] + sorted(category for category in reply_counts if category)
+reply_category = col3.selectbox("Reply category", categories)
+page_size = col4.selectbox("Rows per page", PAGE_SIZES, index=1)
+reply_category = None if reply_category == "All" else reply_category
+
+matching = lead_count(version, statuses, search, reply_category)
+pages = max(1, -(-matching // page_size))
+page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1)
+leads_page = lead_page(version, statuses, search, reply_category, page_size, int(page))
+first = (int(page) - 1) * page_size
+st.caption(f"Showing {first + 1 if matching else 0}-{first + len(leads_page)} of {matching} leads (newest first)")
+st.dataframe(leads_page, hide_index=True, width="stretch")
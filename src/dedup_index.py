@@ -0,0 +1,166 @@
+import re
+import sqlite3
+import unicodedata
+from urllib.parse import unquote, urlsplit
+
+import pandas as pd
+
+LINKEDIN_PROFILE_PATH = re.compile(r"/(?:mwlite/)?(in|pub)/([^/?#]+)")
+HEADLINE_COMPANY = re.compile(r"\b(?:at|@)\s+(.+)$", re.IGNORECASE)
+CREDENTIALS_SUFFIX = re.compile(r",.*$")
+
+def normalize_profile_url(url):
+    """Maps LinkedIn profile URL variants to one key, e.g. ``in/jane-doe-123``.
+
+    Scheme, subdomain (``www.``, ``m.``, country codes), the mobile ``/mwlite``
+    prefix, query string, fragment, trailing slash and case are all ignored.
+    Non-LinkedIn URLs fall back to a lowercased host + path.
+    """
+    if url is None or pd.isna(url):
+        return ""
+    url = str(url).strip()
+    if not url:
+        return ""
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    path = unquote(parts.path).lower()
+    match = LINKEDIN_PROFILE_PATH.search(path)
+    if match and parts.netloc.lower().endswith("linkedin.com"):
+        return f"{match.group(1)}/{match.group(2)}"
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host + path.rstrip("/")
+
+def normalize_text(value):
+    """Lowercase ASCII words only: accents, punctuation and extra whitespace removed."""
+    if value is None or pd.isna(value):
+        return ""
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", value.lower()).split())
+
+def normalize_name(full_name):
+    """Normalized name without trailing credentials ("Jane Doe, PhD" -> "jane doe")."""
+    if full_name is None or pd.isna(full_name):
+        return ""
+    return normalize_text(CREDENTIALS_SUFFIX.sub("", str(full_name)))
+
+def same_first_name(name, other):
+    """True when two normalized names share a first name, or one gives only its initial ("j smith", "john smith")."""
+    first, other_first = name.split(" ", 1)[0], other.split(" ", 1)[0]
+    if first == other_first:
+        return True
+    return min(len(first), len(other_first)) == 1 and first[0] == other_first[0]
+
+def lead_company(lead):
+    """The lead's company, falling back to the "... at Company" part of the headline."""
+    company = normalize_text(lead.get('company'))
+    if company:
+        return company
+    headline = lead.get('headline')
+    if headline is None or pd.isna(headline):
+        return ""
+    match = HEADLINE_COMPANY.search(str(headline))
+    return normalize_text(match.group(1)) if match else ""
+
+class LeadIndex:
+    """Persistent index of every lead seen so far, for O(batch) de-duplication.
+
+    A lead is a duplicate if its normalized profile URL is already indexed.
+    Failing that, it is a duplicate of an indexed person with the identical
+    full name at the same company (the same person scraped under another
+    URL). When one of the two has no profile URL, a matching first name (or
+    initial) at the same company also counts, as does the identical full name
+    at the same school with no conflicting company. Two different URLs are
+    never merged on a fuzzy match, and a shared school alone never merges two
+    people.
+    Blocking on (last name, company) and (last name, school) keeps name
+    comparisons to a handful of candidates per lead instead of the whole
+    history.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS people ("
+            " url_key TEXT, name TEXT NOT NULL, last TEXT NOT NULL, company TEXT NOT NULL, school TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS people_url ON people (url_key) WHERE url_key != ''")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS people_company ON people (last, company) WHERE company != ''")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS people_school ON people (last, school) WHERE school != ''")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM people").fetchone()[0]
+
+    @staticmethod
+    def _record(lead):
+        name = normalize_name(lead.get('full_name'))
+        return (
+            normalize_profile_url(lead.get('profile_url')),
+            name,
+            name.rsplit(" ", 1)[-1] if name else "",
+            lead_company(lead),
+            normalize_text(lead.get('school')),
+        )
+
+    def _find(self, record):
+        url_key, name, last, company, school = record
+        if url_key and self.conn.execute(
+            "SELECT 1 FROM people WHERE url_key = ? AND url_key != ''", (url_key,)
+        ).fetchone():
+            return url_key
+        if not last or not (company or school):
+            return None
+        candidates = self.conn.execute(
+            "SELECT url_key, name, company FROM people WHERE last = ? AND company = ? AND company != ''"
+            " UNION ALL "
+            "SELECT url_key, name, company FROM people WHERE last = ? AND school = ? AND school != ''",
+            (last, company, last, school),
+        ).fetchall()
+        for candidate_url, candidate_name, candidate_company in candidates:
+            if url_key and candidate_url:
+                # Both have profile URLs, and they differ: only the exact same name at the same company is
+                # the same person (re-scraped under another URL), never a fuzzy first-name or school match.
+                if company and candidate_company == company and candidate_name == name:
+                    return candidate_url
+                continue
+            if company and candidate_company == company:
+                if same_first_name(name, candidate_name):
+                    return candidate_url or candidate_name
+            elif candidate_name == name and not (company and candidate_company):
+                return candidate_url or candidate_name
+        return None
+
+    def match(self, lead):
+        """Returns the key of the indexed lead this one duplicates, or None."""
+        return self._find(self._record(lead))
+
+    def add_many(self, df):
+        """Bulk-loads leads without checking for duplicates (e.g. seeding from an existing leads.csv)."""
+        records = [self._record(row) for row in df.to_dict('records')]
+        self.conn.executemany("INSERT OR IGNORE INTO people VALUES (?, ?, ?, ?, ?)", records)
+        self.conn.commit()
+
+    def filter_new(self, df):
+        """Returns the rows of ``df`` not already indexed (or repeated earlier in ``df``) and indexes them."""
+        keep = []
+        for position, lead in enumerate(df.to_dict('records')):
+            record = self._record(lead)
+            if self._find(record) is None:
+                self.conn.execute("INSERT OR IGNORE INTO people VALUES (?, ?, ?, ?, ?)", record)
+                keep.append(position)
+        self.conn.commit()
+        return df.iloc[keep]
+
+    def close(self):
+        self.conn.close()
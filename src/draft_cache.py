@@ -0,0 +1,84 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+class DraftCache:
+    """Disk-backed cache of generated drafts, keyed by the exact request sent to the model.
+
+    The key is a SHA-256 of the model name and the rendered chat messages
+    (system prompt + user prompt), so a lead only misses the cache when
+    something that would change its draft has changed. Entries older than
+    ``max_age_days`` are dropped, and the least recently used entries are
+    evicted once the cache holds more than ``max_entries``.
+    """
+
+    def __init__(self, path, max_entries=100000, max_age_days=30, evict_every=500):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS drafts ("
+            " key TEXT PRIMARY KEY, draft TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS drafts_accessed ON drafts (accessed)")
+        self.conn.commit()
+        self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @staticmethod
+    def key(messages, model):
+        payload = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT draft, created FROM drafts WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.max_age and now - row[1] > self.max_age):
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE drafts SET accessed = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, draft):
+        """Stores a draft and commits immediately, so it survives a crash mid-run."""
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO drafts (key, draft, created, accessed) VALUES (?, ?, ?, ?)",
+            (key, draft, now, now),
+        )
+        self.conn.commit()
+        self._puts += 1
+        if self.evict_every and self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries, then the least recently used ones beyond ``max_entries``."""
+        if self.max_age:
+            self.conn.execute("DELETE FROM drafts WHERE created < ?", (time.time() - self.max_age,))
+        if self.max_entries:
+            self.conn.execute(
+                "DELETE FROM drafts WHERE key IN ("
+                " SELECT key FROM drafts ORDER BY accessed DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM drafts").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -1,15 +1,20 @@
 import os
+import argparse
 import base64
-import pandas as pd
+import sqlite3
+from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-import openai
+import metrics
+from triage import ReplyTriage, TriageCache, TRIAGE_CACHE_FILE, AUTO_REPLY, BOUNCE, ERROR
+from jobqueue import EnqueueError, open_queue, run_worker, worker_arguments
 
 # --- Scopes and Setup ---
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 TOKEN_PICKLE = 'token.pickle'
 CREDENTIALS_FILE = 'credentials.json' # Download from Google Cloud Console
+SYNC_STATE_FILE = os.getenv("GMAIL_SYNC_STATE_FILE", "gmail_sync.sqlite")
+GMAIL_BATCH_SIZE = 50 # Gmail allows up to 100 calls per batch, but recommends staying under 50
 
 def get_gmail_service():
     """Authenticates with Google and returns a Gmail service object."""
@@ -21,6 +26,7 @@ def get_gmail_service():
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
             creds = flow.run_local_server(port=0)
         
@@ -39,65 +45,292 @@ def get_message_details(service, msg_id):
     """Gets the full details of a message."""
     return service.users().messages().get(userId='me', id=msg_id).execute()
 
-def triage_reply(message_body):
-    """Uses GPT to categorize a reply."""
-    prompt = f"""
-    Categorize this email reply as: 1=interested, 2=busy, 3=decline, 4=needs-follow-up.
-    The email is:
-    ---
-    {message_body}
-    ---
-    Category:
+class GmailSyncState:
+    """Remembers the last synced Gmail historyId and every message already triaged."""
+
+    def __init__(self, path=SYNC_STATE_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS processed (message_id TEXT PRIMARY KEY)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def history_id(self):
+        row = self.conn.execute("SELECT value FROM sync_state WHERE key = 'history_id'").fetchone()
+        return row[0] if row else None
+
+    @history_id.setter
+    def history_id(self, value):
+        self.conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('history_id', ?)", (str(value),))
+        self.conn.commit()
+
+    def is_processed(self, message_id):
+        return self.conn.execute("SELECT 1 FROM processed WHERE message_id = ?", (message_id,)).fetchone() is not None
+
+    def mark_processed(self, message_id):
+        self.conn.execute("INSERT OR IGNORE INTO processed (message_id) VALUES (?)", (message_id,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+def list_unread_message_ids(service):
+    """Lists the ids of every unread message, following pagination."""
+    message_ids = []
+    request = service.users().messages().list(userId='me', q='is:unread')
+    while request is not None:
+        with metrics.timer("inbox_listener", "gmail_list"):
+            results = request.execute()
+        message_ids.extend(m['id'] for m in results.get('messages', []))
+        request = service.users().messages().list_next(request, results)
+    return message_ids
+
+def list_new_message_ids(service, start_history_id):
+    """Returns ``(message_ids, history_id)`` for inbox messages added since ``start_history_id``.
+
+    Returns ``(None, None)`` if Gmail no longer has history that far back,
+    in which case the caller should fall back to a full sync.
+    """
+    message_ids = []
+    history_id = start_history_id
+    request = service.users().history().list(
+        userId='me', startHistoryId=start_history_id, historyTypes=['messageAdded'], labelId='INBOX'
+    )
+    while request is not None:
+        try:
+            with metrics.timer("inbox_listener", "gmail_history"):
+                results = request.execute()
+        except Exception as e:
+            if getattr(getattr(e, 'resp', None), 'status', None) == 404:
+                return None, None
+            raise
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                if added['message']['id'] not in message_ids:
+                    message_ids.append(added['message']['id'])
+        history_id = results.get('historyId', history_id)
+        request = service.users().history().list_next(request, results)
+    return message_ids, history_id
+
+def get_messages_batched(service, message_ids, batch_size=GMAIL_BATCH_SIZE):
+    """Fetches full messages with batched HTTP requests instead of one round-trip each."""
+    messages = {}
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            print(f"Could not fetch message {request_id}: {exception}")
+            metrics.count("inbox_listener", "fetch_errors")
+            metrics.error("inbox_listener", "gmail_get", exception)
+        else:
+            messages[request_id] = response
+
+    for start in range(0, len(message_ids), batch_size):
+        batch = service.new_batch_http_request(callback=collect)
+        for msg_id in message_ids[start:start + batch_size]:
+            batch.add(service.users().messages().get(userId='me', id=msg_id), request_id=msg_id)
+        with metrics.timer("inbox_listener", "gmail_batch"):
+            batch.execute()
+    return [messages[msg_id] for msg_id in message_ids if msg_id in messages]
+
+def fetch_new_message_ids(service, state):
+    """Returns ``(message_ids, history_id)``: ids of messages not yet triaged, and the historyId to save once they are.
+
+    The first run (no saved historyId) does a full sync of unread mail; later
+    runs ask the history endpoint only for what arrived since the last sync.
+    """
+    message_ids = None
+    history_id = None
+    if state.history_id:
+        message_ids, history_id = list_new_message_ids(service, state.history_id)
+        if message_ids is None:
+            print("Saved Gmail historyId has expired; doing a full sync.")
+    if message_ids is None:
+        with metrics.timer("inbox_listener", "gmail_profile"):
+            history_id = service.users().getProfile(userId='me').execute()['historyId']
+        message_ids = list_unread_message_ids(service)
+    return [msg_id for msg_id in message_ids if not state.is_processed(msg_id)], history_id
+
+def fetch_new_messages(service, state):
+    """Returns ``(messages, history_id)``: messages not yet triaged, and the historyId to save after triage."""
+    message_ids, history_id = fetch_new_message_ids(service, state)
+    messages = get_messages_batched(service, message_ids)
+    if len(messages) < len(message_ids):
+        # Don't move the sync point past messages we failed to fetch; they'll be retried next run.
+        history_id = state.history_id
+    return messages, history_id
+
+def message_headers(msg_details):
+    """The message's headers as a ``{name: value}`` dict."""
+    return {h['name']: h['value'] for h in msg_details['payload'].get('headers', [])}
+
+def parse_message(msg_details):
+    """Returns ``(sender, body)`` from a full Gmail message resource."""
+    payload = msg_details['payload']
+    sender = next(h['value'] for h in payload['headers'] if h['name'] == 'From')
+
+    if 'parts' in payload:
+        body_data = payload['parts'][0]['body']['data']
+    else:
+        body_data = payload['body']['data']
+
+    return sender, base64.urlsafe_b64decode(body_data).decode('utf-8')
+
+def parse_replies(messages):
+    """``[(msg_details, (sender, body), headers), ...]`` for the messages that parse, and the ids of those that don't.
+
+    A message that can't be parsed (e.g. an unexpected multipart layout) is
+    logged and skipped, so it can't abort the rest of the run.
     """
+    replies, failed = [], []
+    for msg in messages:
+        try:
+            replies.append((msg, parse_message(msg), message_headers(msg)))
+        except Exception as e:
+            print(f"Could not parse message {msg.get('id')}: {e!r}")
+            metrics.error("inbox_listener", "parse_message", e)
+            failed.append(msg.get('id'))
+    return replies, failed
+
+def record_reply(store, reply_index, msg_details, category):
+    """Links a triaged reply to its lead and writes the outcome back. Returns the lead id or None.
+
+    Bounces mark the lead bounced; auto-replies and failed triage leave it as is.
+    """
+    from storage import STATUS_REPLIED, STATUS_BOUNCED, now_iso
+    headers = {name.lower(): value for name, value in message_headers(msg_details).items()}
+    lead_id = reply_index.match(
+        headers.get('from', ''), thread_id=msg_details.get('threadId'),
+        in_reply_to=headers.get('in-reply-to'), references=headers.get('references'),
+    )
+    if lead_id is None or category in (AUTO_REPLY, ERROR):
+        return lead_id
+    if category == BOUNCE:
+        store.set_status(lead_id, STATUS_BOUNCED)
+    else:
+        store.set_status(lead_id, STATUS_REPLIED, reply_category=category, replied_at=now_iso())
+    return lead_id
+
+def triage_reply(message_body, headers=None):
+    """Categorizes a reply, only asking GPT when the local classifier isn't confident."""
+    return ReplyTriage().triage(message_body, headers)
+
+def triage_messages(store, state, triage, messages):
+    """Triages fetched replies and records them, marking each finished message processed in ``state``.
+
+    Replies whose triage failed stay unprocessed so a later run retries them;
+    unparseable messages are marked processed, as they would fail every run.
+    Returns ``(replies, matched, failed)`` counts.
+    """
+    from reply_index import ReplyIndex
+    reply_index = ReplyIndex(store)
+    replies, unparsed = parse_replies(messages)
+    for msg_id in unparsed:
+        state.mark_processed(msg_id)
+    categories = triage.triage_many([(body, headers) for _, (_, body), headers in replies])
+    matched = failed = 0
+    for (msg_details, (sender, _), _), category in zip(replies, categories):
+        lead_id = record_reply(store, reply_index, msg_details, category)
+        matched += lead_id is not None
+        print(f"New reply from: {sender} (lead {lead_id if lead_id is not None else 'unknown'})")
+        print(f"Triage category: {category}")
+        if category == ERROR:
+            failed += 1
+        else:
+            state.mark_processed(msg_details['id'])
+    return len(replies), matched, failed
+
+JOB_QUEUE = "triage"
+
+def enqueue_new_messages(service, state, queue):
+    """Queues one triage job per new message and advances the sync point. Returns how many were queued.
+
+    If the queue rejected any job, the sync point stays put so the next run lists those messages again.
+    """
+    message_ids, history_id = fetch_new_message_ids(service, state)
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"Error triaging reply: {e}")
-        return "Error"
+        queued = queue.send(JOB_QUEUE, [(f"reply:{msg_id}", {"message_id": msg_id}) for msg_id in message_ids])
+    except EnqueueError as e:
+        print(f"{e}; they will be queued again next run.")
+        return e.sent
+    if history_id:
+        state.history_id = history_id
+    return queued
 
-if __name__ == "__main__":
+def triage_job_handler(service, store, triage):
+    """Worker handler for a batch of ``{"message_id"}`` jobs: fetches, triages and records the replies.
+
+    Messages Gmail could not return, and replies whose triage failed, are
+    reported as failed so the job is retried. The reply index is loaded per
+    batch, so replies to messages sent since the worker started are matched.
+    """
+    from reply_index import ReplyIndex
+
+    def handle(bodies):
+        reply_index = ReplyIndex(store)
+        message_ids = [body["message_id"] for body in bodies]
+        messages = get_messages_batched(service, message_ids)
+        replies, unparsed = parse_replies(messages)
+        categories = triage.triage_many([(body, headers) for _, (_, body), headers in replies])
+        for (msg_details, (sender, _), _), category in zip(replies, categories):
+            lead_id = record_reply(store, reply_index, msg_details, category)
+            print(f"New reply from: {sender} (lead {lead_id if lead_id is not None else 'unknown'}): {category}")
+        metrics.count("inbox_listener", "replies", len(replies))
+        outcomes = {msg['id']: "triage failed" if category == ERROR else None for (msg, _, _), category in zip(replies, categories)}
+        outcomes.update((msg_id, "could not parse message") for msg_id in unparsed)
+        return [outcomes[msg_id] if msg_id in outcomes else "could not fetch message" for msg_id in message_ids]
+    return handle
+
+def main(argv=None):
     # This script requires user interaction for the first run to authenticate.
     # You need a credentials.json file from the Google Cloud Console.
-    
+    args = worker_arguments(argparse.ArgumentParser(description="Triage new Gmail replies.")).parse_args(argv)
+
     if not os.path.exists(CREDENTIALS_FILE):
         print("Error: credentials.json not found. Please download it from the Google Cloud Console.")
+    elif args.enqueue:
+        with GmailSyncState() as state, open_queue() as queue:
+            print(f"Queued {enqueue_new_messages(get_gmail_service(), state, queue)} triage jobs.")
+    elif args.worker:
+        from storage import LeadStore
+        with LeadStore() as store, open_queue() as queue, TriageCache(TRIAGE_CACHE_FILE) as cache:
+            triage = ReplyTriage(cache=cache)
+            run_worker(queue, JOB_QUEUE, triage_job_handler(get_gmail_service(), store, triage), store, args)
+            print(triage.format_report())
     else:
         service = get_gmail_service()
-        unread_messages = list_unread_messages(service)
 
-        if not unread_messages:
-            print("No unread messages.")
-        else:
-            leads_df = pd.read_csv('sent.csv') # Assuming we check replies for sent messages
-
-            for msg in unread_messages:
-                msg_details = get_message_details(service, msg['id'])
-                payload = msg_details['payload']
-                
-                # Extract sender and body
-                sender = next(h['value'] for h in payload['headers'] if h['name'] == 'From')
-                
-                if 'parts' in payload:
-                    body_data = payload['parts'][0]['body']['data']
-                else:
-                    body_data = payload['body']['data']
-                
-                body = base64.urlsafe_b64decode(body_data).decode('utf-8')
-
-                print(f"New reply from: {sender}")
-                
-                # Triage the reply
-                category = triage_reply(body)
-                print(f"Triage category: {category}")
-
-                # Here you would update your database/CRM
-                # For now, we'll just print the result
-                # Example: Find the lead by email and update their status
-                # leads_df.loc[leads_df['email'] == sender_email, 'status'] = category
-                
-            # leads_df.to_csv('leads_updated.csv', index=False)
-            print("Finished processing replies.")
+        with GmailSyncState() as state:
+            new_messages, history_id = fetch_new_messages(service, state)
+
+            if not new_messages:
+                print("No new messages.")
+            else:
+                # The lead store (and pandas with it) is only loaded when there is something to record.
+                from storage import LeadStore
+                with LeadStore() as store, TriageCache(TRIAGE_CACHE_FILE) as cache:
+                    triage = ReplyTriage(cache=cache)
+                    replies, matched, failed = triage_messages(store, state, triage, new_messages)
+
+                if failed:
+                    # Keep the sync point before the failed replies so the next run lists them again.
+                    print(f"Triage failed for {failed} replies; they will be retried next run.")
+                    history_id = state.history_id
+                print(f"Matched {matched} of {replies} replies to leads.")
+                metrics.count("inbox_listener", "replies", replies)
+                metrics.count("inbox_listener", "replies_matched", matched)
+                print(triage.format_report())
+                print(metrics.get_metrics().format_report())
+                print("Finished processing replies.")
+
+            # Only advance the sync point once everything up to it has been triaged
+            if history_id:
+                state.history_id = history_id
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+import metrics
+
+load_dotenv()
+
+# --- Queue Location ---
+# A local SQLite file by default (one machine, or tests). An SQS URL prefix such as
+# https://sqs.us-east-1.amazonaws.com/123456789012/networking-agent- uses one SQS queue per job
+# type, named <prefix><queue> (e.g. networking-agent-personalize), with <prefix><queue>-dlq as its dead-letter queue.
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", "jobs.sqlite")
+
+# --- Worker Settings ---
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300")) # seconds a received job is leased to one worker
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5")) # deliveries before a job is dead-lettered
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "10")) # jobs a worker leases and handles at a time
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5")) # idle wait between empty receives (SQS long-polls instead)
+
+SQLITE_JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    key TEXT,
+    body TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    visible_at REAL NOT NULL,
+    receipt TEXT,
+    dead INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (queue, dead, visible_at);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_key ON jobs (queue, key);
+"""
+
+class EnqueueError(Exception):
+    """Raised by ``send`` when the queue rejected some of the jobs; ``sent`` of them were accepted."""
+
+    def __init__(self, message, sent):
+        super().__init__(message)
+        self.sent = sent
+
+class Job:
+    """A leased job: its decoded ``body``, idempotency ``key``, delivery count and the ``receipt`` its lease is held by."""
+
+    def __init__(self, queue, key, body, attempts, receipt):
+        self.queue = queue
+        self.key = key
+        self.body = body
+        self.attempts = attempts
+        self.receipt = receipt
+
+    def __repr__(self):
+        return f"Job({self.queue!r}, key={self.key!r}, attempts={self.attempts})"
+
+class SQLiteJobQueue:
+    """Job queue in a local SQLite file, with the same lease semantics as SQS.
+
+    ``receive`` leases jobs for ``visibility_timeout`` seconds: they are
+    invisible to other workers until acked (deleted), released, or the lease
+    runs out, after which they are delivered again. A job received
+    ``max_attempts`` times without being acked is dead-lettered instead of
+    delivered again. While a job is queued, sending another job with the same
+    key is a no-op. Several processes can share one file; each receive is a
+    single ``BEGIN IMMEDIATE`` transaction, so no job is leased twice at once.
+    """
+
+    def __init__(self, path=JOB_QUEUE_URL, visibility_timeout=JOB_VISIBILITY_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS,
+                 clock=time.time):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SQLITE_JOB_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _update(self, query, params):
+        with self._lock:
+            return self.conn.execute(query, params).rowcount
+
+    def send(self, queue, jobs):
+        """Enqueues ``(key, body)`` pairs (``key`` may be None). Returns how many were new."""
+        now = self.clock()
+        rows = [(queue, key, json.dumps(body), now) for key, body in jobs]
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                cursor.executemany(
+                    "INSERT INTO jobs (queue, key, body, visible_at) VALUES (?, ?, ?, ?) ON CONFLICT (queue, key) DO NOTHING", rows
+                )
+                inserted = cursor.rowcount
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        return max(inserted, 0)
+
+    def receive(self, queue, max_jobs=1, visibility_timeout=None):
+        """Leases up to ``max_jobs`` visible jobs, oldest first."""
+        now = self.clock()
+        lease_until = now + (self.visibility_timeout if visibility_timeout is None else visibility_timeout)
+        jobs = []
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                rows = cursor.execute(
+                    "SELECT id, key, body, attempts FROM jobs WHERE queue = ? AND dead = 0 AND visible_at <= ?"
+                    " ORDER BY visible_at, id LIMIT ?", (queue, now, max_jobs),
+                ).fetchall()
+                for job_id, key, body, attempts in rows:
+                    if attempts >= self.max_attempts:
+                        cursor.execute("UPDATE jobs SET dead = 1, receipt = NULL WHERE id = ?", (job_id,))
+                        continue
+                    receipt = f"{job_id}:{uuid.uuid4().hex}"
+                    cursor.execute("UPDATE jobs SET attempts = attempts + 1, visible_at = ?, receipt = ? WHERE id = ?",
+                                   (lease_until, receipt, job_id))
+                    jobs.append(Job(queue, key, json.loads(body), attempts + 1, receipt))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        return jobs
+
+    def ack(self, job):
+        """Deletes a finished job. Returns False if its lease had expired and another worker holds it now."""
+        return self._update("DELETE FROM jobs WHERE receipt = ?", (job.receipt,)) == 1
+
+    def release(self, job, delay=0, error=None):
+        """Gives up the lease so the job is delivered again after ``delay`` seconds."""
+        return self._update("UPDATE jobs SET visible_at = ?, receipt = NULL, error = ? WHERE receipt = ?",
+                            (self.clock() + delay, error, job.receipt)) == 1
+
+    def extend(self, job, seconds=None):
+        """Keeps holding a job for another ``seconds`` (default: the visibility timeout) from now."""
+        seconds = self.visibility_timeout if seconds is None else seconds
+        return self._update("UPDATE jobs SET visible_at = ? WHERE receipt = ?", (self.clock() + seconds, job.receipt)) == 1
+
+    def counts(self, queue):
+        """``{"visible", "leased", "dead"}`` job counts."""
+        with self._lock:
+            visible, leased, dead = self.conn.execute(
+                "SELECT COALESCE(SUM(dead = 0 AND visible_at <= ?), 0), COALESCE(SUM(dead = 0 AND visible_at > ?), 0),"
+                " COALESCE(SUM(dead), 0) FROM jobs WHERE queue = ?", (self.clock(), self.clock(), queue),
+            ).fetchone()
+        return {"visible": visible, "leased": leased, "dead": dead}
+
+    def dead_letters(self, queue):
+        """The dead-lettered jobs of ``queue`` as ``{"key", "body", "attempts", "error"}`` dicts."""
+        with self._lock:
+            rows = self.conn.execute("SELECT key, body, attempts, error FROM jobs WHERE queue = ? AND dead = 1 ORDER BY id",
+                                     (queue,)).fetchall()
+        return [{"key": key, "body": json.loads(body), "attempts": attempts, "error": error} for key, body, attempts, error in rows]
+
+    def redrive(self, queue):
+        """Puts every dead-lettered job of ``queue`` back, with a fresh attempt count. Returns how many."""
+        return self._update("UPDATE jobs SET dead = 0, attempts = 0, visible_at = ?, receipt = NULL WHERE queue = ? AND dead = 1",
+                            (self.clock(), queue))
+
+class SQSJobQueue:
+    """The same queue interface over Amazon SQS standard queues.
+
+    ``<prefix><queue>`` holds the jobs and ``<prefix><queue>-dlq`` the dead
+    letters. Give the job queue a redrive policy with ``maxReceiveCount`` set
+    to ``max_attempts`` (``infra/cloudformation.yaml`` does); a job seen past
+    that count without one is moved to the DLQ here. Standard queues can
+    deliver a message twice and do not de-duplicate keys on send, so the
+    worker checks every key against the lead store before running it.
+    """
+
+    def __init__(self, prefix_url=JOB_QUEUE_URL, visibility_timeout=JOB_VISIBILITY_TIMEOUT, max_attempts=JOB_MAX_ATTEMPTS,
+                 wait_seconds=10, client=None):
+        self.prefix_url = prefix_url
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.wait_seconds = wait_seconds
+        if client is None:
+            import boto3
+            client = boto3.client("sqs", region_name=prefix_url.split("//", 1)[-1].split(".")[1])
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        pass
+
+    def url(self, queue):
+        return self.prefix_url + queue
+
+    def send(self, queue, jobs):
+        """Enqueues ``(key, body)`` pairs, ten per ``SendMessageBatch`` call. Returns how many were accepted.
+
+        Every batch is tried; if SQS rejected any entry, ``EnqueueError`` is raised at the end.
+        """
+        jobs = list(jobs)
+        sent = 0
+        failed = []
+        for start in range(0, len(jobs), 10):
+            entries = [{"Id": str(n), "MessageBody": json.dumps({"key": key, "body": body})}
+                       for n, (key, body) in enumerate(jobs[start:start + 10])]
+            with metrics.timer("jobs", "sqs_send"):
+                response = self.client.send_message_batch(QueueUrl=self.url(queue), Entries=entries)
+            sent += len(response.get("Successful", []))
+            for failure in response.get("Failed", []):
+                print(f"Could not enqueue {queue} job: {failure.get('Message')}")
+                failed.append(failure)
+        if failed:
+            raise EnqueueError(f"{len(failed)} of {len(jobs)} {queue} jobs could not be enqueued", sent)
+        return sent
+
+    def receive(self, queue, max_jobs=1, visibility_timeout=None):
+        """Leases up to ``max_jobs`` jobs, ten per ``ReceiveMessage`` call; only the first call long-polls."""
+        visibility_timeout = self.visibility_timeout if visibility_timeout is None else visibility_timeout
+        jobs = []
+        while len(jobs) < max_jobs:
+            want = min(10, max_jobs - len(jobs))
+            with metrics.timer("jobs", "sqs_receive"):
+                response = self.client.receive_message(
+                    QueueUrl=self.url(queue), MaxNumberOfMessages=want, VisibilityTimeout=int(visibility_timeout),
+                    WaitTimeSeconds=0 if jobs else self.wait_seconds, MessageSystemAttributeNames=["ApproximateReceiveCount"],
+                )
+            messages = response.get("Messages", [])
+            for message in messages:
+                attempts = int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+                payload = json.loads(message["Body"])
+                if attempts > self.max_attempts:
+                    self.client.send_message(QueueUrl=self.url(f"{queue}-dlq"), MessageBody=message["Body"])
+                    self.client.delete_message(QueueUrl=self.url(queue), ReceiptHandle=message["ReceiptHandle"])
+                    continue
+                jobs.append(Job(queue, payload.get("key"), payload.get("body"), attempts, message["ReceiptHandle"]))
+            if len(messages) < want:
+                break
+        return jobs
+
+    def ack(self, job):
+        self.client.delete_message(QueueUrl=self.url(job.queue), ReceiptHandle=job.receipt)
+        return True
+
+    def release(self, job, delay=0, error=None):
+        self.client.change_message_visibility(QueueUrl=self.url(job.queue), ReceiptHandle=job.receipt,
+                                              VisibilityTimeout=int(delay))
+        return True
+
+    def extend(self, job, seconds=None):
+        seconds = self.visibility_timeout if seconds is None else seconds
+        self.client.change_message_visibility(QueueUrl=self.url(job.queue), ReceiptHandle=job.receipt,
+                                              VisibilityTimeout=int(seconds))
+        return True
+
+    def _attributes(self, queue, names):
+        return self.client.get_queue_attributes(QueueUrl=self.url(queue), AttributeNames=names)["Attributes"]
+
+    def counts(self, queue):
+        """Approximate ``{"visible", "leased", "dead"}`` message counts."""
+        attributes = self._attributes(queue, ["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"])
+        dead = self._attributes(f"{queue}-dlq", ["ApproximateNumberOfMessages"])
+        return {"visible": int(attributes["ApproximateNumberOfMessages"]),
+                "leased": int(attributes["ApproximateNumberOfMessagesNotVisible"]),
+                "dead": int(dead["ApproximateNumberOfMessages"])}
+
+    def redrive(self, queue):
+        """Starts an SQS message move task from the DLQ back to ``queue``. Returns the task handle."""
+        source = self._attributes(f"{queue}-dlq", ["QueueArn"])["QueueArn"]
+        destination = self._attributes(queue, ["QueueArn"])["QueueArn"]
+        return self.client.start_message_move_task(SourceArn=source, DestinationArn=destination)["TaskHandle"]
+
+def open_queue(url=JOB_QUEUE_URL, **kwargs):
+    """The SQS queue set for an ``https://sqs.`` URL prefix, otherwise a SQLite queue file at ``url``."""
+    if url.startswith("https://sqs.") or ".amazonaws.com/" in url:
+        return SQSJobQueue(url, **kwargs)
+    return SQLiteJobQueue(url, **kwargs)
+
+class Worker:
+    """Leases batches of jobs from one queue and runs them, at least once each.
+
+    ``handle(bodies)`` gets the bodies of one batch and returns one error
+    string (or None for success) per body, in order; raising fails the
+    whole batch. Job keys are idempotency keys: with a ``store``, keys its
+    ``processed_jobs`` table already has are acked without running, and a
+    key is recorded there before its job is acked, so a job redelivered
+    after a crash or an expired lease is not run twice once it has
+    finished. Failed jobs are released for a retry after an exponential
+    backoff; the queue dead-letters a job once it has been delivered
+    ``max_attempts`` times. While a batch runs, its leases are extended
+    every third of the visibility timeout so slow batches (e.g. sends
+    waiting for quota) are not handed to another worker.
+
+    Workers share nothing but the queue and the store, so throughput grows
+    with the number of worker processes until an external rate limit or the
+    store is the bottleneck.
+    """
+
+    def __init__(self, queue, name, handle, store=None, batch_size=JOB_BATCH_SIZE, poll_seconds=JOB_POLL_SECONDS,
+                 backoff_base=5.0, backoff_cap=300.0, sleep=time.sleep):
+        self.queue = queue
+        self.name = name
+        self.handle = handle
+        self.store = store
+        self.batch_size = max(1, batch_size)
+        self.poll_seconds = poll_seconds
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.sleep = sleep
+        self.stats = {"received": 0, "done": 0, "skipped": 0, "failed": 0}
+
+    def _heartbeat(self, jobs, finished):
+        interval = max(1.0, self.queue.visibility_timeout / 3)
+        while not finished.wait(interval):
+            for job in jobs:
+                try:
+                    self.queue.extend(job)
+                except Exception as e:
+                    print(f"Could not extend the lease on {job}: {e}")
+
+    def _fail(self, job, error):
+        self.stats["failed"] += 1
+        metrics.count("jobs", f"{self.name}_failed")
+        final = job.attempts >= self.queue.max_attempts
+        print(f"{self.name} job {job.key} failed (attempt {job.attempts}"
+              f"{', dead-lettering' if final else ''}): {error}")
+        self.queue.release(job, delay=min(self.backoff_cap, self.backoff_base * 2 ** (job.attempts - 1)), error=error)
+
+    def run_once(self):
+        """Leases and runs one batch. Returns how many jobs were received."""
+        jobs = self.queue.receive(self.name, max_jobs=self.batch_size)
+        if not jobs:
+            return 0
+        self.stats["received"] += len(jobs)
+        done = self.store.jobs_done([job.key for job in jobs if job.key]) if self.store is not None else set()
+        pending = []
+        for job in jobs:
+            if job.key in done:
+                self.stats["skipped"] += 1
+                self.queue.ack(job)
+            else:
+                pending.append(job)
+        if not pending:
+            return len(jobs)
+
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(pending, finished), daemon=True)
+        heartbeat.start()
+        try:
+            with metrics.timer("jobs", self.name):
+                errors = self.handle([job.body for job in pending])
+        except Exception as e:
+            metrics.error("jobs", self.name, e)
+            errors = [str(e)] * len(pending)
+        finally:
+            finished.set()
+            heartbeat.join()
+
+        succeeded = [job for job, error in zip(pending, errors) if error is None]
+        if self.store is not None:
+            self.store.mark_jobs_done([job.key for job in succeeded if job.key])
+        for job in succeeded:
+            if not self.queue.ack(job):
+                print(f"Lease on {job} expired before it finished; another worker will skip it.")
+        self.stats["done"] += len(succeeded)
+        metrics.count("jobs", f"{self.name}_done", len(succeeded))
+        for job, error in zip(pending, errors):
+            if error is not None:
+                self._fail(job, error)
+        return len(jobs)
+
+    def run(self, stop=None, exit_when_idle=False):
+        """Runs batches until ``stop`` (a threading.Event) is set, or the queue is empty with ``exit_when_idle``."""
+        while stop is None or not stop.is_set():
+            if self.run_once():
+                continue
+            if exit_when_idle:
+                break
+            if isinstance(self.queue, SQLiteJobQueue):
+                self.sleep(self.poll_seconds) # SQS receives already long-poll
+        return self.stats
+
+    def format_report(self):
+        return (f"{self.name} worker: {self.stats['received']} jobs received, {self.stats['done']} done, "
+                f"{self.stats['skipped']} already done, {self.stats['failed']} failed")
+
+def worker_arguments(parser):
+    """Adds the shared ``--enqueue`` / ``--worker`` options to a stage's argument parser."""
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--enqueue", action="store_true", help=f"queue the work as jobs on {JOB_QUEUE_URL} instead of running it")
+    mode.add_argument("--worker", action="store_true", help="run queued jobs until stopped")
+    parser.add_argument("--exit-when-idle", action="store_true", help="with --worker, stop once the queue is empty")
+    parser.add_argument("--batch-size", type=int, default=JOB_BATCH_SIZE, help="jobs leased per batch in worker mode")
+    return parser
+
+def run_worker(queue, name, handle, store, args):
+    """Runs a Worker with the parsed ``worker_arguments`` and prints its report.
+
+    SIGTERM (sent by ECS when a task is stopped or scaled in) and Ctrl-C let
+    the current batch finish before the worker exits.
+    """
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    worker = Worker(queue, name, handle, store=store, batch_size=args.batch_size)
+    worker.run(stop=stop, exit_when_idle=args.exit_when_idle)
+    print(worker.format_report())
+    print(metrics.get_metrics().format_report())
+    return worker.stats
@@ -1,109 +1,432 @@
 import os
+import time
+import argparse
+import random
+import sqlite3
 import pandas as pd
 import requests
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from playwright.sync_api import sync_playwright
+import metrics
+from ratelimit import TokenBucket
+from dedup_index import LeadIndex
+from storage import LeadStore, LEADS_DB, STATUS_NEW, lead_file, load_df
+from linkedin_auth import LINKEDIN_STATE_FILE, ensure_logged_in, saved_state
 
 load_dotenv()
 
 # --- Environment Variables ---
 APOLLO_API_KEY = os.getenv("APOLLO_API_KEY")
-LINKEDIN_EMAIL = os.getenv("LINKEDIN_EMAIL")
-LINKEDIN_PASSWORD = os.getenv("LINKEDIN_PASSWORD")
 
-def load_leads_from_csv(file_path):
-    """Loads leads from a CSV file."""
-    if os.path.exists(file_path):
-        return pd.read_csv(file_path)
-    return pd.DataFrame()
+# --- Apollo Enrichment Settings ---
+APOLLO_API_URL = os.getenv("APOLLO_API_URL", "https://api.apollo.io/v1/people/search")
+APOLLO_WORKERS = int(os.getenv("APOLLO_WORKERS", "4"))
+APOLLO_RPM = int(os.getenv("APOLLO_RPM", "100"))
+APOLLO_CACHE_FILE = os.getenv("APOLLO_CACHE_FILE", "apollo_cache.sqlite")
+APOLLO_CACHE_TTL_DAYS = float(os.getenv("APOLLO_CACHE_TTL_DAYS", "30"))
+APOLLO_NEGATIVE_TTL_DAYS = float(os.getenv("APOLLO_NEGATIVE_TTL_DAYS", "7"))
 
-def scrape_linkedin_search_results(playwright, search_url):
-    """Scrapes LinkedIn search results for public profiles using Playwright."""
-    print(f"Scraping LinkedIn search results from: {search_url}")
-    browser = playwright.chromium.launch(headless=False)
-    context = browser.new_context()
-    page = context.new_page()
+# --- Scraping ---
+LINKEDIN_SEARCH_URL = os.getenv("LINKEDIN_SEARCH_URL", "https://www.linkedin.com/search/results/people/?keywords=Google&schoolFilter=['1014']")
+SCRAPE_TABS = int(os.getenv("SCRAPE_TABS", "3")) # result pages loaded in parallel
+SCRAPE_MAX_PAGES = int(os.getenv("SCRAPE_MAX_PAGES", "10")) # per search URL
+SCRAPE_HEADLESS = os.getenv("SCRAPE_HEADLESS", "true").lower() not in ("0", "false", "no")
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+BLOCKED_URL_PARTS = ("doubleclick.net", "google-analytics.com", "googletagmanager.com", "px.ads.linkedin.com", "/li/track", "bat.bing.com")
+RESULT_SELECTOR = "li.reusable-search__result-container"
+EMPTY_RESULTS_SELECTOR = ".search-reusable-search-no-results, .artdeco-empty-state"
+EXTRACT_RESULTS_JS = """results => results.map(result => {
+    const text = selector => { const el = result.querySelector(selector); return el ? el.innerText.trim() : null; };
+    const link = result.querySelector('a.app-aware-link');
+    return {
+        full_name: text('span[aria-hidden="true"]'),
+        headline: text('div.entity-result__primary-subtitle'),
+        href: link ? link.getAttribute('href') : null,
+    };
+})"""
 
-    try:
-        page.goto("https://www.linkedin.com/login")
-        page.fill('input[name="session_key"]', LINKEDIN_EMAIL)
-        page.fill('input[name="session_password"]', LINKEDIN_PASSWORD)
-        page.click('button[type="submit"]')
-        page.wait_for_load_state('networkidle')
-
-        page.goto(search_url)
-        page.wait_for_load_state('domcontentloaded')
-
-        profiles = page.query_selector_all('li.reusable-search__result-container')
-        leads = []
-        for profile in profiles[:10]:
+# --- De-duplication ---
+LEAD_INDEX_FILE = os.getenv("LEAD_INDEX_FILE", "lead_index.sqlite")
+
+def load_leads_from_csv(file_path, columns=None):
+    """Loads leads from a CSV, Parquet or Feather file (detected from its contents; see ``storage.load_df``)."""
+    return load_df(file_path, columns=columns)
+
+def block_nonessential(route):
+    """Playwright route handler: aborts images, media, fonts, stylesheets and known trackers."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(part in request.url for part in BLOCKED_URL_PARTS):
+        route.abort()
+    else:
+        route.continue_()
+
+def search_page_url(search_url, page_number):
+    """The URL of result page ``page_number`` (1-based) of a LinkedIn search."""
+    parts = urlsplit(search_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != "page"]
+    if page_number > 1:
+        query.append(("page", str(page_number)))
+    return urlunsplit(parts._replace(query=urlencode(query, safe="[]'")))
+
+def leads_from_results(results, base_url="https://www.linkedin.com"):
+    """Builds lead dicts from the ``{full_name, headline, href}`` rows extracted from a result page."""
+    leads = []
+    for result in results:
+        if result.get('full_name') and result.get('headline') and result.get('href'):
+            leads.append({
+                'full_name': result['full_name'],
+                'headline': result['headline'],
+                'profile_url': urljoin(base_url, result['href']),
+                'company': '',
+                'school': '',
+            })
+    return leads
+
+class LinkedInScraper:
+    """Walks LinkedIn search result pages in several tabs of one logged-in browser context.
+
+    The context reuses the cookies saved by earlier runs (logging in only if
+    they are stale) and aborts requests for images, fonts, media, stylesheets
+    and trackers. Each round starts navigations on up to ``tabs`` pages
+    before waiting on any of them, so page loads overlap. Every result on a
+    page is read in one ``eval_on_selector_all`` call; a search stops at its
+    first empty page or after ``max_pages``.
+    """
+
+    def __init__(self, playwright, tabs=SCRAPE_TABS, max_pages=SCRAPE_MAX_PAGES, headless=SCRAPE_HEADLESS,
+                 state_file=LINKEDIN_STATE_FILE, login=True, base_url="https://www.linkedin.com", timeout=15000):
+        self.playwright = playwright
+        self.tabs = max(1, tabs)
+        self.max_pages = max(1, max_pages)
+        self.headless = headless
+        self.state_file = state_file
+        self.login = login
+        self.base_url = base_url
+        self.timeout = timeout
+        self.browser = None
+        self.pages = []
+        self.stats = {"pages": 0, "leads": 0, "empty_pages": 0, "errors": 0}
+
+    def __enter__(self):
+        try:
+            self.open()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        with metrics.timer("lead_gen", "browser_start"):
+            self.browser = self.playwright.chromium.launch(headless=self.headless)
+            context = self.browser.new_context(storage_state=saved_state(self.state_file) if self.login else None)
+            context.route("**/*", block_nonessential)
+            context.set_default_timeout(self.timeout)
+            self.pages = [context.new_page() for _ in range(self.tabs)]
+        if self.login:
+            with metrics.timer("lead_gen", "linkedin_login"):
+                ensure_logged_in(self.pages[0], self.state_file)
+
+    def close(self):
+        if self.browser is not None:
+            self.browser.close()
+            self.browser = None
+        self.pages = []
+
+    def _read_results(self, page):
+        with metrics.timer("lead_gen", "search_read") as timer:
             try:
-                name_element = profile.query_selector('span[aria-hidden="true"]')
-                headline_element = profile.query_selector('div.entity-result__primary-subtitle')
-                url_element = profile.query_selector('a.app-aware-link')
-
-                if name_element and headline_element and url_element:
-                    leads.append({
-                        'full_name': name_element.inner_text(),
-                        'headline': headline_element.inner_text(),
-                        'profile_url': "https://www.linkedin.com" + url_element.get_attribute('href'),
-                        'company': '', 
-                        'school': '',
-                    })
-            except Exception as e:
-                print(f"Could not parse a profile: {e}")
-        return pd.DataFrame(leads)
+                page.wait_for_selector(f"{RESULT_SELECTOR}, {EMPTY_RESULTS_SELECTOR}")
+            except Exception:
+                timer.ok = False
+                return []
+            return leads_from_results(page.eval_on_selector_all(RESULT_SELECTOR, EXTRACT_RESULTS_JS), self.base_url)
+
+    def _next_tasks(self, next_page):
+        """Takes the next ``(url, page_number)`` of each active search round-robin, one per tab."""
+        tasks = []
+        while len(tasks) < self.tabs and next_page:
+            for url in list(next_page):
+                if len(tasks) == self.tabs:
+                    break
+                tasks.append((url, next_page[url]))
+                next_page[url] += 1
+                if next_page[url] > self.max_pages:
+                    del next_page[url]
+        return tasks
+
+    def scrape(self, search_urls):
+        """Yields lead dicts page by page, as soon as each page has been read."""
+        if isinstance(search_urls, str):
+            search_urls = [search_urls]
+        next_page = {url: 1 for url in search_urls}
+        while next_page:
+            tasks = self._next_tasks(next_page)
+            started = []
+            for page, (url, page_number) in zip(self.pages, tasks):
+                try:
+                    with metrics.timer("lead_gen", "search_goto"):
+                        page.goto(search_page_url(url, page_number), wait_until="commit")
+                    started.append((page, url, page_number))
+                except Exception as e:
+                    print(f"Could not open page {page_number} of {url}: {e}")
+                    metrics.error("lead_gen", "search_goto", e)
+                    self.stats["errors"] += 1
+                    next_page.pop(url, None)
 
+            for page, url, page_number in started:
+                leads = self._read_results(page)
+                self.stats["pages"] += 1
+                if not leads:
+                    self.stats["empty_pages"] += 1
+                    next_page.pop(url, None)
+                    continue
+                self.stats["leads"] += len(leads)
+                metrics.count("lead_gen", "leads_scraped", len(leads))
+                yield from leads
+
+def iter_linkedin_search_results(playwright, search_urls, **scraper_kwargs):
+    """Yields leads from one or more LinkedIn searches as they are scraped (see ``LinkedInScraper``)."""
+    print(f"Scraping LinkedIn search results from: {search_urls}")
+    try:
+        with LinkedInScraper(playwright, **scraper_kwargs) as scraper:
+            yield from scraper.scrape(search_urls)
+            print(f"Scraped {scraper.stats['leads']} leads from {scraper.stats['pages']} pages")
     except Exception as e:
         print(f"An error occurred during scraping: {e}")
-        return pd.DataFrame()
-    finally:
-        browser.close()
+        metrics.error("lead_gen", "scrape", e)
+
+def scrape_linkedin_search_results(playwright, search_url, **scraper_kwargs):
+    """Scrapes LinkedIn search results for public profiles using Playwright."""
+    return pd.DataFrame(list(iter_linkedin_search_results(playwright, search_url, **scraper_kwargs)))
+
+def normalize_lookup_key(full_name, company):
+    """Case- and whitespace-insensitive cache key for an Apollo lookup."""
+    def clean(value):
+        return "" if pd.isna(value) else " ".join(str(value).lower().split())
+    return f"{clean(full_name)}|{clean(company)}"
+
+class ApolloCache:
+    """SQLite cache of Apollo lookups, including "no email found" results.
+
+    Found emails are kept for ``ttl_days``; negative results expire sooner
+    (``negative_ttl_days``) so leads Apollo learns about later get retried.
+    """
+
+    def __init__(self, path, ttl_days=APOLLO_CACHE_TTL_DAYS, negative_ttl_days=APOLLO_NEGATIVE_TTL_DAYS):
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, email TEXT, fetched REAL NOT NULL)")
+        self.conn.commit()
 
-def enrich_with_apollo(df):
-    """Enriches lead data with email addresses from Apollo.io."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get(self, key):
+        """Returns ``(hit, email)``; ``email`` is None for a cached negative result."""
+        row = self.conn.execute("SELECT email, fetched FROM lookups WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            email, fetched = row
+            if time.time() - fetched <= (self.ttl if email else self.negative_ttl):
+                self.hits += 1
+                return True, email
+        self.misses += 1
+        return False, None
+
+    def put(self, key, email):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO lookups (key, email, fetched) VALUES (?, ?, ?)", (key, email or None, time.time())
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class ApolloClient:
+    """Thread-safe Apollo people-search client over one pooled HTTP session.
+
+    Every request takes a token from a shared requests-per-minute bucket;
+    429 and 5xx responses are retried with backoff (or Retry-After).
+    """
+
+    def __init__(self, api_key=None, url=APOLLO_API_URL, workers=APOLLO_WORKERS, rpm=APOLLO_RPM,
+                 max_retries=5, backoff_base=1.0):
+        self.api_key = api_key or APOLLO_API_KEY
+        self.url = url
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(rpm)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Cache-Control"] = "no-cache"
+
+    def lookup(self, full_name, company):
+        """Returns the first matching person's email, or None if Apollo has none."""
+        params = {
+            "api_key": self.api_key,
+            "q_keywords": full_name,
+            "organization_name": company,
+            "page": 1
+        }
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            with metrics.timer("lead_gen", "apollo") as timer:
+                r = self.session.get(self.url, params=params, timeout=30)
+                timer.ok = r.status_code < 400
+            if (r.status_code == 429 or r.status_code >= 500) and attempt < self.max_retries:
+                try:
+                    delay = float(r.headers.get("Retry-After"))
+                except (TypeError, ValueError):
+                    delay = self.backoff_base * 2 ** attempt * random.uniform(0.5, 1.5)
+                time.sleep(delay)
+                continue
+            r.raise_for_status()
+            people = r.json().get("people") or [{}]
+            return people[0].get("email")
+
+    def close(self):
+        self.session.close()
+
+def enrich_with_apollo(df, client=None, cache=None):
+    """Enriches lead data with email addresses from Apollo.io.
+
+    Lookups run in parallel over a shared session, are de-duplicated by
+    normalized (full_name, company) and cached across runs (``cache`` defaults
+    to ``APOLLO_CACHE_FILE``). Found emails are written back in one assignment.
+    """
     print("Enriching leads with Apollo.io...")
-    if not APOLLO_API_KEY:
+    if client is None and not APOLLO_API_KEY:
         print("Warning: APOLLO_API_KEY not found. Skipping enrichment.")
         return df
+    if df.empty:
+        return df
 
-    for index, row in df.iterrows():
-        if pd.isna(row.get('email')) or row.get('email') == '':
-            try:
-                url = "https://api.apollo.io/v1/people/search"
-                headers = {"Cache-Control": "no-cache"}
-                params = {
-                    "api_key": APOLLO_API_KEY,
-                    "q_keywords": row['full_name'],
-                    "organization_name": row.get('company', ''),
-                    "page": 1
-                }
-                r = requests.get(url, headers=headers, params=params).json()
-                person = r.get("people", [{}])[0]
-                email = person.get("email")
+    # object dtype so found addresses can land in an all-empty (float NaN) column
+    df['email'] = df['email'].astype(object) if 'email' in df.columns else None
+    names = df['full_name'] if 'full_name' in df.columns else pd.Series('', index=df.index)
+    companies = df['company'] if 'company' in df.columns else pd.Series('', index=df.index)
+    missing = df['email'].isna() | (df['email'] == '')
+    keys = pd.Series(
+        [normalize_lookup_key(name, company) for name, company in zip(names[missing], companies[missing])],
+        index=df.index[missing], dtype=object,
+    )
+    lookups = {}
+    for index, key in keys.items():
+        if key not in lookups:
+            lookups[key] = (str(names[index]).strip(), "" if pd.isna(companies[index]) else str(companies[index]).strip())
+
+    own_client = client is None
+    own_cache = cache is None
+    client = client or ApolloClient()
+    cache = cache or ApolloCache(APOLLO_CACHE_FILE)
+    found = {}
+    try:
+        to_fetch = []
+        for key in lookups:
+            hit, email = cache.get(key)
+            if hit:
+                found[key] = email
+            else:
+                to_fetch.append(key)
+
+        with ThreadPoolExecutor(max_workers=client.workers) as executor:
+            futures = {executor.submit(client.lookup, *lookups[key]): key for key in to_fetch}
+            for future in as_completed(futures):
+                key = futures[future]
+                full_name = lookups[key][0]
+                try:
+                    email = future.result()
+                except Exception as e:
+                    print(f"Could not enrich {full_name}: {e}")
+                    metrics.error("lead_gen", "apollo", e)
+                    continue
+                found[key] = email
+                cache.put(key, email)
                 if email:
-                    df.at[index, 'email'] = email
-                    print(f"Found email for {row['full_name']}: {email}")
-            except Exception as e:
-                print(f"Could not enrich {row['full_name']}: {e}")
+                    print(f"Found email for {full_name}: {email}")
+        print(f"Apollo lookups: {len(to_fetch)} fetched, {len(lookups) - len(to_fetch)} from cache")
+    finally:
+        if own_cache:
+            cache.close()
+        if own_client:
+            client.close()
+
+    emails = keys.map(found).dropna()
+    emails = emails[emails != '']
+    if not emails.empty:
+        df.loc[emails.index, 'email'] = emails
     return df
 
-def deduplicate_leads(df):
-    """De-duplicates leads based on profile_url."""
-    return df.drop_duplicates(subset=['profile_url'], keep='first')
+def deduplicate_leads(df, index=None):
+    """De-duplicates leads by normalized profile_url and fuzzy name + company/school match.
 
-if __name__ == "__main__":
-    leads_df = load_leads_from_csv('leads.csv')
+    With a persistent ``index`` (see ``LeadIndex``), only leads not seen on
+    any previous run are kept, and they are added to the index.
+    """
+    if df.empty:
+        return df
+    with metrics.timer("lead_gen", "dedup"):
+        if index is not None:
+            return index.filter_new(df)
+        with LeadIndex() as batch_index:
+            return batch_index.filter_new(df)
+
+def enrich_stored_leads(store):
+    """Looks up emails for the stored "new" leads that have none yet. Returns how many were found."""
+    leads_df = store.leads(status=STATUS_NEW, columns=["full_name", "company", "profile_url", "email"])
+    missing = leads_df[leads_df['email'].isna() | (leads_df['email'] == '')].drop(columns=['id']).reset_index(drop=True)
+    if missing.empty:
+        return 0
+    enriched = enrich_with_apollo(missing)
+    found = enriched[enriched['email'].notna() & (enriched['email'] != '')]
+    store.upsert_leads(found[['profile_url', 'email']])
+    return len(found)
 
-    search_url = "https://www.linkedin.com/search/results/people/?keywords=Google&schoolFilter=['1014']"
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape LinkedIn search results, de-dup them and enrich them with Apollo.")
+    parser.add_argument("search_urls", nargs="*", default=[LINKEDIN_SEARCH_URL])
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--skip-enrich", action="store_true", help="store the new leads without Apollo lookups")
+    mode.add_argument("--enrich-only", action="store_true", help="only look up emails for stored new leads that have none")
+    args = parser.parse_args(argv)
+
+    if args.enrich_only:
+        with LeadStore() as store:
+            found = enrich_stored_leads(store)
+        print(metrics.get_metrics().format_report())
+        print(f"Found {found} emails. Leads saved to {LEADS_DB}")
+        return
+
+    from playwright.sync_api import sync_playwright # slow to import; --enrich-only never needs it
     with sync_playwright() as p:
-        scraped_leads = scrape_linkedin_search_results(p, search_url)
-    
-    all_leads = pd.concat([leads_df, scraped_leads], ignore_index=True)
+        scraped_leads = scrape_linkedin_search_results(p, args.search_urls)
 
-    unique_leads = deduplicate_leads(all_leads)
+    with LeadStore() as store:
+        # Only the new batch is checked against the persistent index, not the whole history. Seed leads from
+        # leads.csv (or leads.parquet) go through the index too, so each is enriched and stored once.
+        seed_leads = load_leads_from_csv(lead_file(".", "leads.csv"))
+        with LeadIndex(LEAD_INDEX_FILE) as index:
+            if len(index) == 0:
+                index.add_many(store.leads(columns=["full_name", "headline", "company", "school", "profile_url"]))
+            new_leads = deduplicate_leads(pd.concat([seed_leads, scraped_leads], ignore_index=True), index)
+        print(f"{len(new_leads)} new leads out of {len(scraped_leads)} scraped and {len(seed_leads)} seed leads.")
 
-    enriched_leads = enrich_with_apollo(unique_leads)
+        store.upsert_leads(new_leads if args.skip_enrich else enrich_with_apollo(new_leads))
+    print(metrics.get_metrics().format_report())
+    print(f"Lead generation process complete. Leads saved to {LEADS_DB}")
 
-    enriched_leads.to_csv("leads_processed.csv", index=False)
-    print("Lead generation process complete. Output saved to leads_processed.csv")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
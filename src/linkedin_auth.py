@@ -0,0 +1,29 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LINKEDIN_EMAIL = os.getenv("LINKEDIN_EMAIL")
+LINKEDIN_PASSWORD = os.getenv("LINKEDIN_PASSWORD")
+LINKEDIN_STATE_FILE = os.getenv("LINKEDIN_STATE_FILE", "linkedin_state.json")
+LOGIN_MARKERS = ("/login", "/authwall", "/uas/login")
+
+def saved_state(state_file=LINKEDIN_STATE_FILE):
+    """The saved cookie file to start a browser context from, if there is one."""
+    return state_file if state_file and os.path.exists(state_file) else None
+
+def ensure_logged_in(page, state_file=LINKEDIN_STATE_FILE):
+    """Logs in through the form only if the context's cookies are missing or stale, then saves them."""
+    page.goto("https://www.linkedin.com/feed/")
+    page.wait_for_load_state('domcontentloaded')
+    if not any(marker in page.url for marker in LOGIN_MARKERS):
+        return
+
+    page.goto("https://www.linkedin.com/login")
+    page.fill('input[name="session_key"]', LINKEDIN_EMAIL)
+    page.fill('input[name="session_password"]', LINKEDIN_PASSWORD)
+    page.click('button[type="submit"]')
+    page.wait_for_load_state('networkidle')
+
+    if state_file:
+        page.context.storage_state(path=state_file)
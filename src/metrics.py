@@ -0,0 +1,340 @@
+import os
+import sys
+import time
+import atexit
+import bisect
+import sqlite3
+import threading
+from collections import defaultdict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Metrics Settings ---
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.sqlite") # empty: keep metrics in memory only
+METRICS_FLUSH_EVERY = int(os.getenv("METRICS_FLUSH_EVERY", "200")) # events buffered per write
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5")) # ...or this long, whichever comes first
+SENTRY_DSN = os.getenv("SENTRY_DSN") # reports errors to Sentry when set
+
+# USD per 1K (prompt, completion) tokens, matched by longest model-name prefix.
+# OPENAI_PRICE_PER_1K="prompt,completion" overrides it for every model.
+OPENAI_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+OPENAI_PRICE_PER_1K = os.getenv("OPENAI_PRICE_PER_1K")
+
+def _sentry():
+    """sentry_sdk when ``SENTRY_DSN`` is set and it is installed, else None (imported only then: it is slow to import)."""
+    if not SENTRY_DSN:
+        return None
+    try:
+        import sentry_sdk
+    except ImportError: # optional: errors are only counted locally without it
+        return None
+    return sentry_sdk
+
+# Latency histogram bucket upper bounds: 1 ms doubling up to ~131 s.
+LATENCY_BUCKETS = [0.001 * 2 ** n for n in range(18)]
+
+TIMER = "timer"
+COUNT = "count"
+TOKENS = "tokens"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metric_events (
+    ts REAL NOT NULL,
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value REAL NOT NULL,
+    ok INTEGER NOT NULL DEFAULT 1,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cost REAL
+);
+CREATE INDEX IF NOT EXISTS metric_events_ts ON metric_events (ts);
+"""
+
+def token_cost(model, prompt_tokens, completion_tokens):
+    """Estimated USD cost of one completion."""
+    if OPENAI_PRICE_PER_1K:
+        prices = tuple(float(p) for p in OPENAI_PRICE_PER_1K.split(","))
+    else:
+        matches = [prefix for prefix in OPENAI_PRICES if (model or "").startswith(prefix)]
+        if not matches:
+            return 0.0
+        prices = OPENAI_PRICES[max(matches, key=len)]
+    return (prompt_tokens or 0) / 1000 * prices[0] + (completion_tokens or 0) / 1000 * prices[1]
+
+class Histogram:
+    """Fixed-bucket latency histogram; quantiles are interpolated within a bucket."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.bounds[position - 1] if position > 0 else 0.0
+                high = self.bounds[position] if position < len(self.bounds) else self.max
+                return min(self.max, low + (high - low) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+class Timer:
+    """Context manager measuring one call; set ``ok = False`` to record a failure that didn't raise."""
+
+    def __init__(self, metrics, stage, name):
+        self.metrics = metrics
+        self.stage = stage
+        self.name = name
+        self.ok = True
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.start
+        self.metrics.observe(self.stage, self.name, self.seconds, ok=self.ok and exc_type is None)
+        return False
+
+class Metrics:
+    """Timers, counters and OpenAI token usage per stage, persisted to SQLite.
+
+    Every external call is wrapped in ``timer(stage, name)``, which feeds an
+    in-memory latency histogram (for ``format_report()`` at the end of a run)
+    and appends one event to ``metric_events``. Events are buffered and
+    written in one transaction every ``flush_every`` events or
+    ``flush_seconds``, and on exit, so instrumentation costs no extra
+    round-trip per call. The dashboard reads the same table (``load_events``).
+    """
+
+    def __init__(self, path=METRICS_FILE, run_id=None, flush_every=METRICS_FLUSH_EVERY, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.path = path
+        self.run_id = run_id or f"{os.path.basename(sys.argv[0] or 'python')}:{os.getpid()}:{int(time.time())}"
+        self.flush_every = max(1, flush_every)
+        self.flush_seconds = flush_seconds
+        self.histograms = defaultdict(Histogram)
+        self.errors = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.tokens = defaultdict(lambda: {"prompt": 0, "completion": 0, "cost": 0.0})
+        self.started = time.time()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def timer(self, stage, name):
+        return Timer(self, stage, name)
+
+    def observe(self, stage, name, seconds, ok=True):
+        with self._lock:
+            self.histograms[(stage, name)].observe(seconds)
+            if not ok:
+                self.errors[(stage, name)] += 1
+            self._add((time.time(), self.run_id, stage, name, TIMER, seconds, int(ok), None, None, None))
+
+    def count(self, stage, name, n=1):
+        with self._lock:
+            self.counters[(stage, name)] += n
+            self._add((time.time(), self.run_id, stage, name, COUNT, n, 1, None, None, None))
+
+    def record_usage(self, stage, model, prompt_tokens, completion_tokens):
+        """Records one completion's token usage and its estimated cost."""
+        cost = token_cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            tokens = self.tokens[stage]
+            tokens["prompt"] += prompt_tokens or 0
+            tokens["completion"] += completion_tokens or 0
+            tokens["cost"] += cost
+            self._add((time.time(), self.run_id, stage, model or "unknown", TOKENS,
+                       (prompt_tokens or 0) + (completion_tokens or 0), 1, prompt_tokens, completion_tokens, cost))
+
+    def error(self, stage, name, error):
+        """Reports an error a caller handled (and printed) to Sentry, when configured."""
+        sentry_sdk = _sentry()
+        if sentry_sdk is not None:
+            with sentry_sdk.new_scope() as scope:
+                scope.set_tag("stage", stage)
+                scope.set_tag("operation", name)
+                sentry_sdk.capture_exception(error)
+
+    def _add(self, event):
+        self._pending.append(event)
+        if len(self._pending) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._pending or not self.path:
+            self._pending = []
+            return
+        try:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.executescript(SCHEMA)
+            with self._conn:
+                self._conn.executemany("INSERT INTO metric_events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+        except sqlite3.Error as e:
+            print(f"Could not save metrics to {self.path}: {e}")
+        self._pending = []
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def report(self):
+        """Per ``(stage, name)``: calls, errors, p50/p95 seconds and calls per second of this run."""
+        elapsed = max(time.time() - self.started, 1e-9)
+        with self._lock:
+            return {
+                key: {
+                    "calls": histogram.count, "errors": self.errors[key],
+                    "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95),
+                    "per_sec": histogram.count / elapsed,
+                }
+                for key, histogram in self.histograms.items()
+            }
+
+    def format_report(self):
+        lines = ["Timings:"]
+        for (stage, name), row in sorted(self.report().items()):
+            lines.append(
+                f"  {stage + '.' + name:<28} {row['calls']:>6} calls  {row['errors']:>4} errors  "
+                f"p50 {1000 * row['p50']:8.1f} ms  p95 {1000 * row['p95']:8.1f} ms"
+            )
+        for stage, tokens in sorted(self.tokens.items()):
+            lines.append(f"  {stage + ' tokens':<28} {tokens['prompt']} prompt + {tokens['completion']} completion  ~${tokens['cost']:.4f}")
+        return "\n".join(lines)
+
+# --- Process-wide registry used by the worker modules ---
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """The process's ``Metrics``, opened on first use (and Sentry initialized if ``SENTRY_DSN`` is set)."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            sentry_sdk = _sentry()
+            if sentry_sdk is not None:
+                sentry_sdk.init(dsn=SENTRY_DSN)
+            _metrics = Metrics()
+            atexit.register(_metrics.close)
+        return _metrics
+
+def use_metrics(metrics):
+    """Replaces the process-wide registry (e.g. with a temporary one in tests). Returns the previous one."""
+    global _metrics
+    with _metrics_lock:
+        previous, _metrics = _metrics, metrics
+        return previous
+
+def timer(stage, name):
+    return get_metrics().timer(stage, name)
+
+def observe(stage, name, seconds, ok=True):
+    get_metrics().observe(stage, name, seconds, ok=ok)
+
+def count(stage, name, n=1):
+    get_metrics().count(stage, name, n)
+
+def record_usage(stage, model, usage):
+    """Records an OpenAI response's ``usage`` (dict or object with prompt/completion tokens)."""
+    if not usage:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+    get_metrics().record_usage(stage, model, get("prompt_tokens"), get("completion_tokens"))
+
+def error(stage, name, exc):
+    get_metrics().error(stage, name, exc)
+
+# --- Reading metrics back (dashboard) ---
+# pandas is imported here rather than at the top: every worker records metrics, only the dashboard reads them.
+
+def load_events(path=METRICS_FILE, since=None):
+    """Events from ``path`` newer than ``since`` (epoch seconds) as a DataFrame, empty if there are none yet."""
+    import pandas as pd
+    columns = ["ts", "run_id", "stage", "name", "kind", "value", "ok", "prompt_tokens", "completion_tokens", "cost"]
+    if not path or not os.path.exists(path):
+        return pd.DataFrame(columns=columns)
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        conn.execute("SELECT 1 FROM metric_events LIMIT 1")
+        return pd.read_sql_query("SELECT * FROM metric_events WHERE ts >= ? ORDER BY ts", conn, params=(since or 0,))
+    except sqlite3.OperationalError:
+        return pd.DataFrame(columns=columns)
+    finally:
+        conn.close()
+
+def summarize(events):
+    """One row per ``(stage, name)`` timer: calls, error rate, p50/p95 ms and throughput.
+
+    Throughput is calls per second of wall time the operation was active,
+    summed over runs, so idle time between runs doesn't dilute it.
+    """
+    import pandas as pd
+    timers = events[events["kind"] == TIMER]
+    if timers.empty:
+        return pd.DataFrame(columns=["stage", "name", "calls", "error_rate", "p50_ms", "p95_ms", "per_sec"])
+    timers = timers.assign(start=timers["ts"] - timers["value"])
+    active = timers.groupby(["stage", "name", "run_id"]).agg(first=("start", "min"), last=("ts", "max"))
+    active = (active["last"] - active["first"]).groupby(level=["stage", "name"]).sum()
+    summary = timers.groupby(["stage", "name"]).agg(
+        calls=("value", "size"), error_rate=("ok", lambda ok: 1 - ok.mean()),
+        p50_ms=("value", lambda v: 1000 * v.quantile(0.5)), p95_ms=("value", lambda v: 1000 * v.quantile(0.95)),
+    )
+    summary["per_sec"] = summary["calls"] / active.clip(lower=1e-3)
+    return summary.reset_index()
+
+def spend_by_stage(events):
+    """OpenAI tokens and estimated USD per stage."""
+    usage = events[events["kind"] == TOKENS]
+    return usage.groupby("stage").agg(
+        requests=("value", "size"), prompt_tokens=("prompt_tokens", "sum"),
+        completion_tokens=("completion_tokens", "sum"), spend_usd=("cost", "sum"),
+    ).reset_index()
+
+def timeseries(events, freq="1h"):
+    """Per-stage p95 latency (ms), calls, errors and spend for each ``freq`` interval."""
+    import pandas as pd
+    if events.empty:
+        return pd.DataFrame(columns=["time", "stage", "p95_ms", "calls", "errors", "spend_usd"])
+    events = events.assign(time=pd.to_datetime(events["ts"], unit="s").dt.floor(freq))
+    timers = events[events["kind"] == TIMER]
+    latency = timers.groupby(["time", "stage"]).agg(
+        p95_ms=("value", lambda v: 1000 * v.quantile(0.95)), calls=("value", "size"), errors=("ok", lambda ok: int((ok == 0).sum())),
+    )
+    spend = events[events["kind"] == TOKENS].groupby(["time", "stage"])["cost"].sum().rename("spend_usd")
+    return latency.join(spend, how="outer").fillna({"calls": 0, "errors": 0, "spend_usd": 0.0}).reset_index()
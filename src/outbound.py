@@ -0,0 +1,126 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from ratelimit import TokenBucket
+from storage import DELIVERY_DELIVERED, DELIVERY_SENDING
+
+def delivery_key(channel, lead_id):
+    """Idempotency key of a lead's outreach on one channel."""
+    return f"{channel}:{int(lead_id)}"
+
+class OutboundScheduler:
+    """Sends the outbox over several channels at once, paced only by token-bucket quotas.
+
+    Each channel (e.g. "linkedin", "email") has its own worker threads and a
+    list of quota buckets it must take a token from before every send: its
+    own pacing bucket plus any shared per-account buckets, so two channels
+    using one account share that account's limit. A worker sends as soon as
+    all of its buckets allow, instead of sleeping a fixed time.
+
+    Every send is journaled in the lead store: the key is claimed just before
+    sending, and the outcome is written together with the lead's "sent"
+    status in one transaction. A restarted run skips delivered keys and never
+    re-sends a key a crashed run had claimed but not finished.
+    """
+
+    def __init__(self, store, sleep=time.sleep):
+        self.store = store
+        self.sleep = sleep
+        self.buckets = {}
+        self.channels = {}
+        self.stats = defaultdict(lambda: {"sent": 0, "failed": 0, "skipped": 0, "in_doubt": 0, "waited": 0.0})
+        self._lock = threading.Lock()
+
+    def quota(self, name, rate_per_minute, capacity=1):
+        """Returns the named token bucket, creating it on first use so channels can share it."""
+        if name not in self.buckets:
+            self.buckets[name] = TokenBucket(rate_per_minute, capacity=capacity)
+        return self.buckets[name]
+
+    def add_channel(self, name, connect, quotas, workers=1, on_delivered=None):
+        """Registers a channel.
+
+        ``connect()`` is called once in each worker thread and must return a
+        context manager yielding ``deliver(job) -> {"ok", "error", "message_id"}``
+        (Playwright and SMTP handles stay on the thread that opened them).
+        ``quotas`` are token buckets from ``quota()``. ``on_delivered(job, result)``
+        runs after a successful send has been journaled.
+        """
+        self.channels[name] = {"connect": connect, "quotas": list(quotas), "workers": max(1, workers), "on_delivered": on_delivered}
+
+    def _wait_for_quota(self, channel):
+        wait = max(bucket.reserve(1) for bucket in self.channels[channel]["quotas"]) if self.channels[channel]["quotas"] else 0
+        if wait > 0:
+            with self._lock:
+                self.stats[channel]["waited"] += wait
+            self.sleep(wait)
+
+    def _count(self, channel, outcome):
+        with self._lock:
+            self.stats[channel][outcome] += 1
+
+    def _worker(self, channel, jobs):
+        config = self.channels[channel]
+        job = None
+        try:
+            with config["connect"]() as deliver:
+                while True:
+                    try:
+                        job = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    self._wait_for_quota(channel)
+                    if not self.store.begin_delivery(job["key"], job["lead_id"], channel):
+                        self._count(channel, "in_doubt")
+                        continue
+                    try:
+                        result = deliver(job)
+                    except Exception as e:
+                        result = {"ok": False, "error": str(e)}
+                    self.store.complete_delivery(
+                        job["key"], job["lead_id"], result["ok"],
+                        error=result.get("error"), message_id=result.get("message_id"),
+                    )
+                    self._count(channel, "sent" if result["ok"] else "failed")
+                    done, job = job, None
+                    if result["ok"] and config["on_delivered"]:
+                        config["on_delivered"](done, result)
+        except Exception as e:
+            print(f"{channel} worker stopped: {e}")
+            if job is not None: # taken but never journaled as sent or failed
+                self._count(channel, "failed")
+
+    def run(self, jobs):
+        """Sends ``jobs`` (dicts with at least ``lead_id`` and ``channel``) and returns the per-channel stats.
+
+        Jobs already delivered, or left in doubt by a crashed run, are skipped
+        before taking any quota.
+        """
+        jobs = [dict(job, key=job.get("key") or delivery_key(job["channel"], job["lead_id"])) for job in jobs]
+        states = self.store.delivery_states(job["key"] for job in jobs)
+        queues = defaultdict(queue.Queue)
+        for job in jobs:
+            state = states.get(job["key"])
+            if state == DELIVERY_DELIVERED:
+                self._count(job["channel"], "skipped")
+            elif state == DELIVERY_SENDING:
+                print(f"Skipping lead {job['lead_id']} on {job['channel']}: a previous run may have sent it (check manually).")
+                self._count(job["channel"], "in_doubt")
+            else:
+                queues[job["channel"]].put(job)
+
+        threads = []
+        for channel, channel_jobs in queues.items():
+            for _ in range(min(self.channels[channel]["workers"], channel_jobs.qsize())):
+                thread = threading.Thread(target=self._worker, args=(channel, channel_jobs), name=f"outbound-{channel}")
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+        for channel, channel_jobs in queues.items():
+            # Left over when every worker of the channel stopped early (e.g. it couldn't connect): never attempted.
+            while not channel_jobs.empty():
+                channel_jobs.get_nowait()
+                self._count(channel, "failed")
+        return {channel: dict(stats) for channel, stats in self.stats.items()}
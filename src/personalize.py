@@ -1,63 +1,414 @@
 import os
+import argparse
+import asyncio
+import json
+import random
 import pandas as pd
-import openai
 from dotenv import load_dotenv
+import metrics
+from prompts import batch_max_tokens, count_message_tokens, squeeze, truncate_tokens
+from ratelimit import TokenBucket
+from draft_cache import DraftCache
+from jobqueue import open_queue, run_worker, worker_arguments
+from storage import LeadStore, LEADS_DB, STATUS_NEW
 
 load_dotenv()
 
 # --- Environment Variables ---
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if OPENAI_API_KEY:
-    openai.api_key = OPENAI_API_KEY
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE") # e.g. a local fake completion server
+
+# --- Generation Settings ---
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "40000"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+EXPECTED_COMPLETION_TOKENS = 100 # ~50 words, used to pre-reserve TPM budget
+DRAFT_MAX_TOKENS = int(os.getenv("DRAFT_MAX_TOKENS", "120")) # cap per draft; a 50-word DM is ~70 tokens
+DRAFT_LENGTH_RETRIES = int(os.getenv("DRAFT_LENGTH_RETRIES", "1")) # retries, each with twice the cap, of a cut-off draft
+LEAD_FIELD_TOKENS = int(os.getenv("LEAD_FIELD_TOKENS", "40")) # budget per lead field (name, headline, company, school)
+ERROR_DRAFT = "Error generating message."
+
+# --- Draft Cache / Checkpoints ---
+DRAFT_CACHE_FILE = os.getenv("DRAFT_CACHE_FILE", "draft_cache.sqlite")
+DRAFT_CACHE_MAX_ENTRIES = int(os.getenv("DRAFT_CACHE_MAX_ENTRIES", "100000"))
+DRAFT_CACHE_MAX_AGE_DAYS = float(os.getenv("DRAFT_CACHE_MAX_AGE_DAYS", "30"))
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "100")) # drafts per batched write to the lead store
+DRAFT_BATCH_SIZE = int(os.getenv("DRAFT_BATCH_SIZE", "1")) # >1 packs that many leads into one request
 
 # --- System Prompt ---
 SYSTEM_PROMPT = "You are a polite new-grad SWE reaching out to a {role} at {company}. Keep it under 50 words, reference 1 shared detail."
+BATCH_SYSTEM_PROMPT = (
+    "You are a polite new-grad SWE reaching out to professionals. For each lead, write the message its "
+    "instructions ask for, addressed to that lead. Keep each under 50 words, reference 1 shared detail. "
+    "Reply with only a JSON object mapping each lead id to its message."
+)
+
+def _openai():
+    """The configured openai module, imported on first use (it takes about a second to import)."""
+    import openai
+    if OPENAI_API_KEY:
+        openai.api_key = OPENAI_API_KEY
+    if OPENAI_API_BASE:
+        openai.api_base = OPENAI_API_BASE
+    return openai
+
+def lead_field(lead, name, default):
+    """A lead field for a prompt: whitespace collapsed and cut to ``LEAD_FIELD_TOKENS`` (long headlines are common)."""
+    return truncate_tokens(squeeze(str(lead.get(name, default))), LEAD_FIELD_TOKENS)
 
 def generate_message_prompt(lead):
     """Generates a specific prompt for a given lead."""
     # This example assumes the CSV has these columns.
     # You might need to adjust based on your actual lead data.
-    prompt = f"""
-    Write a 50-word LinkedIn DM to {lead.get('full_name', 'there')}, a {lead.get('headline', 'professional')} at {lead.get('company', 'their company')}.
-    You both attended {lead.get('school', 'the same university')}.
-    Politely ask for a 15-min career chat about their work.
-    """
+    prompt = (
+        f"Write a 50-word LinkedIn DM to {lead_field(lead, 'full_name', 'there')}, "
+        f"a {lead_field(lead, 'headline', 'professional')} at {lead_field(lead, 'company', 'their company')}. "
+        f"You both attended {lead_field(lead, 'school', 'the same university')}. "
+        "Politely ask for a 15-min career chat about their work."
+    )
     # The guide mentions referencing a recent post, which would require more data.
     # Example: if 'recent_post_topic' in lead and lead['recent_post_topic']:
     #     prompt += f" Mention their recent post about {lead['recent_post_topic']}."
     return prompt
 
+def build_messages(lead):
+    """Builds the chat messages (system + user) for a lead."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT.format(role=lead_field(lead, 'headline', 'professional'), company=lead_field(lead, 'company', 'their company'))},
+        {"role": "user", "content": generate_message_prompt(lead)}
+    ]
+
+def build_batch_messages(leads_with_ids):
+    """Builds one request asking for drafts for several ``(lead_id, lead)`` pairs as JSON."""
+    instructions = {lead_id: generate_message_prompt(lead) for lead_id, lead in leads_with_ids}
+    return [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": json.dumps(instructions, ensure_ascii=False)}
+    ]
+
+def parse_batch_response(text, lead_ids):
+    """Parses a batch reply into ``{lead_id: draft}``, keeping only known ids with non-empty string drafts."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        text = text[text.find("{"):]
+    try:
+        data = json.loads(text[:text.rfind("}") + 1])
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {
+        str(lead_id): draft.strip() for lead_id, draft in data.items()
+        if str(lead_id) in lead_ids and isinstance(draft, str) and draft.strip()
+    }
+
 def get_personalized_message(lead):
     """Uses OpenAI to generate a personalized message for a lead."""
     if not OPENAI_API_KEY:
         print("Warning: OPENAI_API_KEY not found. Returning placeholder message.")
         return "This is a placeholder message. Please set your OPENAI_API_KEY."
 
-    full_prompt = generate_message_prompt(lead)
-    
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT.format(role=lead.get('headline', 'professional'), company=lead.get('company', 'their company'))},
-                {"role": "user", "content": full_prompt}
-            ]
-        )
+        with metrics.timer("personalize", "openai"):
+            response = _openai().ChatCompletion.create(
+                model=OPENAI_MODEL,
+                messages=build_messages(lead),
+                max_tokens=DRAFT_MAX_TOKENS,
+            )
+        metrics.record_usage("personalize", OPENAI_MODEL, response.get("usage"))
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"Error generating message for {lead.get('full_name')}: {e}")
-        return "Error generating message."
+        metrics.error("personalize", "openai", e)
+        return ERROR_DRAFT
+
+async def openai_complete(messages, model, max_tokens=None):
+    """Default completer: one async chat completion, returns (text, total_tokens, finish_reason)."""
+    limits = {"max_tokens": max_tokens} if max_tokens else {}
+    response = await _openai().ChatCompletion.acreate(model=model, messages=messages, **limits)
+    usage = response.get("usage") or {}
+    metrics.record_usage("personalize", model, usage)
+    return response.choices[0].message.content.strip(), usage.get("total_tokens"), response.choices[0].get("finish_reason")
+
+def estimate_tokens(messages):
+    """Rough token estimate (~4 chars per token) used to reserve TPM budget up front."""
+    return sum(len(m["content"]) for m in messages) // 4 + EXPECTED_COMPLETION_TOKENS
+
+def _status_code(error):
+    return getattr(error, "http_status", None) or getattr(error, "status_code", None)
+
+def is_retryable(error):
+    """429s, 5xx responses, timeouts and dropped connections are worth retrying."""
+    status = _status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in (
+        "RateLimitError", "ServiceUnavailableError", "APIConnectionError", "Timeout", "APITimeoutError"
+    )
+
+def _retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+class DraftGenerator:
+    """Generates drafts concurrently while staying under request and token rate limits.
+
+    Up to ``concurrency`` completions are in flight at once. Each request first
+    takes one token from the requests-per-minute bucket and its estimated size
+    from the tokens-per-minute bucket; the token estimate is corrected once the
+    response reports its real usage. 429/5xx errors are retried with jittered
+    exponential backoff (or the server's Retry-After, when given). With a
+    ``cache``, drafts already generated for the same request are returned
+    without calling the model, and new ones are stored as soon as they arrive.
+    ``complete(messages, model, max_tokens)`` makes each request, with the
+    answer capped at ``max_tokens`` per draft, and returns ``(text, tokens)``
+    or ``(text, tokens, finish_reason)``. An answer cut off by the cap
+    (finish reason "length") is retried with twice the room, up to
+    ``length_retries`` times, then counted as failed; it is never cached.
+    """
+
+    def __init__(self, complete=None, model=OPENAI_MODEL, concurrency=OPENAI_CONCURRENCY,
+                 rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_retries=OPENAI_MAX_RETRIES, backoff_base=1.0, backoff_cap=60.0,
+                 cache=None, batch_size=DRAFT_BATCH_SIZE, max_tokens=DRAFT_MAX_TOKENS, length_retries=DRAFT_LENGTH_RETRIES):
+        self.complete = complete or openai_complete
+        self.max_tokens = max_tokens
+        self.length_retries = length_retries
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.requests_bucket = TokenBucket(rpm)
+        self.tokens_bucket = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.stats = {"completed": 0, "failed": 0, "retries": 0, "tokens": 0, "length_limited": 0,
+                      "batched_requests": 0, "batch_fallbacks": 0, "tokens_saved": 0}
+
+    async def _request(self, messages, estimate, label, max_tokens):
+        """Runs one rate-limited completion with retries. Returns the text, or None on failure."""
+        metrics.count("personalize", "input_tokens", count_message_tokens(messages))
+        attempt = length_retries = 0
+        while True:
+            await self.requests_bucket.acquire_async(1)
+            await self.tokens_bucket.acquire_async(estimate)
+            try:
+                with metrics.timer("personalize", "openai"):
+                    text, used_tokens, *finish = await self.complete(messages, self.model, max_tokens=max_tokens)
+            except Exception as e:
+                if attempt < self.max_retries and is_retryable(e):
+                    self.stats["retries"] += 1
+                    delay = _retry_after(e) or min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+                    attempt += 1
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                    continue
+                print(f"Error generating message for {label}: {e}")
+                metrics.error("personalize", "openai", e)
+                return None
+            if used_tokens:
+                self.tokens_bucket.reserve(used_tokens - estimate)
+                self.stats["tokens"] += used_tokens
+            if finish and finish[0] == "length":
+                self.stats["length_limited"] += 1
+                metrics.count("personalize", "length_limited")
+                if max_tokens and length_retries < self.length_retries:
+                    length_retries += 1
+                    max_tokens *= 2
+                    continue
+                print(f"Message for {label} was cut off at {max_tokens} tokens.")
+                return None
+            return text
+
+    async def generate_one(self, lead):
+        """Generates one draft, retrying transient errors. Returns the draft text."""
+        messages = build_messages(lead)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(messages, self.model)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        return await self._generate_uncached(lead, messages, cache_key)
+
+    async def _generate_uncached(self, lead, messages, cache_key):
+        text = await self._request(messages, estimate_tokens(messages), lead.get('full_name'), self.max_tokens)
+        if text is None:
+            self.stats["failed"] += 1
+            return ERROR_DRAFT
+        self.stats["completed"] += 1
+        if cache_key:
+            self.cache.put(cache_key, text)
+        return text
+
+    async def generate_batch(self, items):
+        """Generates drafts for several ``(key, lead)`` pairs in one request.
+
+        Leads missing from (or malformed in) the JSON response fall back to
+        single-lead calls. Returns ``{key: draft}``.
+        """
+        drafts = {}
+        pending = []
+        for key, lead in items:
+            single_messages = build_messages(lead)
+            cache_key = self.cache.key(single_messages, self.model) if self.cache is not None else None
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                drafts[key] = cached
+            else:
+                pending.append((key, lead, cache_key, single_messages))
+
+        if len(pending) > 1:
+            lead_ids = {str(n): entry for n, entry in enumerate(pending, start=1)}
+            messages = build_batch_messages([(lead_id, entry[1]) for lead_id, entry in lead_ids.items()])
+            estimate = estimate_tokens(messages) + EXPECTED_COMPLETION_TOKENS * (len(pending) - 1)
+            text = await self._request(messages, estimate, f"batch of {len(pending)} leads",
+                                       batch_max_tokens(self.max_tokens, len(pending)))
+            parsed = parse_batch_response(text, lead_ids) if text is not None else {}
+            self.stats["batched_requests"] += 1
+
+            resolved = []
+            for lead_id, draft in parsed.items():
+                key, lead, cache_key, single_messages = lead_ids[lead_id]
+                drafts[key] = draft
+                resolved.append(single_messages)
+                self.stats["completed"] += 1
+                if cache_key:
+                    self.cache.put(cache_key, draft)
+            if resolved:
+                # Prompt tokens the resolved leads would have cost as separate calls, minus what the batch cost.
+                single_cost = sum(estimate_tokens(m) - EXPECTED_COMPLETION_TOKENS for m in resolved)
+                self.stats["tokens_saved"] += single_cost - (estimate_tokens(messages) - EXPECTED_COMPLETION_TOKENS)
+
+        for key, lead, cache_key, single_messages in pending:
+            if key not in drafts:
+                if len(pending) > 1:
+                    self.stats["batch_fallbacks"] += 1
+                drafts[key] = await self._generate_uncached(lead, single_messages, cache_key)
+        return drafts
+
+    async def run(self, leads, on_result=None):
+        """Generates drafts for ``(key, lead)`` pairs.
+
+        ``on_result(key, draft)`` is called as each draft completes; the full
+        ``{key: draft}`` mapping is also returned. With ``batch_size`` > 1,
+        leads are sent ``batch_size`` at a time in a single request.
+        """
+        leads = list(leads)
+        queue = asyncio.Queue()
+        if self.batch_size > 1:
+            for i in range(0, len(leads), self.batch_size):
+                queue.put_nowait(leads[i:i + self.batch_size])
+        else:
+            for item in leads:
+                queue.put_nowait([item])
+        results = {}
+
+        async def worker():
+            while True:
+                try:
+                    chunk = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if len(chunk) == 1:
+                    key, lead = chunk[0]
+                    drafts = {key: await self.generate_one(lead)}
+                else:
+                    drafts = await self.generate_batch(chunk)
+                for key, draft in drafts.items():
+                    results[key] = draft
+                    if on_result:
+                        on_result(key, draft)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return results
+
+def generate_drafts(leads_df, generator=None, store=None, checkpoint_every=CHECKPOINT_EVERY):
+    """Fills ``draft_msg`` for every row of ``leads_df`` using a DraftGenerator.
+
+    With a ``store``, ``leads_df`` must be indexed by lead id; finished drafts
+    are written to the store in batches of ``checkpoint_every`` (and moved to
+    "pending" review), so a crash loses at most one batch. Failed drafts are
+    not stored, leaving those leads to be retried on the next run.
+    """
+    generator = generator or DraftGenerator()
+    unsaved = {}
+
+    def on_result(index, draft):
+        leads_df.at[index, 'draft_msg'] = draft
+        print(f"Generated message for {leads_df.at[index, 'full_name']}")
+        metrics.count("personalize", "drafts" if draft != ERROR_DRAFT else "failed_drafts")
+        if store is not None and draft != ERROR_DRAFT:
+            unsaved[index] = draft
+            if len(unsaved) >= max(1, checkpoint_every):
+                store.set_drafts(unsaved)
+                unsaved.clear()
+
+    leads = [(index, row.to_dict()) for index, row in leads_df.iterrows()]
+    try:
+        asyncio.run(generator.run(leads, on_result=on_result))
+    finally:
+        if store is not None and unsaved:
+            store.set_drafts(unsaved)
+    return leads_df
+
+JOB_QUEUE = "personalize"
+
+def enqueue_drafts(store, queue):
+    """Queues one job per lead still waiting for a draft. Returns how many were queued."""
+    lead_ids = store.leads(status=STATUS_NEW, columns=["id"])["id"]
+    return queue.send(JOB_QUEUE, [(f"draft:{int(lead_id)}", {"lead_id": int(lead_id)}) for lead_id in lead_ids])
+
+def draft_job_handler(store, generator):
+    """Worker handler for a batch of ``{"lead_id"}`` jobs: drafts them concurrently and stores the drafts.
+
+    Leads that are no longer "new" (drafted by an earlier delivery of the
+    same job) are skipped; failed drafts are reported so the job is retried.
+    """
+    def handle(bodies):
+        leads_df = store.leads_by_ids([body["lead_id"] for body in bodies]).set_index('id')
+        leads_df = generate_drafts(leads_df[leads_df['status'] == STATUS_NEW].copy(), generator, store=store)
+        failed = set(leads_df.index[leads_df['draft_msg'] == ERROR_DRAFT])
+        return ["draft failed" if body["lead_id"] in failed else None for body in bodies]
+    return handle
+
+def main(argv=None):
+    args = worker_arguments(argparse.ArgumentParser(description="Draft a message for every new lead.")).parse_args(argv)
+
+    if args.enqueue or args.worker:
+        with LeadStore() as store, open_queue() as queue:
+            if args.enqueue:
+                print(f"Queued {enqueue_drafts(store, queue)} draft jobs.")
+            else:
+                with DraftCache(DRAFT_CACHE_FILE, DRAFT_CACHE_MAX_ENTRIES, DRAFT_CACHE_MAX_AGE_DAYS) as cache:
+                    run_worker(queue, JOB_QUEUE, draft_job_handler(store, DraftGenerator(cache=cache)), store, args)
+    else:
+        with LeadStore() as store:
+            leads_df = store.leads(status=STATUS_NEW).set_index('id')
+            print(f"{len(leads_df)} leads need a draft.")
+
+            if not OPENAI_API_KEY and not OPENAI_API_BASE:
+                drafts = {index: get_personalized_message(row.to_dict()) for index, row in leads_df.iterrows()}
+                store.set_drafts(drafts)
+            else:
+                with DraftCache(DRAFT_CACHE_FILE, DRAFT_CACHE_MAX_ENTRIES, DRAFT_CACHE_MAX_AGE_DAYS) as cache:
+                    generator = DraftGenerator(cache=cache)
+                    generate_drafts(leads_df, generator, store=store)
+                print(f"Drafts: {generator.stats['completed']} ok, {generator.stats['failed']} failed, "
+                      f"{generator.stats['retries']} retries, {generator.stats['tokens']} tokens")
+                print(f"Draft cache: {cache.hits} hits, {cache.misses} misses")
+                if generator.batch_size > 1:
+                    print(f"Batch mode: {generator.stats['batched_requests']} batched requests, "
+                          f"{generator.stats['batch_fallbacks']} single-lead fallbacks, "
+                          f"~{generator.stats['tokens_saved']} prompt tokens saved vs per-lead calls")
+                print(metrics.get_metrics().format_report())
+
+        print(f"Finished generating messages. Drafts saved to {LEADS_DB} for review.")
 
 if __name__ == "__main__":
-    leads_df = pd.read_csv("leads_processed.csv")
-    
-    # Create a new column for the draft message
-    leads_df['draft_msg'] = ''
-
-    for index, row in leads_df.iterrows():
-        print(f"Generating message for {row['full_name']}...")
-        message = get_personalized_message(row.to_dict())
-        leads_df.at[index, 'draft_msg'] = message
-
-    leads_df.to_csv("leads_with_drafts.csv", index=False)
-    print("Finished generating messages. Output saved to leads_with_drafts.csv")
+    main()
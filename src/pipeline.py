@@ -0,0 +1,317 @@
+import os
+import time
+import queue
+import asyncio
+import argparse
+import threading
+from contextlib import ExitStack, contextmanager, nullcontext
+import pandas as pd
+from dotenv import load_dotenv
+import metrics
+from storage import LeadStore, LEADS_DB, STATUS_NEW
+
+load_dotenv()
+
+# --- Pipeline Settings ---
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "50")) # leads buffered between two stages
+PIPELINE_REPORT_EVERY = float(os.getenv("PIPELINE_REPORT_EVERY", "10")) # seconds between progress lines
+
+DONE = object() # end-of-stream marker, one per downstream worker
+
+class Stage:
+    """One step of the pipeline.
+
+    ``process(items) -> items`` handles a micro-batch of up to ``batch_size``
+    leads (whatever is already waiting, never blocking for more than
+    ``max_wait`` once it has one) and returns the leads to pass on; dropping a
+    lead filters it out. Alternatively ``connect()`` returns a context manager
+    yielding ``process``, opened once per worker thread, for stages holding
+    connections (SQLite, HTTP sessions) that must stay on one thread.
+    """
+
+    def __init__(self, name, process=None, connect=None, workers=1, batch_size=1, max_wait=0.05):
+        self.name = name
+        self.connect = connect or (lambda: nullcontext(process))
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+
+def _new_stats():
+    return {"in": 0, "out": 0, "errors": 0, "busy": 0.0, "queue": 0, "max_queue": 0}
+
+class StreamingPipeline:
+    """Runs a source and its stages concurrently, connected by bounded queues.
+
+    Each lead moves on as soon as a stage has handled it, so the first drafts
+    exist while scraping is still going. A full queue blocks the stage
+    feeding it (backpressure), so a slow stage throttles the ones before it
+    instead of buffering the whole run in memory. ``stats`` holds per-stage
+    counts, busy time and current/max depth of the stage's input queue.
+    """
+
+    def __init__(self, source, stages, queue_size=PIPELINE_QUEUE_SIZE, report_every=PIPELINE_REPORT_EVERY,
+                 source_name="source"):
+        self.source = source
+        self.source_name = source_name
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.report_every = report_every
+        self.stats = {name: _new_stats() for name in [source_name] + [stage.name for stage in self.stages]}
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def _record(self, name, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.stats[name][key] += value
+
+    def _put(self, outbox, item, consumer):
+        outbox.put(item)
+        depth = outbox.qsize()
+        with self._lock:
+            stats = self.stats[consumer]
+            stats["max_queue"] = max(stats["max_queue"], depth)
+
+    def _finish(self, outbox, downstream):
+        for _ in range(downstream.workers if downstream else 0):
+            outbox.put(DONE)
+
+    def _run_source(self, outbox, downstream):
+        try:
+            for item in self.source:
+                self._record(self.source_name, out=1)
+                if outbox is not None:
+                    self._put(outbox, item, downstream.name)
+        except Exception as e:
+            print(f"{self.source_name} stopped: {e}")
+            self._record(self.source_name, errors=1)
+        finally:
+            self._finish(outbox, downstream)
+
+    def _take(self, inbox, stage):
+        """Blocks for one item, then takes whatever else arrives within ``max_wait``. Returns ``(items, done)``."""
+        item = inbox.get()
+        if item is DONE:
+            return [], True
+        items = [item]
+        deadline = time.monotonic() + stage.max_wait
+        while len(items) < stage.batch_size:
+            try:
+                item = inbox.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is DONE:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def _run_stage(self, stage, inbox, outbox, downstream, remaining):
+        try:
+            with ExitStack() as stack:
+                try:
+                    process = stack.enter_context(stage.connect())
+                except Exception as e:
+                    # Keep draining the inbox so upstream stages never block on a dead stage.
+                    print(f"{stage.name} could not start: {e}")
+                    process = None
+                done = False
+                while not done:
+                    items, done = self._take(inbox, stage)
+                    if not items:
+                        continue
+                    self._record(stage.name, **{"in": len(items)})
+                    if process is None:
+                        self._record(stage.name, errors=len(items))
+                        continue
+                    start = time.perf_counter()
+                    try:
+                        results = list(process(items) or [])
+                    except Exception as e:
+                        print(f"{stage.name} failed on {len(items)} leads: {e}")
+                        busy = time.perf_counter() - start
+                        self._record(stage.name, errors=len(items), busy=busy)
+                        metrics.observe("pipeline", stage.name, busy, ok=False)
+                        metrics.error("pipeline", stage.name, e)
+                        continue
+                    busy = time.perf_counter() - start
+                    self._record(stage.name, out=len(results), busy=busy)
+                    metrics.observe("pipeline", stage.name, busy)
+                    if outbox is not None:
+                        for result in results:
+                            self._put(outbox, result, downstream.name)
+        finally:
+            with self._lock:
+                remaining[stage.name] -= 1
+                last = remaining[stage.name] == 0
+            if last:
+                self._finish(outbox, downstream)
+
+    def _reporter(self, queues, stop):
+        while not stop.wait(self.report_every):
+            print(self.format_report(queues))
+
+    def _sample_depths(self, queues):
+        with self._lock:
+            for stage, inbox in zip(self.stages, queues):
+                self.stats[stage.name]["queue"] = inbox.qsize()
+
+    def run(self):
+        """Runs until the source is exhausted and every stage has drained. Returns ``stats``."""
+        self.started = time.monotonic()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        threads = [threading.Thread(
+            target=self._run_source, name=f"pipeline-{self.source_name}",
+            args=(queues[0] if queues else None, self.stages[0] if self.stages else None),
+        )]
+        for position, stage in enumerate(self.stages):
+            has_next = position + 1 < len(self.stages)
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._run_stage, name=f"pipeline-{stage.name}",
+                    args=(stage, queues[position], queues[position + 1] if has_next else None,
+                          self.stages[position + 1] if has_next else None, remaining),
+                ))
+        stop = threading.Event()
+        reporter = threading.Thread(target=self._reporter, args=(queues, stop), daemon=True)
+        for thread in threads:
+            thread.start()
+        if self.report_every:
+            reporter.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        self.finished = time.monotonic()
+        self._sample_depths(queues)
+        return self.stats
+
+    def throughput(self, name):
+        """Leads per second a stage has passed on since the run started."""
+        elapsed = (self.finished or time.monotonic()) - self.started if self.started else 0
+        return self.stats[name]["out"] / elapsed if elapsed > 0 else 0.0
+
+    def format_report(self, queues=None):
+        if queues is not None:
+            self._sample_depths(queues)
+        lines = []
+        for name, stats in self.stats.items():
+            lines.append(
+                f"  {name:<12} in {stats['in']:>6}  out {stats['out']:>6}  errors {stats['errors']:>4}  "
+                f"{self.throughput(name):8.2f}/s  busy {stats['busy']:7.1f}s  queue {stats['queue']:>3} (max {stats['max_queue']})"
+            )
+        return "Pipeline:\n" + "\n".join(lines)
+
+def run_batch(source, stages):
+    """Stage-at-a-time mode: every lead finishes one stage before the next stage starts."""
+    items = list(source)
+    for stage in stages:
+        with stage.connect() as process:
+            items = list(process(items) or []) if items else []
+        print(f"{stage.name}: {len(items)} leads")
+    return items
+
+# --- Lead pipeline stages ---
+
+def scraped_leads(search_urls):
+    """Source: leads from the LinkedIn searches, yielded as each result page is read."""
+    from playwright.sync_api import sync_playwright
+    from lead_gen import iter_linkedin_search_results
+
+    with sync_playwright() as p:
+        yield from iter_linkedin_search_results(p, search_urls)
+
+def dedup_stage(index_path=None, store=None):
+    """Drops leads seen on any earlier run; an empty index is first seeded with the leads already in ``store``."""
+    from lead_gen import deduplicate_leads, LEAD_INDEX_FILE
+    from dedup_index import LeadIndex
+
+    @contextmanager
+    def connect():
+        with LeadIndex(index_path or LEAD_INDEX_FILE) as index:
+            if store is not None and len(index) == 0:
+                index.add_many(store.leads(columns=["full_name", "headline", "company", "school", "profile_url"]))
+            yield lambda leads: deduplicate_leads(pd.DataFrame(leads), index).to_dict('records')
+    return Stage("dedup", connect=connect)
+
+def enrich_stage(store, client=None, cache_path=None, batch_size=8):
+    """Enriches a micro-batch with Apollo, saves it to the store as "new" and tags each lead with its id.
+
+    Only leads whose stored status is still "new" are passed on: a re-scraped
+    lead that was already drafted, sent or answered is not drafted again.
+    """
+    from lead_gen import enrich_with_apollo, ApolloCache, ApolloClient, APOLLO_API_KEY, APOLLO_CACHE_FILE
+
+    @contextmanager
+    def connect():
+        own_client = client is None and APOLLO_API_KEY
+        apollo = ApolloClient() if own_client else client
+        try:
+            with ApolloCache(cache_path or APOLLO_CACHE_FILE) as cache:
+                def process(leads):
+                    df = pd.DataFrame(leads)
+                    if apollo is not None:
+                        df = enrich_with_apollo(df, client=apollo, cache=cache)
+                    store.upsert_leads(df)
+                    ids = store.ids_by_profile_url(df['profile_url'].tolist())
+                    df['id'] = df['profile_url'].map(ids)
+                    df = df[df['id'].notna()]
+                    stored = store.leads_by_ids(df['id'].tolist())
+                    new_ids = set(stored.loc[stored['status'] == STATUS_NEW, 'id'])
+                    return df[df['id'].isin(new_ids)].to_dict('records')
+                yield process
+        finally:
+            if own_client:
+                apollo.close()
+    return Stage("enrich", connect=connect, batch_size=batch_size)
+
+def personalize_stage(store, generator_factory=None, batch_size=8):
+    """Drafts a micro-batch concurrently and saves the drafts for review ("pending")."""
+    from personalize import (DraftGenerator, DraftCache, get_personalized_message, ERROR_DRAFT, OPENAI_API_KEY,
+                             OPENAI_API_BASE, DRAFT_CACHE_FILE, DRAFT_CACHE_MAX_ENTRIES, DRAFT_CACHE_MAX_AGE_DAYS)
+
+    @contextmanager
+    def connect():
+        if generator_factory is not None:
+            generator, cache = generator_factory(), nullcontext()
+        elif OPENAI_API_KEY or OPENAI_API_BASE:
+            cache = DraftCache(DRAFT_CACHE_FILE, DRAFT_CACHE_MAX_ENTRIES, DRAFT_CACHE_MAX_AGE_DAYS)
+            generator = DraftGenerator(cache=cache)
+        else:
+            generator, cache = None, nullcontext()
+        with cache:
+            def process(leads):
+                if generator is None:
+                    drafts = {lead['id']: get_personalized_message(lead) for lead in leads}
+                else:
+                    drafts = asyncio.run(generator.run([(lead['id'], lead) for lead in leads]))
+                drafts = {lead_id: draft for lead_id, draft in drafts.items() if draft != ERROR_DRAFT}
+                store.set_drafts(drafts)
+                return [dict(lead, draft_msg=drafts[lead['id']]) for lead in leads if lead['id'] in drafts]
+            yield process
+    return Stage("personalize", connect=connect, batch_size=batch_size)
+
+def lead_stages(store):
+    return [dedup_stage(store=store), enrich_stage(store), personalize_stage(store)]
+
+if __name__ == "__main__":
+    from lead_gen import LINKEDIN_SEARCH_URL
+
+    parser = argparse.ArgumentParser(description="Scrape -> de-dup -> enrich -> draft, as one streaming run.")
+    parser.add_argument("search_urls", nargs="*", default=[LINKEDIN_SEARCH_URL])
+    parser.add_argument("--mode", choices=["stream", "batch"], default="stream",
+                        help="stream: leads flow through every stage as they are scraped; batch: one stage at a time")
+    parser.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    with LeadStore() as store:
+        if args.mode == "batch":
+            drafted = len(run_batch(scraped_leads(args.search_urls), lead_stages(store)))
+        else:
+            pipeline = StreamingPipeline(scraped_leads(args.search_urls), lead_stages(store),
+                                         queue_size=args.queue_size, source_name="scrape")
+            pipeline.run()
+            print(pipeline.format_report())
+            print(metrics.get_metrics().format_report())
+            drafted = pipeline.stats["personalize"]["out"]
+    print(f"{drafted} new drafts saved to {LEADS_DB} for review.")
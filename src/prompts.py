@@ -0,0 +1,132 @@
+"""Prompt compaction shared by the stages that call the model.
+
+Reply bodies lose their quoted history, signature and extra whitespace
+before triage, and every model input can be cut to a token budget. Tokens
+are counted with tiktoken when it is installed (and its encoding is
+available offline), else with a local estimate that errs slightly high, so a
+budget is never overshot. Batched requests get a ``max_tokens`` cap sized
+from the per-item cap with ``batch_max_tokens``.
+"""
+import os
+import re
+
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+JSON_ENTRY_TOKENS = 8 # id, quotes and punctuation around each entry of a batched JSON answer
+MESSAGE_TOKENS = 4 # per-message overhead of the chat format (role, separators)
+
+# --- Quoted history and signatures ---
+QUOTE_START = re.compile(
+    r"^(>.*"
+    r"|on\b[^\n]*(\n[^\n]*)?\bwrote:\s*" # Gmail / Apple Mail attribution, which may wrap onto a second line
+    r"|-{2,}\s*(original|forwarded) message\s*-{2,}\s*"
+    r"|begin forwarded message:\s*"
+    r"|_{10,}\s*" # Outlook's separator above the quoted headers
+    r"|from:[^\n]+\n(sent|date):[^\n]+"
+    r")$",
+    re.IGNORECASE | re.MULTILINE,
+)
+SIGNATURE_START = re.compile(r"^(--\s*|sent from my \S.*|get outlook for \S.*)$", re.IGNORECASE | re.MULTILINE)
+SIGN_OFF = re.compile(
+    r"^(best|best regards|kind regards|warm regards|regards|thanks|thank you|many thanks|cheers|sincerely|"
+    r"all the best|talk soon),$",
+    re.IGNORECASE,
+)
+MAX_SIGNATURE_LINES = 4 # name, title, company, phone under a sign-off
+MAX_SIGNATURE_LINE_CHARS = 60
+# Lowercase words a name or title line may still contain ("Head of Sales", "Partner at Acme & Co").
+SIGNATURE_CONNECTORS = {"of", "at", "and", "for", "the", "in", "de", "van", "von", "der", "la"}
+
+# ~cl100k pre-tokenization: words with their leading space, 1-3 digit runs, single symbols, whitespace runs.
+TOKEN_PIECES = re.compile(r" ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]|\s+|_+")
+CHARS_PER_WORD_TOKEN = 6 # common words are one token; long or rare ones split every few characters
+
+def strip_quoted(text):
+    """The reply's own text: everything from the first quoted line or quote header on is dropped."""
+    text = text or ""
+    match = QUOTE_START.search(text)
+    return text[:match.start()] if match else text
+
+def _signature_line(line):
+    """Whether ``line`` is shaped like a signature's name, title, company or contact line."""
+    if len(line) > MAX_SIGNATURE_LINE_CHARS or line.endswith((".", "?", "!", ":")):
+        return False
+    # Every word capitalized, a connector, or not a word at all ("+1", "|", an address or URL).
+    return all(not word[0].islower() or word in SIGNATURE_CONNECTORS or "@" in word or "." in word for word in line.split())
+
+def strip_signature(text, keep=()):
+    """Drops a ``--``/"Sent from my ..." signature, and name/title lines under a closing "Best," or "Thanks,".
+
+    Lines after a sign-off that read like a reply ("Thanks,\nnot interested")
+    stay, as does any tail matching one of the ``keep`` patterns (compiled regexes).
+    """
+    text = text or ""
+    match = SIGNATURE_START.search(text)
+    if match:
+        text = text[:match.start()]
+    lines = text.rstrip().split("\n")
+    for position in range(max(0, len(lines) - MAX_SIGNATURE_LINES - 1), len(lines) - 1):
+        tail = [line.strip() for line in lines[position + 1:]]
+        if SIGN_OFF.match(lines[position].strip()) and all(_signature_line(line) for line in tail if line) \
+                and not any(pattern.search("\n".join(tail)) for pattern in keep):
+            return "\n".join(lines[:position + 1])
+    return text
+
+def squeeze(text):
+    """Collapses every run of whitespace, newlines and indentation included, to one space."""
+    return " ".join((text or "").split())
+
+def compact_reply(body, keep=()):
+    """An email reply reduced to what a classifier needs: no quoted history, signature or extra whitespace.
+
+    ``keep`` is passed to ``strip_signature``.
+    """
+    return squeeze(strip_signature(strip_quoted(body), keep))
+
+_encoding = None
+
+def _tiktoken():
+    """The tiktoken encoding, or None when tiktoken is not installed or its encoding can't be loaded."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken # optional; imported on first use
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception: # not installed, or the encoding file can't be downloaded
+            _encoding = False
+    return _encoding or None
+
+def _piece_tokens(piece):
+    word = piece.strip()
+    return 1 if len(word) <= CHARS_PER_WORD_TOKEN else -(-len(word) // CHARS_PER_WORD_TOKEN)
+
+def count_tokens(text):
+    """Tokens in ``text``: exact with tiktoken, else a local estimate that errs slightly high."""
+    text = text or ""
+    encoding = _tiktoken()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return sum(_piece_tokens(match.group(0)) for match in TOKEN_PIECES.finditer(text))
+
+def count_message_tokens(messages):
+    """Prompt tokens of a chat request."""
+    return sum(count_tokens(message["content"]) + MESSAGE_TOKENS for message in messages)
+
+def truncate_tokens(text, budget):
+    """``text`` cut to its first ``budget`` tokens (unchanged when it already fits, or ``budget`` is falsy)."""
+    text = text or ""
+    if not budget:
+        return text
+    encoding = _tiktoken()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= budget else encoding.decode(tokens[:budget]).rstrip()
+    used = 0
+    for match in TOKEN_PIECES.finditer(text):
+        used += _piece_tokens(match.group(0))
+        if used > budget:
+            return text[:match.start()].rstrip()
+    return text
+
+def batch_max_tokens(per_item, count):
+    """``max_tokens`` for a JSON answer holding ``count`` items of up to ``per_item`` tokens each."""
+    return count * (per_item + JSON_ENTRY_TOKENS) + JSON_ENTRY_TOKENS
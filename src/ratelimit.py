@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import time
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate_per_minute``.
+
+    ``reserve`` always succeeds and returns how long the caller must wait
+    before its tokens are actually available, so callers never spin. A
+    negative ``amount`` hands tokens back (e.g. when a request used fewer
+    tokens than estimated).
+    """
+
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.clock = clock
+        self.tokens = float(self.capacity)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        """Takes ``amount`` tokens, returning the seconds to wait before using them."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+            if self.tokens >= 0 or self.rate <= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, amount=1):
+        """Blocks until ``amount`` tokens are available."""
+        wait = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, amount=1):
+        """Async variant of ``acquire`` that yields to the event loop while waiting."""
+        wait = self.reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
@@ -0,0 +1,65 @@
+from storage import STATUS_SENT, STATUS_REPLIED, STATUS_BOUNCED, normalize_email
+
+def normalize_message_id(message_id):
+    return (message_id or "").strip().strip("<>").strip()
+
+def referenced_message_ids(in_reply_to=None, references=None):
+    """Message-IDs a reply points back to, most recent first."""
+    ids = []
+    for header in (in_reply_to, references):
+        for token in reversed((header or "").replace(",", " ").split()):
+            message_id = normalize_message_id(token)
+            if message_id and message_id not in ids:
+                ids.append(message_id)
+    return ids
+
+class ReplyIndex:
+    """Resolves an inbound reply to the lead it answers with indexed lookups.
+
+    Keys are ``msgid:<Message-ID we sent>``, ``thread:<Gmail thread id>`` and
+    ``email:<normalized address>``. They live in the store's ``reply_keys``
+    table: the sender adds them as each message goes out, and the listener
+    looks up a reply's keys by primary key (falling back to the indexed
+    normalized email of leads already contacted) and learns thread IDs as
+    replies are matched. Nothing is loaded up front, so a lookup costs the
+    same however many leads the store holds.
+    """
+
+    CONTACTED = [STATUS_SENT, STATUS_REPLIED, STATUS_BOUNCED]
+
+    def __init__(self, store):
+        self.store = store
+
+    def _add(self, lead_id, keys):
+        keys = [key for key in keys if key]
+        if keys:
+            self.store.add_reply_keys(lead_id, keys)
+
+    def record_send(self, lead_id, email=None, message_id=None, thread_id=None):
+        """Indexes an outgoing message so replies to it resolve to ``lead_id``."""
+        email = normalize_email(email) if isinstance(email, str) else ""
+        message_id = normalize_message_id(message_id)
+        self._add(lead_id, [
+            f"email:{email}" if email else None,
+            f"msgid:{message_id}" if message_id else None,
+            f"thread:{thread_id}" if thread_id else None,
+        ])
+
+    def match(self, sender, thread_id=None, in_reply_to=None, references=None):
+        """Returns the lead id a reply belongs to, or None.
+
+        Threading headers are the most specific evidence, then the Gmail
+        thread, then the sender's address. A match also indexes the reply's
+        thread, so later replies in it match even from another address.
+        """
+        email = normalize_email(sender)
+        candidates = [f"msgid:{message_id}" for message_id in referenced_message_ids(in_reply_to, references)]
+        candidates += [f"thread:{thread_id}" if thread_id else None, f"email:{email}" if email else None]
+        candidates = [key for key in candidates if key]
+        found = {key: int(lead_id) for key, lead_id in self.store.reply_keys(candidates)}
+        lead_id = next((found[key] for key in candidates if key in found), None)
+        if lead_id is None and email:
+            lead_id = self.store.lead_id_by_email(email, status=self.CONTACTED)
+        if lead_id is not None and thread_id and f"thread:{thread_id}" not in found:
+            self._add(lead_id, [f"thread:{thread_id}"])
+        return lead_id
@@ -1,75 +1,155 @@
-import streamlit as st
 import pandas as pd
-import os
+import streamlit as st
+import metrics
+from storage import LeadStore, STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED
 
-LEADS_FILE = "leads_with_drafts.csv"
-APPROVED_FILE = "outbox.csv"
+REVIEW_COLUMNS = ["full_name", "company", "headline", "school", "draft_msg"]
+BATCH_SIZES = [10, 25, 50, 100]
 
-def load_data():
-    """Loads the leads with drafted messages."""
-    if os.path.exists(LEADS_FILE):
-        return pd.read_csv(LEADS_FILE)
-    return None
+@st.cache_resource
+def get_store():
+    """One store connection shared across Streamlit reruns."""
+    return LeadStore()
 
-def save_approved(approved_leads_df):
-    """Saves approved messages to the outbox."""
-    if os.path.exists(APPROVED_FILE):
-        approved_leads_df.to_csv(APPROVED_FILE, mode='a', header=False, index=False)
-    else:
-        approved_leads_df.to_csv(APPROVED_FILE, index=False)
+def decide(lead_id, status, **fields):
+    """Records a review decision as a single-row update."""
+    with metrics.timer("review_ui", "decide"):
+        get_store().set_status(lead_id, status, **fields)
+    metrics.count("review_ui", status)
+
+def decide_batch(decisions):
+    """Writes a whole page of ``{lead_id: (status, draft)}`` decisions in one transaction. Returns how many applied."""
+    with metrics.timer("review_ui", "decide_batch"):
+        applied = get_store().review(decisions)
+    for status in (STATUS_APPROVED, STATUS_REJECTED):
+        decided = sum(1 for s, _ in decisions.values() if s == status)
+        if decided:
+            metrics.count("review_ui", status, decided)
+    return applied
+
+def review_buffer(batch_size):
+    """The pending drafts queued for batch review, topped up to two pages (the current one and the next).
+
+    Drafts are fetched by key after the last one queued, so each top-up is
+    one index seek no matter how many leads the store holds, and the next
+    page is already in memory when the current one is submitted.
+    """
+    state = st.session_state
+    buffer = state.setdefault("review_buffer", [])
+    if len(buffer) < 2 * batch_size:
+        more = get_store().leads(status=STATUS_PENDING, columns=REVIEW_COLUMNS, limit=2 * batch_size - len(buffer),
+                                 after_id=state.get("review_cursor", 0))
+        if more.empty and not buffer and state.get("review_cursor", 0):
+            state.review_cursor = 0 # wrap around to drafts skipped earlier or drafted since
+            return review_buffer(batch_size)
+        if not more.empty:
+            buffer.extend(more.to_dict("records"))
+            state.review_cursor = int(more['id'].max())
+    return buffer
+
+def batch_review(counts):
+    batch_size = st.sidebar.selectbox("Drafts per page", BATCH_SIZES, index=1)
+    buffer = review_buffer(batch_size)
+    if not buffer:
+        st.success("All messages have been reviewed!")
+        st.write(f"{counts.get(STATUS_APPROVED, 0)} approved messages are in the outbox.")
+        return
+
+    page = buffer[:batch_size]
+    st.caption(f"{counts.get(STATUS_PENDING, 0)} messages waiting for review; showing {len(page)}. "
+               "Tick approve or reject, edit drafts in place, then submit. Unticked drafts stay pending.")
+    grid = pd.DataFrame([{"approve": False, "reject": False, **lead} for lead in page])
+    edited = st.data_editor(
+        grid, key=f"grid_{page[0]['id']}", hide_index=True, width="stretch",
+        column_order=["approve", "reject", "full_name", "company", "headline", "school", "draft_msg"],
+        disabled=["id", "full_name", "company", "headline", "school"],
+        column_config={
+            "approve": st.column_config.CheckboxColumn("✅", width="small"),
+            "reject": st.column_config.CheckboxColumn("❌", width="small"),
+            "draft_msg": st.column_config.TextColumn("Drafted Message", width="large"),
+        },
+    )
+
+    col1, col2, col3 = st.columns(3)
+    action = None
+    if col1.button("Submit ticked"):
+        action = "ticked"
+    if col2.button("✅ Approve all on page"):
+        action = STATUS_APPROVED
+    if col3.button("❌ Reject all on page"):
+        action = STATUS_REJECTED
+    if action is None:
+        return
+
+    decisions = {}
+    for original, row in zip(page, edited.to_dict("records")):
+        if action == "ticked":
+            if row["approve"] == row["reject"]:
+                continue # neither (or both) ticked: leave it pending
+            status = STATUS_APPROVED if row["approve"] else STATUS_REJECTED
+        else:
+            status = action
+        draft = row["draft_msg"] if row["draft_msg"] != original["draft_msg"] else None
+        decisions[int(original["id"])] = (status, draft)
+
+    if not decisions:
+        st.warning("Nothing ticked: tick ✅ or ❌ on the drafts to decide, or use the approve/reject all buttons.")
+        return
+    applied = decide_batch(decisions)
+    del buffer[:len(page)] # undecided drafts are skipped until the queue wraps around
+    st.session_state.review_notice = (
+        f"Saved {applied} decisions" + (f" ({len(decisions) - applied} had already been decided elsewhere)" if applied < len(decisions) else "")
+    )
+    st.rerun()
+
+def single_review(counts):
+    # Fetch only the next pending message, not the whole lead table
+    pending_reviews = get_store().leads(status=STATUS_PENDING, columns=REVIEW_COLUMNS, limit=1)
+    if pending_reviews.empty:
+        st.success("All messages have been reviewed!")
+        st.write(f"{counts.get(STATUS_APPROVED, 0)} approved messages are in the outbox.")
+        return
+
+    lead = pending_reviews.iloc[0]
+    current_id = int(lead['id'])
+
+    st.caption(f"{counts.get(STATUS_PENDING, 0)} messages waiting for review")
+    st.subheader(f"Reviewing message for: {lead['full_name']}")
+    st.write(f"**Company:** {lead['company']}")
+    st.write(f"**Headline:** {lead['headline']}")
+    st.write(f"**School:** {lead['school']}")
+
+    edited_msg = st.text_area("Drafted Message", lead['draft_msg'], height=150, key=f"draft_{current_id}")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        if st.button("✅ Approve"):
+            decide(current_id, STATUS_APPROVED)
+            st.rerun()
+
+    with col2:
+        if st.button("❌ Reject"):
+            decide(current_id, STATUS_REJECTED)
+            st.rerun()
+
+    with col3:
+        if st.button("✏️ Edit & Approve"):
+            decide(current_id, STATUS_APPROVED, draft_msg=edited_msg)
+            st.rerun()
 
 st.title("Message Review UI")
 
-df = load_data()
-
-if df is not None:
-    if 'status' not in df.columns:
-        df['status'] = 'pending' # Add status column if it doesn't exist
-
-    # Use session state to keep track of the current index
-    if 'review_index' not in st.session_state:
-        st.session_state.review_index = 0
-
-    # Get the next pending message
-    pending_reviews = df[df['status'] == 'pending']
-    if not pending_reviews.empty:
-        current_index = pending_reviews.index[0]
-        
-        lead = df.loc[current_index]
-
-        st.subheader(f"Reviewing message for: {lead['full_name']}")
-        st.write(f"**Company:** {lead['company']}")
-        st.write(f"**Headline:** {lead['headline']}")
-        st.write(f"**School:** {lead['school']}")
-        
-        st.text_area("Drafted Message", lead['draft_msg'], height=150)
-
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            if st.button("✅ Approve"):
-                df.at[current_index, 'status'] = 'approved'
-                save_approved(df.loc[[current_index]])
-                st.rerun()
-
-        with col2:
-            if st.button("❌ Reject"):
-                df.at[current_index, 'status'] = 'rejected'
-                st.rerun()
-        
-        with col3:
-            if st.button("✏️ Edit & Approve"):
-                # For simplicity, we'll consider editing as direct approval in this version.
-                # A more advanced version would allow text editing.
-                df.at[current_index, 'status'] = 'approved'
-                save_approved(df.loc[[current_index]])
-                st.rerun()
-
-        # Update the main dataframe with the new status
-        df.to_csv(LEADS_FILE, index=False)
+store = get_store()
+counts = store.count_by_status()
 
+if counts:
+    mode = st.sidebar.radio("Review mode", ["One at a time", "Batch"])
+    if "review_notice" in st.session_state:
+        st.toast(st.session_state.pop("review_notice"))
+    if mode == "Batch":
+        batch_review(counts)
     else:
-        st.success("All messages have been reviewed!")
-        st.write("Approved messages are in `outbox.csv`.")
+        single_review(counts)
 
 else:
-    st.warning("No leads file found. Please run `personalize.py` first.")
+    st.warning("No leads found. Please run `lead_gen.py` and `personalize.py` first.")
@@ -1,104 +1,385 @@
 import os
-import pandas as pd
-from playwright.sync_api import sync_playwright
+import argparse
 from dotenv import load_dotenv
 import time
-import yagmail
+import smtplib
+import threading
+from collections import deque
+from contextlib import contextmanager
+from email.utils import make_msgid
+import metrics
+from storage import LeadStore, STATUS_APPROVED, DELIVERY_FAILED
+from reply_index import ReplyIndex
+from outbound import OutboundScheduler, delivery_key
+from jobqueue import open_queue, run_worker, worker_arguments
+from linkedin_auth import LINKEDIN_EMAIL, LINKEDIN_STATE_FILE, ensure_logged_in, saved_state
 
 load_dotenv()
 
 # --- Environment Variables ---
-LINKEDIN_EMAIL = os.getenv("LINKEDIN_EMAIL")
-LINKEDIN_PASSWORD = os.getenv("LINKEDIN_PASSWORD")
 GMAIL_USER = os.getenv("GMAIL_USER")
 GMAIL_PASSWORD = os.getenv("GMAIL_PASSWORD")
 
-OUTBOX_FILE = "outbox.csv"
-SENT_FILE = "sent.csv"
+LINKEDIN_POOL_SIZE = int(os.getenv("LINKEDIN_POOL_SIZE", "2")) # LinkedIn sender threads, each with its own browser page
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "1"))
+
+# --- Send Quotas (token buckets; sends go out as soon as every bucket allows) ---
+LINKEDIN_SENDS_PER_MINUTE = float(os.getenv("LINKEDIN_SENDS_PER_MINUTE", "1"))
+EMAIL_SENDS_PER_MINUTE = float(os.getenv("EMAIL_SENDS_PER_MINUTE", "6"))
+LINKEDIN_ACCOUNT_SENDS_PER_DAY = float(os.getenv("LINKEDIN_ACCOUNT_SENDS_PER_DAY", "100"))
+EMAIL_ACCOUNT_SENDS_PER_DAY = float(os.getenv("EMAIL_ACCOUNT_SENDS_PER_DAY", "500"))
+
+class LinkedInSessionPool:
+    """Keeps a few logged-in LinkedIn pages open for the whole send run.
+
+    Cookies are saved to ``state_file`` after the first login and reused on
+    later runs, so the login form is only filled in when the saved session
+    has expired. Messages are dispatched round-robin over the open pages.
+    """
+
+    def __init__(self, playwright, size=LINKEDIN_POOL_SIZE, state_file=LINKEDIN_STATE_FILE, headless=False):
+        self.playwright = playwright
+        self.size = max(1, size)
+        self.state_file = state_file
+        self.headless = headless # Set headless=True for production
+        self.browser = None
+        self.pages = deque()
+
+    def __enter__(self):
+        try:
+            self.open()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        """Launches one browser and opens ``size`` authenticated pages in it."""
+        with metrics.timer("sender", "browser_start"):
+            self.browser = self.playwright.chromium.launch(headless=self.headless)
+        first_context = self.browser.new_context(storage_state=saved_state(self.state_file))
+        first_page = first_context.new_page()
+        with metrics.timer("sender", "linkedin_login"):
+            ensure_logged_in(first_page, self.state_file)
+        self.pages.append(first_page)
+
+        # Every other context starts from the session the first one just established.
+        state = first_context.storage_state()
+        for _ in range(self.size - 1):
+            context = self.browser.new_context(storage_state=state)
+            self.pages.append(context.new_page())
+
+    def close(self):
+        if self.browser is not None:
+            self.browser.close()
+            self.browser = None
+        self.pages.clear()
+
+    def send(self, profile_url, message):
+        """Sends a message from the next free page in the pool."""
+        page = self.pages.popleft()
+        try:
+            with metrics.timer("sender", "linkedin_send"):
+                # Go to profile
+                page.goto(profile_url)
+                page.wait_for_load_state('domcontentloaded')
+
+                # Click message button and send
+                page.click('button:has-text("Message")')
+                page.wait_for_selector('div.msg-form__contenteditable')
+                page.fill('div.msg-form__contenteditable', message)
+                page.click('button.msg-form__send-button')
+            print(f"Message sent to {profile_url}")
+            return True
+
+        except Exception as e:
+            print(f"Failed to send message to {profile_url}: {e}")
+            metrics.error("sender", "linkedin_send", e)
+            return False
+        finally:
+            self.pages.append(page)
 
 def send_linkedin_message(playwright, profile_url, message):
     """Navigates to a LinkedIn profile and sends a message."""
-    browser = playwright.chromium.launch(headless=False) # Set headless=True for production
-    context = browser.new_context()
-    page = context.new_page()
-
     try:
-        # Login
-        page.goto("https://www.linkedin.com/login")
-        page.fill('input[name="session_key"]', LINKEDIN_EMAIL)
-        page.fill('input[name="session_password"]', LINKEDIN_PASSWORD)
-        page.click('button[type="submit"]')
-        page.wait_for_load_state('networkidle')
-
-        # Go to profile
-        page.goto(profile_url)
-        page.wait_for_load_state('domcontentloaded')
-
-        # Click message button and send
-        page.click('button:has-text("Message")')
-        time.sleep(2) # Wait for message box to appear
-        page.fill('div.msg-form__contenteditable', message)
-        page.click('button.msg-form__send-button')
-        print(f"Message sent to {profile_url}")
-        return True
-
+        with LinkedInSessionPool(playwright, size=1) as pool:
+            return pool.send(profile_url, message)
     except Exception as e:
         print(f"Failed to send message to {profile_url}: {e}")
         return False
-    finally:
-        browser.close()
+
+class EmailTransport:
+    """Sends a whole outbox over a few long-lived, authenticated SMTP connections.
+
+    Each connection does the TCP connect, TLS handshake and AUTH once and is
+    reused for every message it sends. A connection that drops mid-batch is
+    re-opened and the message retried. Extra keyword arguments go straight to
+    ``yagmail.SMTP`` (e.g. ``smtp_ssl=False, smtp_skip_login=True`` for a local
+    test server).
+    """
+
+    def __init__(self, user=None, password=None, host=SMTP_HOST, port=SMTP_PORT,
+                 pool_size=SMTP_POOL_SIZE, delay=0, max_retries=2, **smtp_kwargs):
+        self.user = user or GMAIL_USER
+        self.password = password or GMAIL_PASSWORD
+        self.host = host
+        self.port = port
+        self.pool_size = max(1, pool_size)
+        self.delay = delay
+        self.max_retries = max_retries
+        self.smtp_kwargs = smtp_kwargs
+        self.clients = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        try:
+            self.open()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _connect(self):
+        import yagmail # slow to import; a run with an empty outbox never needs it
+        with metrics.timer("sender", "smtp_connect"):
+            client = yagmail.SMTP(self.user, self.password, host=self.host, port=self.port, **self.smtp_kwargs)
+            client.login()
+        return client
+
+    def open(self):
+        for _ in range(self.pool_size):
+            self.clients.append(self._connect())
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.clients = []
+
+    def _send_on(self, slot, recipient, subject, body, message_id):
+        """Sends one message on connection ``slot``; returns an error string or None."""
+        attempts = 0
+        while True:
+            client = self.clients[slot]
+            try:
+                recipients, msg_string = client.prepare_send(
+                    to=recipient, subject=subject, contents=body, message_id=message_id
+                )
+                with metrics.timer("sender", "smtp_send"):
+                    client.smtp.sendmail(client.user, recipients, msg_string)
+                return None
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                attempts += 1
+                if attempts > self.max_retries:
+                    metrics.error("sender", "smtp_send", e)
+                    return str(e)
+                try:
+                    client.close()
+                    self.clients[slot] = self._connect()
+                except Exception as reconnect_error:
+                    metrics.error("sender", "smtp_connect", reconnect_error)
+                    return f"{e} (reconnect failed: {reconnect_error})"
+            except Exception as e:
+                metrics.error("sender", "smtp_send", e)
+                return str(e)
+
+    def send(self, recipient_email, subject, body):
+        """Sends a single message on the first connection."""
+        return self.send_batch([(recipient_email, subject, body)])[0]
+
+    def send_batch(self, messages, on_result=None):
+        """Sends ``(recipient, subject, body)`` tuples through the pool.
+
+        Returns one ``{"to", "ok", "error", "message_id"}`` dict per message, in
+        input order; ``message_id`` is the Message-ID header replies will
+        reference. ``on_result(position, result)`` is called as each message
+        finishes.
+        """
+        results = [None] * len(messages)
+
+        def worker(slot):
+            for position in range(slot, len(messages), len(self.clients)):
+                recipient, subject, body = messages[position]
+                message_id = make_msgid(domain=(self.user or "localhost").rsplit("@", 1)[-1])
+                error = self._send_on(slot, recipient, subject, body, message_id)
+                result = {"to": recipient, "ok": error is None, "error": error, "message_id": message_id}
+                results[position] = result
+                if error is None:
+                    print(f"Email sent to {recipient}")
+                else:
+                    print(f"Failed to send email to {recipient}: {error}")
+                if on_result:
+                    with self._lock:
+                        on_result(position, result)
+                if self.delay and error is None:
+                    time.sleep(self.delay)
+
+        if len(self.clients) == 1:
+            worker(0)
+        else:
+            threads = [threading.Thread(target=worker, args=(slot,)) for slot in range(len(self.clients))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return results
 
 def send_cold_email(recipient_email, subject, body):
     """Sends a cold email using yagmail."""
     if not GMAIL_USER or not GMAIL_PASSWORD:
         print("Gmail credentials not found in environment variables.")
         return False
-    
+
     try:
-        yag = yagmail.SMTP(GMAIL_USER, GMAIL_PASSWORD)
-        yag.send(
-            to=recipient_email,
-            subject=subject,
-            contents=body
-        )
-        print(f"Email sent to {recipient_email}")
-        return True
+        with EmailTransport(pool_size=1) as transport:
+            return transport.send(recipient_email, subject, body)["ok"]
     except Exception as e:
         print(f"Failed to send email to {recipient_email}: {e}")
         return False
 
-if __name__ == "__main__":
-    SENDING_METHOD = os.getenv("SENDING_METHOD", "linkedin") # "linkedin" or "email"
-
-    if not os.path.exists(OUTBOX_FILE):
-        print("Outbox file not found. Nothing to send.")
-        exit()
-
-    outbox_df = pd.read_csv(OUTBOX_FILE)
-    
-    if not os.path.exists(SENT_FILE):
-        pd.DataFrame(columns=outbox_df.columns).to_csv(SENT_FILE, index=False)
-
-    if SENDING_METHOD == "linkedin":
-        with sync_playwright() as p:
-            for index, row in outbox_df.iterrows():
-                success = send_linkedin_message(p, row['profile_url'], row['draft_msg'])
-                if success:
-                    pd.DataFrame([row]).to_csv(SENT_FILE, mode='a', header=False, index=False)
-                    outbox_df.drop(index, inplace=True)
-                    time.sleep(60)
-    
-    elif SENDING_METHOD == "email":
-        for index, row in outbox_df.iterrows():
-            if 'email' in row and pd.notna(row['email']):
-                subject = f"Following up from {row.get('company', 'your company')}"
-                success = send_cold_email(row['email'], subject, row['draft_msg'])
-                if success:
-                    pd.DataFrame([row]).to_csv(SENT_FILE, mode='a', header=False, index=False)
-                    outbox_df.drop(index, inplace=True)
-                    time.sleep(10)
-            else:
+@contextmanager
+def linkedin_channel():
+    """Opens a logged-in LinkedIn page on the calling thread and yields a scheduler ``deliver`` function.
+
+    Playwright's sync API is bound to the thread that started it, so each
+    scheduler worker opens its own page; ``LINKEDIN_POOL_SIZE`` workers run at once.
+    """
+    from playwright.sync_api import sync_playwright # slow to import; only LinkedIn sends need it
+    with sync_playwright() as p, LinkedInSessionPool(p, size=1) as pool:
+        def deliver(job):
+            ok = pool.send(job['profile_url'], job['message'])
+            return {"ok": ok, "error": None if ok else "LinkedIn send failed"}
+        yield deliver
+
+@contextmanager
+def email_channel():
+    """Opens one SMTP connection on the calling thread and yields a scheduler ``deliver`` function."""
+    with EmailTransport(pool_size=1) as transport:
+        yield lambda job: transport.send(job['to'], job['subject'], job['body'])
+
+JOB_QUEUE = "send"
+
+def send_job(lead, channel):
+    """The scheduler job sending ``lead``'s approved draft over ``channel``."""
+    if channel == "email":
+        return {"lead_id": int(lead['id']), "channel": "email", "to": lead['email'],
+                "subject": f"Following up from {lead.get('company', 'your company')}", "body": lead['draft_msg']}
+    return {"lead_id": int(lead['id']), "channel": "linkedin", "profile_url": lead['profile_url'],
+            "message": lead['draft_msg'], "email": lead['email']}
+
+def outbox_jobs(outbox_df, method):
+    """Scheduler jobs for the leads in ``outbox_df``.
+
+    "linkedin" messages every lead on LinkedIn, "email" emails the leads with
+    an address, and "both" emails those and messages the rest on LinkedIn.
+    """
+    has_email = outbox_df['email'].notna() & (outbox_df['email'] != '')
+    jobs = []
+    if method in ("linkedin", "both"):
+        linkedin_rows = outbox_df if method == "linkedin" else outbox_df[~has_email]
+        jobs += [send_job(row, "linkedin") for _, row in linkedin_rows.iterrows()]
+    if method in ("email", "both"):
+        if method == "email":
+            for _, row in outbox_df[~has_email].iterrows():
                 print(f"Skipping {row['full_name']} - no email address.")
+        jobs += [send_job(row, "email") for _, row in outbox_df[has_email].iterrows()]
+    return jobs
+
+def build_scheduler(store, method):
+    """An OutboundScheduler with the channels of ``method`` and their quotas, recording sends in the reply index."""
+    reply_index = ReplyIndex(store)
+
+    def record_send(job, result):
+        reply_index.record_send(job['lead_id'], email=job.get('to') or job.get('email'), message_id=result.get('message_id'))
 
-    outbox_df.to_csv(OUTBOX_FILE, index=False)
-    print("Finished sending messages.")
\ No newline at end of file
+    scheduler = OutboundScheduler(store)
+    if method in ("linkedin", "both"):
+        scheduler.add_channel("linkedin", linkedin_channel, [
+            scheduler.quota("linkedin", LINKEDIN_SENDS_PER_MINUTE),
+            scheduler.quota(f"account:{LINKEDIN_EMAIL}", LINKEDIN_ACCOUNT_SENDS_PER_DAY / 1440, capacity=LINKEDIN_ACCOUNT_SENDS_PER_DAY),
+        ], workers=LINKEDIN_POOL_SIZE, on_delivered=record_send)
+    if method in ("email", "both"):
+        scheduler.add_channel("email", email_channel, [
+            scheduler.quota("email", EMAIL_SENDS_PER_MINUTE),
+            scheduler.quota(f"account:{GMAIL_USER}", EMAIL_ACCOUNT_SENDS_PER_DAY / 1440, capacity=EMAIL_ACCOUNT_SENDS_PER_DAY),
+        ], workers=SMTP_POOL_SIZE, on_delivered=record_send)
+    return scheduler
+
+def send_job_handler(store, scheduler):
+    """Worker handler for a batch of ``{"lead_id", "channel"}`` jobs: sends them through ``scheduler``.
+
+    The current draft is read from the store at send time, and the delivery
+    journal decides each job's outcome: sent now or by an earlier delivery,
+    and in-doubt sends, are done; failed sends, and sends never attempted
+    (e.g. the channel couldn't connect), are retried. Leads that are no
+    longer approved are skipped.
+    """
+    def handle(bodies):
+        leads = {int(lead['id']): lead for lead in store.leads_by_ids([body["lead_id"] for body in bodies]).to_dict("records")}
+        jobs = [send_job(leads[body["lead_id"]], body["channel"]) for body in bodies
+                if body["channel"] in scheduler.channels and leads.get(body["lead_id"], {}).get('status') == STATUS_APPROVED]
+        scheduler.run(jobs)
+        attempted = {delivery_key(job["channel"], job["lead_id"]) for job in jobs}
+        states = store.delivery_states(delivery_key(body["channel"], body["lead_id"]) for body in bodies)
+        errors = []
+        for body in bodies:
+            key = delivery_key(body["channel"], body["lead_id"])
+            if body["channel"] not in scheduler.channels:
+                errors.append(f"{body['channel']} sending is not enabled on this worker")
+            elif states.get(key) == DELIVERY_FAILED:
+                errors.append("send failed")
+            elif key in attempted and key not in states:
+                errors.append("send not attempted")
+            else:
+                errors.append(None)
+        return errors
+    return handle
+
+def main(argv=None):
+    # "linkedin", "email", or "both" (email for leads with an address, LinkedIn for the rest, concurrently)
+    SENDING_METHOD = os.getenv("SENDING_METHOD", "linkedin")
+    args = worker_arguments(argparse.ArgumentParser(description="Send the approved drafts.")).parse_args(argv)
+
+    if SENDING_METHOD in ("email", "both") and not args.enqueue and (not GMAIL_USER or not GMAIL_PASSWORD):
+        print("Gmail credentials not found in environment variables.")
+        return
+
+    with LeadStore() as store:
+        if args.worker:
+            with open_queue() as queue:
+                run_worker(queue, JOB_QUEUE, send_job_handler(store, build_scheduler(store, SENDING_METHOD)), store, args)
+            return
+
+        outbox_df = store.leads(status=STATUS_APPROVED)
+        if outbox_df.empty:
+            print("Outbox is empty. Nothing to send.")
+            return
+
+        jobs = outbox_jobs(outbox_df, SENDING_METHOD)
+        if args.enqueue:
+            with open_queue() as queue:
+                queued = queue.send(JOB_QUEUE, [
+                    (delivery_key(job['channel'], job['lead_id']), {"lead_id": job['lead_id'], "channel": job['channel']}) for job in jobs
+                ])
+            print(f"Queued {queued} send jobs.")
+            return
+
+        stats = build_scheduler(store, SENDING_METHOD).run(jobs)
+        for channel, channel_stats in stats.items():
+            print(f"{channel}: {channel_stats['sent']} sent, {channel_stats['failed']} failed, "
+                  f"{channel_stats['skipped']} already sent, {channel_stats['in_doubt']} in doubt, "
+                  f"{channel_stats['waited']:.0f}s waiting for quota")
+            metrics.count("sender", f"{channel}_sent", channel_stats['sent'])
+        print(metrics.get_metrics().format_report())
+
+    print("Finished sending messages.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,800 @@
+import os
+import sys
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from email.utils import parseaddr
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Store Location ---
+# An embedded SQLite file by default; a postgres:// URL uses sql/schema.sql instead (brought up to date on open).
+LEADS_DB = os.getenv("LEADS_DB", "leads.db")
+
+# --- Lead Statuses (in pipeline order) ---
+STATUS_NEW = "new"            # scraped / enriched, no draft yet
+STATUS_PENDING = "pending"    # drafted, waiting for review
+STATUS_APPROVED = "approved"  # approved in review, i.e. the outbox
+STATUS_REJECTED = "rejected"
+STATUS_SENT = "sent"
+STATUS_REPLIED = "replied"    # reply_category says how
+STATUS_BOUNCED = "bounced"
+
+# --- Delivery Journal States ---
+DELIVERY_SENDING = "sending"      # claimed; if a run dies here the send is in doubt and never retried automatically
+DELIVERY_DELIVERED = "delivered"
+DELIVERY_FAILED = "failed"        # retried on the next run
+
+LEAD_COLUMNS = [
+    "full_name", "headline", "company", "school", "mutual_group",
+    "profile_url", "email", "last_contact", "status", "draft_msg",
+    "reply_category", "replied_at",
+]
+GMAIL_DOMAINS = {"gmail.com", "googlemail.com"}
+
+# --- Lead Files (seed leads, import/export) ---
+LEAD_FILE_FORMAT = os.getenv("LEAD_FILE_FORMAT", "csv") # csv | parquet: what export writes
+# Highly repetitive text columns, loaded as pandas categoricals (dictionary-encoded in Parquet).
+CATEGORICAL_COLUMNS = ["status", "company", "school", "headline", "mutual_group", "reply_category"]
+FILE_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+PARQUET_MAGIC = b"PAR1"
+ARROW_MAGIC = b"ARROW1"
+
+# The CSV hand-off files and the status their rows have in the store.
+CSV_FILES = [
+    ("leads_processed.csv", STATUS_NEW),
+    ("leads_with_drafts.csv", STATUS_PENDING),
+    ("outbox.csv", STATUS_APPROVED),
+    ("sent.csv", STATUS_SENT),
+]
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    full_name TEXT,
+    headline TEXT,
+    company TEXT,
+    school TEXT,
+    mutual_group TEXT,
+    profile_url TEXT UNIQUE,
+    email TEXT,
+    last_contact TEXT,
+    status TEXT NOT NULL DEFAULT 'new',
+    draft_msg TEXT,
+    reply_category TEXT,
+    replied_at TEXT,
+    email_key TEXT
+);
+CREATE INDEX IF NOT EXISTS leads_status ON leads (status);
+CREATE INDEX IF NOT EXISTS leads_email ON leads (email);
+CREATE INDEX IF NOT EXISTS leads_email_key ON leads (email_key);
+CREATE TABLE IF NOT EXISTS reply_keys (
+    key TEXT PRIMARY KEY,
+    lead_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    key TEXT PRIMARY KEY,
+    lead_id INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempted_at TEXT,
+    delivered_at TEXT,
+    message_id TEXT,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS processed_jobs (
+    key TEXT PRIMARY KEY,
+    finished_at TEXT NOT NULL
+);
+"""
+
+# Columns the lead table search box matches against.
+SEARCH_COLUMNS = ["full_name", "company", "headline", "school", "email"]
+
+# Columns added after the first release, created on older SQLite files at startup.
+# email_key is the normalized email (normalize_email), kept next to email so replies resolve through an index.
+ADDED_COLUMNS = {"reply_category": "TEXT", "replied_at": "TEXT", "email_key": "TEXT"}
+
+# Materialized funnel counters: "status:<status>" and "reply:<category>" (replied leads only) row counts.
+# Kept up to date by triggers, so every stage's writes update them in the same transaction. On SQLite, which
+# serializes writers anyway, the triggers update the counter rows in place, and a "version" row is bumped on
+# every lead write so readers can cache until it changes. On Postgres, concurrent workers must never queue on
+# (or deadlock over) shared rows: the triggers append deltas that readers fold in, and the version is a sequence.
+_BUMP = "INSERT INTO lead_stats (key, value) SELECT {key}, {delta} WHERE {when} ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;"
+_STATUS_KEY = "'status:' || {row}.status"
+_REPLY_KEY = "'reply:' || COALESCE({row}.reply_category, '')"
+_REPLIED = "{row}.status = 'replied'"
+
+def _bumps(row, delta):
+    return (
+        _BUMP.format(key=_STATUS_KEY.format(row=row), delta=delta, when="1")
+        + _BUMP.format(key=_REPLY_KEY.format(row=row), delta=delta, when=_REPLIED.format(row=row))
+    )
+
+SQLITE_STATS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS lead_stats (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS leads_stats_insert AFTER INSERT ON leads BEGIN
+    {_bumps("NEW", 1)}
+    {_BUMP.format(key="'version'", delta=1, when="1")}
+END;
+CREATE TRIGGER IF NOT EXISTS leads_stats_delete AFTER DELETE ON leads BEGIN
+    {_bumps("OLD", -1)}
+    {_BUMP.format(key="'version'", delta=1, when="1")}
+END;
+CREATE TRIGGER IF NOT EXISTS leads_stats_update AFTER UPDATE OF status, reply_category ON leads
+WHEN OLD.status IS NOT NEW.status OR OLD.reply_category IS NOT NEW.reply_category BEGIN
+    {_bumps("OLD", -1)}
+    {_bumps("NEW", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS leads_version_update AFTER UPDATE ON leads BEGIN
+    {_BUMP.format(key="'version'", delta=1, when="1")}
+END;
+"""
+
+# The Postgres schema (kept identical to sql/schema.sql), written to run on every open: LeadStore applies it
+# to new and existing databases the way SQLITE_SCHEMA/SQLITE_STATS_SCHEMA create and update SQLite files.
+POSTGRES_SCHEMA = """CREATE TABLE IF NOT EXISTS leads (
+    id SERIAL PRIMARY KEY,
+    full_name VARCHAR(255),
+    headline TEXT,
+    company VARCHAR(255),
+    school VARCHAR(255),
+    mutual_group VARCHAR(255),
+    profile_url VARCHAR(255) UNIQUE,
+    email VARCHAR(255),
+    last_contact TIMESTAMP,
+    status VARCHAR(50) NOT NULL DEFAULT 'new',
+    draft_msg TEXT,
+    reply_category VARCHAR(50),
+    replied_at TIMESTAMP,
+    email_key VARCHAR(255)
+);
+
+CREATE INDEX IF NOT EXISTS leads_status ON leads (status);
+CREATE INDEX IF NOT EXISTS leads_email ON leads (email);
+
+-- Columns added after the first release (email_key: the normalized email, set by LeadStore)
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS reply_category VARCHAR(50);
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS replied_at TIMESTAMP;
+ALTER TABLE leads ADD COLUMN IF NOT EXISTS email_key VARCHAR(255);
+CREATE INDEX IF NOT EXISTS leads_email_key ON leads (email_key);
+
+-- Maps normalized sender addresses, Gmail thread IDs and sent Message-IDs to leads (see src/reply_index.py)
+CREATE TABLE IF NOT EXISTS reply_keys (
+    key TEXT PRIMARY KEY,
+    lead_id INTEGER NOT NULL REFERENCES leads (id)
+);
+
+-- Outbound delivery journal (see src/outbound.py)
+CREATE TABLE IF NOT EXISTS deliveries (
+    key TEXT PRIMARY KEY,
+    lead_id INTEGER NOT NULL REFERENCES leads (id),
+    channel VARCHAR(50) NOT NULL,
+    state VARCHAR(20) NOT NULL,
+    attempted_at TIMESTAMP,
+    delivered_at TIMESTAMP,
+    message_id TEXT,
+    error TEXT
+);
+
+-- Idempotency keys of finished queue jobs, shared by every worker task (see src/jobqueue.py)
+CREATE TABLE IF NOT EXISTS processed_jobs (
+    key TEXT PRIMARY KEY,
+    finished_at TIMESTAMP NOT NULL
+);
+
+-- Materialized funnel counters read by the dashboard (see LeadStore.count_by_status):
+-- 'status:<status>' and 'reply:<category>' for replied leads. LeadStore backfills them when empty.
+CREATE TABLE IF NOT EXISTS lead_stats (
+    key TEXT PRIMARY KEY,
+    value BIGINT NOT NULL
+);
+
+-- Counter changes appended by lead writes (no shared rows to lock), folded into lead_stats by readers.
+CREATE TABLE IF NOT EXISTS lead_stat_deltas (
+    key TEXT NOT NULL,
+    delta INTEGER NOT NULL
+);
+
+-- Advanced once per statement that writes leads (see LeadStore.version).
+CREATE SEQUENCE IF NOT EXISTS lead_version;
+
+CREATE OR REPLACE FUNCTION bump_lead_stat(stat_key TEXT, delta INTEGER) RETURNS VOID AS $$
+    INSERT INTO lead_stat_deltas (key, delta) VALUES (stat_key, delta);
+$$ LANGUAGE SQL;
+
+CREATE OR REPLACE FUNCTION update_lead_stats() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND (TG_OP = 'DELETE' OR OLD.status IS DISTINCT FROM NEW.status
+            OR OLD.reply_category IS DISTINCT FROM NEW.reply_category) THEN
+        PERFORM bump_lead_stat('status:' || OLD.status, -1);
+        IF OLD.status = 'replied' THEN
+            PERFORM bump_lead_stat('reply:' || COALESCE(OLD.reply_category, ''), -1);
+        END IF;
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND (OLD.status IS DISTINCT FROM NEW.status
+            OR OLD.reply_category IS DISTINCT FROM NEW.reply_category)) THEN
+        PERFORM bump_lead_stat('status:' || NEW.status, 1);
+        IF NEW.status = 'replied' THEN
+            PERFORM bump_lead_stat('reply:' || COALESCE(NEW.reply_category, ''), 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bump_lead_version() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM nextval('lead_version');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'leads'::regclass AND tgname = 'leads_stats') THEN
+        CREATE TRIGGER leads_stats AFTER INSERT OR UPDATE OR DELETE ON leads
+            FOR EACH ROW EXECUTE FUNCTION update_lead_stats();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'leads'::regclass AND tgname = 'leads_version') THEN
+        CREATE TRIGGER leads_version AFTER INSERT OR UPDATE OR DELETE ON leads
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_lead_version();
+    END IF;
+END;
+$$;
+"""
+# Serializes concurrent opens: CREATE OR REPLACE FUNCTION fails if two sessions replace one function at once.
+POSTGRES_MIGRATION_LOCK = 7436017
+# Held while folding lead_stat_deltas into lead_stats, so only one reader folds at a time.
+POSTGRES_FOLD_LOCK = 7436018
+POSTGRES_FOLD_STATS = """
+WITH folded AS (DELETE FROM lead_stat_deltas RETURNING key, delta)
+INSERT INTO lead_stats (key, value) SELECT key, SUM(delta) FROM folded GROUP BY key
+ON CONFLICT (key) DO UPDATE SET value = lead_stats.value + excluded.value
+"""
+
+def normalize_email(address):
+    """Canonical form of an address: lowercase, no display name, no +tag, no dots for Gmail."""
+    address = parseaddr(address or "")[1].strip().lower()
+    if "@" not in address:
+        return ""
+    local, domain = address.rsplit("@", 1)
+    local = local.split("+", 1)[0]
+    if domain in GMAIL_DOMAINS:
+        local, domain = local.replace(".", ""), "gmail.com"
+    return f"{local}@{domain}"
+
+def _email_key(email):
+    return (normalize_email(email) or None) if isinstance(email, str) else None
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+def lead_file_format(file_path):
+    """"parquet", "feather" (Arrow IPC) or "csv", from the file's magic bytes rather than its name."""
+    with open(file_path, "rb") as f:
+        head = f.read(len(ARROW_MAGIC))
+    if head.startswith(PARQUET_MAGIC):
+        return "parquet"
+    if head == ARROW_MAGIC:
+        return "feather"
+    return "csv"
+
+def lead_file_columns(file_path):
+    """Column names of a lead file, without reading its rows."""
+    file_format = lead_file_format(file_path)
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(file_path).schema_arrow.names
+    if file_format == "feather":
+        import pyarrow.feather as feather
+        return feather.read_table(file_path, memory_map=True).schema.names
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+def compact_dtypes(df):
+    """Turns the repetitive text columns into categoricals (typically a fraction of the object-dtype memory)."""
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype) \
+                and pd.api.types.is_string_dtype(df[column].dtype):
+            df[column] = df[column].astype("category")
+    return df
+
+def load_df(file_path, columns=None, compact=True):
+    """Reads a lead file in CSV, Parquet or Feather format, detected from its contents.
+
+    With ``columns`` only those columns are read (Parquet and Feather skip
+    the others on disk; missing ones are ignored). With ``compact``,
+    ``CATEGORICAL_COLUMNS`` come back as categoricals. A missing file reads
+    as an empty DataFrame.
+    """
+    if not os.path.exists(file_path):
+        return pd.DataFrame(columns=columns or [])
+    file_format = lead_file_format(file_path)
+    if columns is not None:
+        available = set(lead_file_columns(file_path))
+        columns = [c for c in columns if c in available]
+    if file_format == "parquet":
+        df = pd.read_parquet(file_path, columns=columns)
+    elif file_format == "feather":
+        df = pd.read_feather(file_path, columns=columns)
+    else:
+        dtype = {c: "category" for c in CATEGORICAL_COLUMNS} if compact else None
+        df = pd.read_csv(file_path, usecols=columns, dtype=dtype)
+    return compact_dtypes(df) if compact else df
+
+def save_df(df, file_path, file_format=None):
+    """Writes a lead file; the format comes from ``file_format`` or the extension (.parquet, .feather, else CSV)."""
+    if file_format is None:
+        extension = os.path.splitext(file_path)[1].lower()
+        file_format = next((name for name, ext in FILE_EXTENSIONS.items() if ext == extension), "csv")
+    if file_format == "csv":
+        df.to_csv(file_path, index=False)
+    elif file_format == "parquet":
+        compact_dtypes(df.copy()).to_parquet(file_path, index=False)
+    elif file_format == "feather":
+        compact_dtypes(df.reset_index(drop=True)).to_feather(file_path)
+    else:
+        raise ValueError(f"Unknown lead file format: {file_format}")
+
+def lead_file(directory, file_name):
+    """Path of a hand-off file, preferring a Parquet/Feather copy (``outbox.parquet``) over the CSV."""
+    stem = os.path.join(directory, os.path.splitext(file_name)[0])
+    for extension in (FILE_EXTENSIONS["parquet"], FILE_EXTENSIONS["feather"]):
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return stem + FILE_EXTENSIONS["csv"]
+
+def _records(df, columns):
+    """DataFrame rows as tuples with NaN turned into NULL."""
+    values = df[columns].astype(object)
+    return list(values.where(values.notna(), None).itertuples(index=False, name=None))
+
+class LeadStore:
+    """Lead table shared by every pipeline stage.
+
+    Stages read the leads they need by status and write back single rows or
+    batches; a status change is one indexed UPDATE instead of a rewrite of a
+    whole CSV. SQLite runs in WAL mode so the Streamlit apps can read while
+    the workers write.
+    """
+
+    def __init__(self, path=LEADS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self.postgres = path.startswith(("postgres://", "postgresql://"))
+        if self.postgres:
+            import psycopg2
+            self.conn = psycopg2.connect(path)
+            self.placeholder = "%s"
+            self._migrate_postgres()
+        else:
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            existing = {row[1] for row in self.conn.execute("PRAGMA table_info(leads)")}
+            for column, column_type in ADDED_COLUMNS.items():
+                if existing and column not in existing:
+                    self.conn.execute(f"ALTER TABLE leads ADD COLUMN {column} {column_type}")
+            self.conn.executescript(SQLITE_SCHEMA)
+            self.conn.executescript(SQLITE_STATS_SCHEMA)
+            self.conn.commit()
+            self.placeholder = "?"
+            if self.version() is None:
+                self.rebuild_stats()
+            if existing and "email_key" not in existing:
+                self._backfill_email_keys()
+
+    def _migrate_postgres(self):
+        """Creates or updates the schema (``POSTGRES_SCHEMA``) and backfills the counters of a database that had none."""
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (POSTGRES_MIGRATION_LOCK,))
+            cursor.execute("SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema()"
+                           " AND table_name = 'leads' AND column_name IN ('id', 'email_key')")
+            backfill_emails = cursor.rowcount == 1 # the leads table exists, without email_key
+            cursor.execute(POSTGRES_SCHEMA)
+            cursor.execute("SELECT 1 FROM lead_stats UNION ALL SELECT 1 FROM lead_stat_deltas LIMIT 1")
+            backfill = cursor.fetchone() is None
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if backfill:
+            self.rebuild_stats()
+        if backfill_emails:
+            self._backfill_email_keys()
+
+    def _backfill_email_keys(self):
+        """Fills ``email_key`` for the leads stored before the column existed."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT id, email FROM leads WHERE email IS NOT NULL")
+            rows = [(_email_key(email), lead_id) for lead_id, email in cursor.fetchall()]
+        self._execute("UPDATE leads SET email_key = ? WHERE id = ?", [row for row in rows if row[0]], many=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _sql(self, query):
+        return query.replace("?", self.placeholder)
+
+    def _execute(self, query, params=(), many=False):
+        with self._lock:
+            cursor = self.conn.cursor()
+            if many:
+                cursor.executemany(self._sql(query), params)
+            else:
+                cursor.execute(self._sql(query), params)
+            self.conn.commit()
+            return cursor.rowcount
+
+    def _transaction(self, statements):
+        """Runs ``[(query, params), ...]`` and commits them together, or not at all."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            try:
+                for query, params in statements:
+                    cursor.execute(self._sql(query), params)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    # --- Writes ---
+
+    def upsert_leads(self, df, status=None):
+        """Inserts or updates leads keyed on profile_url, in one batch.
+
+        Only the columns present in ``df`` are written, and empty values never
+        overwrite stored ones. New rows start as ``status`` (default "new");
+        existing rows keep their status unless ``status`` is given.
+        """
+        if df is None or df.empty:
+            return 0
+        df = df.copy()
+        if status is not None:
+            df["status"] = status
+        elif "status" not in df.columns:
+            df["status"] = None
+        if "email" in df.columns:
+            df["email_key"] = df["email"].map(_email_key)
+        columns = [c for c in LEAD_COLUMNS + ["email_key"] if c in df.columns]
+        updates = [c for c in columns if c != "profile_url" and (c != "status" or status is not None)]
+        insert_values = ", ".join(
+            "COALESCE(?, 'new')" if c == "status" else "?" for c in columns
+        )
+        query = f"INSERT INTO leads ({', '.join(columns)}) VALUES ({insert_values})"
+        if "profile_url" in columns and updates:
+            query += " ON CONFLICT (profile_url) DO UPDATE SET " + ", ".join(
+                f"{c} = COALESCE(excluded.{c}, leads.{c})" for c in updates
+            )
+        elif "profile_url" in columns:
+            query += " ON CONFLICT (profile_url) DO NOTHING"
+        return self._execute(query, _records(df, columns), many=True)
+
+    def update_leads(self, lead_ids, **fields):
+        """Sets ``fields`` (e.g. status, draft_msg, last_contact) on one id or a list of ids."""
+        if not isinstance(lead_ids, (list, tuple, set, pd.Index, pd.Series)):
+            lead_ids = [lead_ids]
+        lead_ids = [int(lead_id) for lead_id in lead_ids]
+        if not lead_ids or not fields:
+            return 0
+        if "email" in fields:
+            fields["email_key"] = _email_key(fields["email"])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        values = list(fields.values())
+        return self._execute(
+            f"UPDATE leads SET {assignments} WHERE id = ?",
+            [(*values, lead_id) for lead_id in lead_ids], many=True,
+        )
+
+    def set_status(self, lead_ids, status, **fields):
+        return self.update_leads(lead_ids, status=status, **fields)
+
+    def set_drafts(self, drafts, status=STATUS_PENDING, from_status=STATUS_NEW):
+        """Stores ``{lead_id: draft}`` and moves those leads to ``status`` in one batch.
+
+        Only leads still in ``from_status`` are changed, so a lead that was
+        reviewed, sent or replied to in the meantime is never sent back to
+        review. Returns the number of leads updated.
+        """
+        return self._execute(
+            "UPDATE leads SET draft_msg = ?, status = ? WHERE id = ? AND status = ?",
+            [(draft, status, int(lead_id), from_status) for lead_id, draft in drafts.items()], many=True,
+        ) if drafts else 0
+
+    def review(self, decisions, from_status=STATUS_PENDING):
+        """Applies ``{lead_id: (status, draft_msg or None)}`` review decisions in one batched transaction.
+
+        Only leads still in ``from_status`` are changed, so a decision made
+        elsewhere in the meantime is not overwritten; a ``None`` draft keeps
+        the stored one. Returns the number of leads updated.
+        """
+        return self._execute(
+            "UPDATE leads SET status = ?, draft_msg = COALESCE(?, draft_msg) WHERE id = ? AND status = ?",
+            [(status, draft, int(lead_id), from_status) for lead_id, (status, draft) in decisions.items()], many=True,
+        ) if decisions else 0
+
+    def add_reply_keys(self, lead_id, keys):
+        """Points each reply-matching key (see reply_index.py) at ``lead_id``."""
+        return self._execute(
+            "INSERT INTO reply_keys (key, lead_id) VALUES (?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET lead_id = excluded.lead_id",
+            [(key, int(lead_id)) for key in keys], many=True,
+        )
+
+    # --- Delivery journal ---
+
+    def begin_delivery(self, key, lead_id, channel):
+        """Claims ``key`` before sending. Returns False if it was delivered, or left in doubt by a crash."""
+        return self._execute(
+            "INSERT INTO deliveries (key, lead_id, channel, state, attempted_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET state = excluded.state, attempted_at = excluded.attempted_at, error = NULL"
+            " WHERE deliveries.state = ?",
+            (key, int(lead_id), channel, DELIVERY_SENDING, now_iso(), DELIVERY_FAILED),
+        ) == 1
+
+    def complete_delivery(self, key, lead_id, ok, error=None, message_id=None):
+        """Journals the outcome of a send and, if it went out, marks the lead sent in the same transaction."""
+        now = now_iso()
+        statements = [(
+            "UPDATE deliveries SET state = ?, delivered_at = ?, message_id = ?, error = ? WHERE key = ?",
+            (DELIVERY_DELIVERED if ok else DELIVERY_FAILED, now if ok else None, message_id, error, key),
+        )]
+        if ok:
+            statements.append(("UPDATE leads SET status = ?, last_contact = ? WHERE id = ?", (STATUS_SENT, now, int(lead_id))))
+        self._transaction(statements)
+
+    def delivery_states(self, keys):
+        """``{key: state}`` for the journaled keys among ``keys``."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(self._sql(
+                f"SELECT key, state FROM deliveries WHERE key IN ({', '.join('?' for _ in keys)})"
+            ), keys)
+            return dict(cursor.fetchall())
+
+    # --- Job idempotency (see jobqueue.Worker) ---
+
+    def jobs_done(self, keys):
+        """The keys among ``keys`` whose jobs have already finished."""
+        keys = list(keys)
+        if not keys:
+            return set()
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(self._sql(
+                f"SELECT key FROM processed_jobs WHERE key IN ({', '.join('?' for _ in keys)})"
+            ), keys)
+            return {row[0] for row in cursor.fetchall()}
+
+    def mark_jobs_done(self, keys):
+        """Records ``keys`` as finished, so redelivered copies of their jobs are skipped."""
+        now = now_iso()
+        return self._execute(
+            "INSERT INTO processed_jobs (key, finished_at) VALUES (?, ?) ON CONFLICT (key) DO NOTHING",
+            [(key, now) for key in keys], many=True,
+        )
+
+    # --- Reads ---
+
+    def _where(self, status=None, search=None, reply_category=None):
+        """SQL filter and parameters for ``leads``/``count_leads``."""
+        clauses, params = [], []
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            clauses.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            params.extend(statuses)
+        if reply_category is not None:
+            clauses.append("reply_category = ?")
+            params.append(reply_category)
+        if search:
+            clauses.append("(" + " OR ".join(f"LOWER({c}) LIKE ?" for c in SEARCH_COLUMNS) + ")")
+            params.extend([f"%{search.lower()}%"] * len(SEARCH_COLUMNS))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def leads(self, status=None, columns=None, limit=None, offset=0, search=None, reply_category=None, newest_first=False,
+              after_id=None):
+        """Returns leads as a DataFrame with an ``id`` column.
+
+        Optionally restricted to one or more statuses, a reply category and a
+        case-insensitive ``search`` over name/company/headline/school/email;
+        only ``columns`` are read, and ``limit``/``offset`` select one page.
+        ``after_id`` pages by key instead (ids greater than it), which stays
+        one index seek however deep into the table the page is.
+        """
+        selected = ", ".join(["id"] + [c for c in (columns or LEAD_COLUMNS) if c != "id"])
+        where, params = self._where(status, search, reply_category)
+        if after_id is not None:
+            where += (" AND" if where else " WHERE") + " id > ?"
+            params.append(int(after_id))
+        query = f"SELECT {selected} FROM leads{where} ORDER BY id{' DESC' if newest_first else ''}"
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([int(limit), int(offset)])
+        with self._lock:
+            return pd.read_sql_query(self._sql(query), self.conn, params=params)
+
+    def count_leads(self, status=None, search=None, reply_category=None):
+        """Number of leads ``leads()`` would return for the same filters (unpaginated)."""
+        if not search and reply_category is None:
+            counts = self.count_by_status()
+            if status is None:
+                return sum(counts.values())
+            return sum(counts.get(s, 0) for s in ([status] if isinstance(status, str) else status))
+        where, params = self._where(status, search, reply_category)
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(self._sql(f"SELECT COUNT(*) FROM leads{where}"), params)
+            return cursor.fetchone()[0]
+
+    def get_lead(self, lead_id):
+        leads = self.leads_by_ids([lead_id])
+        return None if leads.empty else leads.iloc[0].to_dict()
+
+    def leads_by_ids(self, lead_ids):
+        lead_ids = [int(lead_id) for lead_id in lead_ids]
+        if not lead_ids:
+            return self.leads(limit=0)
+        query = f"SELECT id, {', '.join(LEAD_COLUMNS)} FROM leads WHERE id IN ({', '.join('?' for _ in lead_ids)})"
+        with self._lock:
+            return pd.read_sql_query(self._sql(query), self.conn, params=lead_ids)
+
+    def ids_by_profile_url(self, profile_urls):
+        """``{profile_url: id}`` for the stored leads among ``profile_urls``."""
+        profile_urls = [url for url in profile_urls if isinstance(url, str)]
+        if not profile_urls:
+            return {}
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(self._sql(
+                f"SELECT profile_url, id FROM leads WHERE profile_url IN ({', '.join('?' for _ in profile_urls)})"
+            ), profile_urls)
+            return dict(cursor.fetchall())
+
+    def _stats(self, prefix):
+        with self._lock:
+            cursor = self.conn.cursor()
+            if not self.postgres:
+                cursor.execute("SELECT key, value FROM lead_stats WHERE key LIKE ? AND value > 0", (prefix + "%",))
+                return {key[len(prefix):]: value for key, value in cursor.fetchall()}
+            try:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (POSTGRES_FOLD_LOCK,))
+                if cursor.fetchone()[0]: # else another reader is folding; the deltas are summed below either way
+                    cursor.execute(POSTGRES_FOLD_STATS)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            cursor.execute(
+                "SELECT key, SUM(value)::BIGINT FROM (SELECT key, value FROM lead_stats"
+                " UNION ALL SELECT key, delta FROM lead_stat_deltas) AS stats"
+                " WHERE key LIKE %s GROUP BY key HAVING SUM(value) > 0", (prefix + "%",))
+            stats = {key[len(prefix):]: value for key, value in cursor.fetchall()}
+            self.conn.commit()
+            return stats
+
+    def count_by_status(self):
+        """Leads per status, read from the materialized counters (no table scan)."""
+        return self._stats("status:")
+
+    def version(self):
+        """A number that changes whenever any lead is written; None before the counters exist."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            if self.postgres:
+                cursor.execute("SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM lead_version")
+            else:
+                cursor.execute("SELECT value FROM lead_stats WHERE key = 'version'")
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def rebuild_stats(self):
+        """Recomputes the funnel counters from the lead table (e.g. for a database created before them)."""
+        self._transaction([
+            # Postgres: hold off writers and folds until the recount commits (SQLite's write lock already does).
+            *([("LOCK TABLE leads IN SHARE MODE", ()), ("SELECT pg_advisory_xact_lock(?)", (POSTGRES_FOLD_LOCK,)),
+               ("DELETE FROM lead_stat_deltas", ())] if self.postgres else []),
+            ("DELETE FROM lead_stats", ()),
+            ("INSERT INTO lead_stats (key, value) SELECT 'status:' || status, COUNT(*) FROM leads GROUP BY status", ()),
+            ("INSERT INTO lead_stats (key, value) SELECT 'reply:' || COALESCE(reply_category, ''), COUNT(*) FROM leads"
+             " WHERE status = ? GROUP BY COALESCE(reply_category, '')", (STATUS_REPLIED,)),
+            *([] if self.postgres else [("INSERT INTO lead_stats (key, value) VALUES ('version', 0)", ())]),
+        ])
+
+    def reply_keys(self, keys=None):
+        """Stored ``(key, lead_id)`` reply-matching pairs: those of ``keys`` (primary-key lookups), or every pair."""
+        with self._lock:
+            cursor = self.conn.cursor()
+            if keys is None:
+                cursor.execute("SELECT key, lead_id FROM reply_keys")
+            else:
+                keys = list(keys)
+                if not keys:
+                    return []
+                cursor.execute(self._sql(f"SELECT key, lead_id FROM reply_keys WHERE key IN ({', '.join('?' * len(keys))})"), keys)
+            return cursor.fetchall()
+
+    def lead_id_by_email(self, email, status=None):
+        """Id of the newest lead whose normalized email is ``normalize_email(email)`` (optionally in ``status``), or None."""
+        email_key = _email_key(email)
+        if not email_key:
+            return None
+        statuses = [] if status is None else [status] if isinstance(status, str) else list(status)
+        query = "SELECT id FROM leads WHERE email_key = ?"
+        if statuses:
+            query += f" AND status IN ({', '.join('?' * len(statuses))})"
+        with self._lock:
+            cursor = self.conn.cursor()
+            cursor.execute(self._sql(query + " ORDER BY id DESC LIMIT 1"), [email_key, *statuses])
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+    def count_by_reply_category(self):
+        """Replied leads per reply category, from the materialized counters ("" for uncategorized)."""
+        return self._stats("reply:")
+
+    # --- CSV compatibility ---
+
+    def import_csv(self, file_path, status=None):
+        """Upserts the rows of a pipeline lead file (CSV, Parquet or Feather). Returns the number of rows read."""
+        if not os.path.exists(file_path):
+            return 0
+        df = load_df(file_path)
+        self.upsert_leads(df, status=status)
+        return len(df)
+
+    def export_csv(self, file_path, status=None):
+        """Writes leads (optionally one status) in the old hand-off layout, as CSV or by extension Parquet/Feather."""
+        df = self.leads(status=status).drop(columns=["id"])
+        save_df(df, file_path)
+        return len(df)
+
+def import_all_csvs(store, directory="."):
+    """Imports the CSV hand-off files in pipeline order, so later stages win."""
+    for file_name, status in CSV_FILES:
+        file_path = lead_file(directory, file_name)
+        # leads_with_drafts.csv carries review decisions in its own status column
+        keep_own_status = file_name == "leads_with_drafts.csv" and os.path.exists(file_path) \
+            and "status" in lead_file_columns(file_path)
+        count = store.import_csv(file_path, status=None if keep_own_status else status)
+        if count:
+            print(f"Imported {count} rows from {os.path.basename(file_path)}")
+
+def export_all_csvs(store, directory=".", file_format=LEAD_FILE_FORMAT):
+    """Writes the hand-off files from the store, as CSV or (``file_format="parquet"``) Parquet."""
+    exports = [
+        ("leads_processed.csv", None),
+        ("leads_with_drafts.csv", [STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED, STATUS_SENT]),
+        ("outbox.csv", STATUS_APPROVED),
+        ("sent.csv", STATUS_SENT),
+    ]
+    for file_name, status in exports:
+        file_name = os.path.splitext(file_name)[0] + FILE_EXTENSIONS[file_format]
+        count = store.export_csv(os.path.join(directory, file_name), status=status)
+        print(f"Exported {count} rows to {file_name}")
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    with LeadStore() as store:
+        if command == "import":
+            import_all_csvs(store)
+        elif command == "export":
+            export_all_csvs(store)
+        else:
+            print("Usage: python src/storage.py [import|export]")
+            print(f"Leads by status in {LEADS_DB}: {store.count_by_status()}")
@@ -0,0 +1,351 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+from collections import defaultdict
+from email.utils import parseaddr
+from dotenv import load_dotenv
+import metrics
+from prompts import batch_max_tokens, compact_reply, count_message_tokens, count_tokens, truncate_tokens
+
+load_dotenv()
+
+# --- Triage Settings ---
+TRIAGE_MODEL = os.getenv("TRIAGE_MODEL", "gpt-4")
+TRIAGE_BATCH_SIZE = int(os.getenv("TRIAGE_BATCH_SIZE", "20")) # ambiguous replies per LLM request
+TRIAGE_CACHE_FILE = os.getenv("TRIAGE_CACHE_FILE", "triage_cache.sqlite")
+TRIAGE_MIN_CONFIDENCE = float(os.getenv("TRIAGE_MIN_CONFIDENCE", "0.8"))
+TRIAGE_INPUT_TOKENS = int(os.getenv("TRIAGE_INPUT_TOKENS", "400")) # per reply body sent to the LLM
+TRIAGE_MAX_TOKENS = int(os.getenv("TRIAGE_MAX_TOKENS", "4")) # per label: the answer is one digit
+
+# --- Categories ---
+INTERESTED = "interested"
+BUSY = "busy"
+DECLINE = "decline"
+FOLLOW_UP = "needs-follow-up"
+AUTO_REPLY = "auto-reply"   # out-of-office and other machine replies, never sent to the LLM
+BOUNCE = "bounce"           # delivery failures
+ERROR = "Error"
+
+# The LLM prompt's numeric labels.
+LLM_CATEGORIES = {"1": INTERESTED, "2": BUSY, "3": DECLINE, "4": FOLLOW_UP}
+
+# Tiers, cheapest first.
+TIER_HEADERS = "headers"
+TIER_LOCAL = "local"
+TIER_CACHE = "cache"
+TIER_LLM = "llm"
+TIERS = [TIER_HEADERS, TIER_LOCAL, TIER_CACHE, TIER_LLM]
+
+TRIAGE_PROMPT = (
+    "Categorize this email reply as: 1=interested, 2=busy, 3=decline, 4=needs-follow-up.\n"
+    "The email is:\n---\n{body}\n---\nCategory:"
+)
+BATCH_TRIAGE_PROMPT = (
+    "Categorize each email reply as: 1=interested, 2=busy, 3=decline, 4=needs-follow-up. "
+    "Reply with only a JSON object mapping each reply id to its category number."
+)
+
+# --- Header heuristics ---
+BOUNCE_SENDERS = re.compile(r"^(mailer-daemon|postmaster)@", re.IGNORECASE)
+BOUNCE_SUBJECTS = re.compile(
+    r"(delivery status notification|undeliverable|undelivered mail|mail delivery (failed|failure|subsystem)|returned mail)",
+    re.IGNORECASE,
+)
+AUTO_REPLY_SUBJECTS = re.compile(r"^\s*(automatic reply|auto[- ]?reply|auto:|out of (the )?office)", re.IGNORECASE)
+AUTO_PRECEDENCE = {"auto_reply", "bulk", "junk", "list"}
+
+# --- Text classifier ---
+# Weighted phrase patterns per category. A short reply that hits one category
+# clearly is labelled locally; anything mixed, long or unmatched goes to the LLM.
+PATTERNS = {
+    AUTO_REPLY: [
+        (r"\b(i am|i'm|i will be) (currently )?(out of (the )?office|away|on (annual |parental |medical )?leave|on vacation|travell?ing)\b", 1.0),
+        (r"\blimited access to (my )?e-?mail\b", 0.8),
+        (r"\bthis is an automated (reply|response|message)\b", 1.0),
+    ],
+    DECLINE: [
+        (r"\bnot interested\b", 1.0),
+        (r"\bno,? thanks?( you)?\b", 0.9),
+        (r"\b(unsubscribe|remove me|stop (e-?mailing|messaging|contacting) me|do not contact)\b", 1.0),
+        (r"\b(i'll|i will|i'd|i would|going to) (have to |need to )?pass\b", 0.9),
+        (r"\bnot (a good fit|the right person|hiring)\b", 0.7),
+    ],
+    BUSY: [
+        (r"\b(too busy|swamped|slammed|underwater|hectic)\b", 0.9),
+        (r"\b(bad|busy) time\b", 0.8),
+        (r"\b(reach out|ping me|circle back|follow up|try me) (again )?(next|in a few|after|later)\b", 0.9),
+        (r"\bno (bandwidth|capacity)\b", 0.8),
+    ],
+    INTERESTED: [
+        (r"\b(happy|glad|love|would love|keen) to (chat|talk|connect|help|meet)\b", 1.0),
+        (r"\b(sounds (good|great)|let'?s (chat|talk|do it|set (it|something) up))\b", 0.9),
+        (r"\b(here is|here's) my calendly\b|\bcalendly\.com/", 1.0),
+        (r"^\s*(yes|sure|absolutely|definitely)\b", 0.8),
+        (r"\bwhat times? (works|work) (for you|best)\b", 0.9),
+    ],
+}
+COMPILED_PATTERNS = {
+    category: [(re.compile(pattern, re.IGNORECASE | re.MULTILINE), weight) for pattern, weight in patterns]
+    for category, patterns in PATTERNS.items()
+}
+SIGNATURE_KEEP = [pattern for patterns in COMPILED_PATTERNS.values() for pattern, _ in patterns]
+QUESTION = re.compile(r"\?")
+MAX_LOCAL_WORDS = 60 # longer bodies are too nuanced for phrase matching
+
+def normalize_body(body):
+    """The reply's own text: quoted history and signature dropped, whitespace collapsed.
+
+    Lines under a sign-off that match a triage phrase are never taken for a signature.
+    """
+    return compact_reply(body, keep=SIGNATURE_KEEP)
+
+def body_key(body, model):
+    return hashlib.sha256(f"{model}\n{normalize_body(body).lower()}".encode("utf-8")).hexdigest()
+
+def classify_headers(headers):
+    """Returns BOUNCE or AUTO_REPLY when the headers alone identify a machine reply, else None."""
+    headers = {name.lower(): value for name, value in (headers or {}).items()}
+    sender = parseaddr(headers.get("from", ""))[1]
+    subject = headers.get("subject", "")
+    if BOUNCE_SENDERS.match(sender) or BOUNCE_SUBJECTS.search(subject) \
+            or "report-type=delivery-status" in headers.get("content-type", "").lower().replace(" ", ""):
+        return BOUNCE
+    auto_submitted = headers.get("auto-submitted", "").strip().lower()
+    if (auto_submitted and auto_submitted != "no") or "x-autoreply" in headers or "x-autorespond" in headers \
+            or headers.get("precedence", "").strip().lower() in AUTO_PRECEDENCE \
+            or AUTO_REPLY_SUBJECTS.search(subject):
+        return AUTO_REPLY
+    return None
+
+def classify_text(body):
+    """Scores a reply against the phrase patterns. Returns ``(category, confidence)``.
+
+    Confidence is the winning category's score minus the runner-up's, capped
+    at 1 and reduced for longer replies or ones that ask a question (which
+    usually need a human follow-up rather than a canned label).
+    """
+    text = normalize_body(body)
+    if not text:
+        return None, 0.0
+    scores = {
+        category: sum(weight for pattern, weight in patterns if pattern.search(text))
+        for category, patterns in COMPILED_PATTERNS.items()
+    }
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (category, best), (_, runner_up) = ranked[0], ranked[1]
+    if best == 0:
+        return None, 0.0
+    confidence = min(1.0, best - runner_up)
+    words = len(text.split())
+    if words > MAX_LOCAL_WORDS:
+        confidence *= 0.5
+    elif words > MAX_LOCAL_WORDS // 2:
+        confidence *= 0.85
+    if category != DECLINE and QUESTION.search(text):
+        confidence *= 0.7
+    return category, confidence
+
+def parse_llm_category(text):
+    """Maps an LLM answer such as "1", "1=interested" or "Decline" to a category."""
+    text = (text or "").strip().lower()
+    match = re.search(r"[1-4]", text)
+    if match:
+        return LLM_CATEGORIES[match.group(0)]
+    for category in LLM_CATEGORIES.values():
+        if category in text:
+            return category
+    return None
+
+def openai_complete(messages, model, max_tokens=None):
+    import openai # slow to import; replies the local tiers settle never need it
+    limits = {"max_tokens": max_tokens} if max_tokens else {}
+    response = openai.ChatCompletion.create(model=model, messages=messages, **limits)
+    metrics.record_usage("triage", model, response.get("usage"))
+    if response.choices[0].get("finish_reason") == "length":
+        metrics.count("triage", "length_limited")
+    return response.choices[0].message.content
+
+class TriageCache:
+    """SQLite cache of LLM triage labels keyed by a hash of the normalized reply body."""
+
+    def __init__(self, path=TRIAGE_CACHE_FILE):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS labels (key TEXT PRIMARY KEY, category TEXT NOT NULL, created REAL NOT NULL)")
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT category FROM labels WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, labels):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO labels (key, category, created) VALUES (?, ?, ?)",
+            [(key, category, now) for key, category in labels.items()],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+class ReplyTriage:
+    """Labels replies with the cheapest tier that is confident enough.
+
+    1. headers: bounces and auto-replies, from From/Subject/Auto-Submitted/Precedence.
+    2. local: phrase classifier for short, unambiguous replies.
+    3. cache: earlier LLM labels for the same (normalized) body.
+    4. llm: everything left, ``batch_size`` replies per request.
+
+    Bodies reach the LLM without quoted history or signature, cut to
+    ``input_tokens`` each, and the answer is capped at ``max_tokens`` per
+    reply. ``complete(messages, model, max_tokens)`` makes the request.
+
+    ``stats`` counts messages and time spent per tier for ``report()``, and
+    ``tokens`` the LLM input sent and trimmed away.
+    """
+
+    def __init__(self, complete=None, model=TRIAGE_MODEL, batch_size=TRIAGE_BATCH_SIZE, cache=None,
+                 min_confidence=TRIAGE_MIN_CONFIDENCE, input_tokens=TRIAGE_INPUT_TOKENS, max_tokens=TRIAGE_MAX_TOKENS):
+        self.complete = complete or openai_complete
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.cache = cache
+        self.min_confidence = min_confidence
+        self.input_tokens = input_tokens
+        self.max_tokens = max_tokens
+        self.stats = {tier: {"count": 0, "seconds": 0.0} for tier in TIERS}
+        self.tokens = {"input": 0, "trimmed": 0}
+        self.llm_requests = 0
+
+    def _record(self, tier, count, seconds):
+        self.stats[tier]["count"] += count
+        self.stats[tier]["seconds"] += seconds
+
+    def classify_local(self, body, headers=None):
+        """Returns ``(category, tier)`` from the local tiers, or ``(None, None)`` if the reply needs the LLM."""
+        start = time.perf_counter()
+        category = classify_headers(headers)
+        if category:
+            self._record(TIER_HEADERS, 1, time.perf_counter() - start)
+            return category, TIER_HEADERS
+        category, confidence = classify_text(body)
+        if category and confidence >= self.min_confidence:
+            self._record(TIER_LOCAL, 1, time.perf_counter() - start)
+            return category, TIER_LOCAL
+        return None, None
+
+    def triage_many(self, replies):
+        """Labels ``[(body, headers), ...]``, returning categories in input order."""
+        results = [None] * len(replies)
+        counts_before = {tier: stats["count"] for tier, stats in self.stats.items()}
+        escalate = defaultdict(list) # body key -> positions, so identical bodies share one LLM slot
+        bodies = {}
+        for position, (body, headers) in enumerate(replies):
+            category, _ = self.classify_local(body, headers)
+            if category:
+                results[position] = category
+                continue
+            key = body_key(body, self.model)
+            start = time.perf_counter()
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached:
+                self._record(TIER_CACHE, 1, time.perf_counter() - start)
+                results[position] = cached
+                continue
+            escalate[key].append(position)
+            if key not in bodies:
+                bodies[key] = truncate_tokens(normalize_body(body), self.input_tokens)
+                trimmed = count_tokens(body) - count_tokens(bodies[key])
+                self.tokens["trimmed"] += trimmed
+                metrics.count("triage", "trimmed_tokens", trimmed)
+
+        keys = list(escalate)
+        for offset in range(0, len(keys), self.batch_size):
+            chunk = keys[offset:offset + self.batch_size]
+            start = time.perf_counter()
+            labels = self._llm_batch({key: bodies[key] for key in chunk})
+            per_message = (time.perf_counter() - start) / sum(len(escalate[key]) for key in chunk)
+            if self.cache is not None:
+                self.cache.put_many({key: label for key, label in labels.items() if label != ERROR})
+            for key in chunk:
+                for position in escalate[key]:
+                    results[position] = labels.get(key, ERROR)
+                    self._record(TIER_LLM, 1, per_message)
+        for tier, stats in self.stats.items():
+            if stats["count"] > counts_before[tier]:
+                metrics.count("triage", tier, stats["count"] - counts_before[tier])
+        return results
+
+    def triage(self, body, headers=None):
+        return self.triage_many([(body, headers)])[0]
+
+    def _ask(self, messages, max_tokens):
+        self.llm_requests += 1
+        input_tokens = count_message_tokens(messages)
+        self.tokens["input"] += input_tokens
+        metrics.count("triage", "input_tokens", input_tokens)
+        with metrics.timer("triage", "openai"):
+            return self.complete(messages, self.model, max_tokens=max_tokens)
+
+    def _llm_batch(self, bodies):
+        """Labels ``{key: body}`` with one request, retrying any the batch answer missed one at a time."""
+        labels = {}
+        if len(bodies) > 1:
+            ids = {str(number): key for number, key in enumerate(bodies, 1)}
+            messages = [
+                {"role": "system", "content": BATCH_TRIAGE_PROMPT},
+                {"role": "user", "content": json.dumps({number: bodies[key] for number, key in ids.items()}, ensure_ascii=False)},
+            ]
+            try:
+                text = self._ask(messages, batch_max_tokens(self.max_tokens, len(bodies))).strip()
+                if text.startswith("```"):
+                    text = text.strip("`")
+                    text = text[text.find("{"):]
+                answers = json.loads(text)
+                for number, answer in answers.items() if isinstance(answers, dict) else []:
+                    category = parse_llm_category(str(answer))
+                    if number in ids and category:
+                        labels[ids[number]] = category
+            except Exception as e:
+                print(f"Error triaging batch of {len(bodies)} replies: {e}")
+                metrics.error("triage", "openai", e)
+        for key, body in bodies.items():
+            if key in labels:
+                continue
+            try:
+                text = self._ask([{"role": "user", "content": TRIAGE_PROMPT.format(body=body)}], self.max_tokens)
+                labels[key] = parse_llm_category(text) or ERROR
+            except Exception as e:
+                print(f"Error triaging reply: {e}")
+                metrics.error("triage", "openai", e)
+                labels[key] = ERROR
+        return labels
+
+    def report(self):
+        """Share of replies and mean latency per tier, e.g. for printing after a run."""
+        total = sum(tier["count"] for tier in self.stats.values())
+        return {
+            name: {
+                "count": tier["count"],
+                "fraction": tier["count"] / total if total else 0.0,
+                "mean_ms": 1000 * tier["seconds"] / tier["count"] if tier["count"] else 0.0,
+            }
+            for name, tier in self.stats.items()
+        }
+
+    def format_report(self):
+        lines = [f"Triage tiers ({self.llm_requests} LLM requests, {self.tokens['input']} input tokens, "
+                 f"{self.tokens['trimmed']} trimmed):"]
+        for name, tier in self.report().items():
+            lines.append(f"  {name:<8} {tier['count']:>6} replies  {tier['fraction']:6.1%}  {tier['mean_ms']:9.3f} ms/reply")
+        return "\n".join(lines)
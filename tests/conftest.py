@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules in src/ import each other as top-level modules (the way they
+# resolve when run as `python src/<module>.py`), so put src/ on the path.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# Keep metrics from test runs in memory instead of writing metrics.sqlite into the working tree.
+os.environ.setdefault("METRICS_FILE", "")
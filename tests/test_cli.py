@@ -0,0 +1,114 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+import cli
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# Seconds of imports allowed before the CLI can print its help; the heavy libraries below take ~0.2-1 s each.
+CLI_IMPORT_BUDGET = 0.3
+# Seconds of imports, besides the heavy libraries the run needs, allowed for a subcommand run with nothing to do.
+NOOP_IMPORT_BUDGET = 0.5
+HEAVY = ["pandas", "openai", "playwright", "yagmail", "googleapiclient", "google_auth_oauthlib", "streamlit", "boto3",
+         "sentry_sdk", "tiktoken"]
+
+def import_profile(code, cwd=SRC, excluding=(), **env):
+    """``(modules imported, total import seconds)`` for running ``code`` in a fresh interpreter, via ``-X importtime``.
+
+    The seconds leave out the time spent importing the ``excluding`` packages.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, capture_output=True, text=True,
+                            env=dict(os.environ, SENTRY_DSN="", PYTHONPATH=SRC, **env))
+    modules, total = set(), 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue # the header line
+        modules.add(name.strip())
+        if not name.startswith("  "): # top-level import: its cumulative time includes everything it pulled in
+            total += int(cumulative) / 1e6
+        if name.strip() in excluding:
+            total -= int(cumulative) / 1e6
+    return modules, total
+
+def heavy_imports(modules, allowed=()):
+    return sorted({m.split(".")[0] for m in modules} & set(HEAVY) - set(allowed))
+
+class TestCli(unittest.TestCase):
+
+    def test_help_stays_within_the_import_budget(self):
+        modules, seconds = import_profile("import cli\ntry:\n    cli.main(['--help'])\nexcept SystemExit:\n    pass")
+        self.assertIn("cli", modules)
+        self.assertEqual(heavy_imports(modules), [])
+        self.assertLess(seconds, CLI_IMPORT_BUDGET)
+
+    def test_stage_modules_import_only_what_their_stage_needs(self):
+        """
+        Test that a stage's module never loads another stage's heavy libraries, so e.g. a cron triage run
+        with no new mail does not pay for pandas or openai.
+        """
+        needs = {
+            "inbox_listener": ["googleapiclient"],
+            "triage": [],
+            "jobqueue": [],
+            "personalize": ["pandas"],
+            "sender": ["pandas"],
+            "lead_gen": ["pandas"],
+        }
+        for module, allowed in needs.items():
+            with self.subTest(module=module):
+                modules, _ = import_profile(f"import {module}")
+                self.assertIn(module, modules)
+                self.assertEqual(heavy_imports(modules, allowed), [])
+
+    def test_subcommands_with_nothing_to_do_stay_within_the_import_budget(self):
+        """
+        Test that a subcommand run against an empty lead store and job queue only loads the libraries that
+        run needs, e.g. an empty outbox never loads Playwright or yagmail.
+        """
+        needs = {
+            ("scrape", "--help"): ["pandas"],
+            ("enrich",): ["pandas"],
+            ("personalize",): ["pandas"],
+            ("personalize", "--worker", "--exit-when-idle"): ["pandas"],
+            ("send",): ["pandas"],
+            ("send", "--worker", "--exit-when-idle"): ["pandas"],
+            ("triage",): ["googleapiclient"], # no credentials.json
+        }
+        for argv, allowed in needs.items():
+            with self.subTest(argv=argv), tempfile.TemporaryDirectory() as workdir:
+                code = f"import cli\ntry:\n    cli.main({list(argv)!r})\nexcept SystemExit:\n    pass"
+                # Best of two runs, so a busy machine does not fail the budget.
+                (modules, seconds), (_, rerun_seconds) = [
+                    import_profile(code, cwd=workdir, excluding=allowed, OPENAI_API_KEY="", SENDING_METHOD="linkedin")
+                    for _ in range(2)
+                ]
+                self.assertIn("cli", modules)
+                self.assertEqual(heavy_imports(modules, allowed), [])
+                self.assertLess(min(seconds, rerun_seconds), NOOP_IMPORT_BUDGET)
+
+    def test_subcommands_run_their_stage_with_the_remaining_arguments(self):
+        with patch("lead_gen.main") as lead_gen_main, patch("sender.main") as sender_main, patch.object(sys, "argv", ["pytest"]):
+            cli.main(["enrich"])
+            cli.main(["send", "--worker", "--exit-when-idle"])
+        lead_gen_main.assert_called_once_with(["--enrich-only"])
+        sender_main.assert_called_once_with(["--worker", "--exit-when-idle"])
+
+    def test_streamlit_apps_are_served_from_src(self):
+        command = cli.streamlit_command("review_ui.py", ["--server.port=8080"])
+        self.assertEqual(command[1:4], ["-m", "streamlit", "run"])
+        self.assertEqual(command[4:], [os.path.join(SRC, "review_ui.py"), "--server.port=8080"])
+
+    def test_unknown_or_missing_subcommands_are_usage_errors(self):
+        for argv in ([], ["bogus"]):
+            with self.subTest(argv=argv), self.assertRaises(SystemExit) as raised, patch("sys.stderr"):
+                cli.main(argv)
+            self.assertEqual(raised.exception.code, 2)
+
+if __name__ == '__main__':
+    unittest.main()
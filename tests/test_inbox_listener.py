@@ -0,0 +1,262 @@
+import base64
+import os
+import tempfile
+import unittest
+import pandas as pd
+from jobqueue import EnqueueError
+from reply_index import ReplyIndex
+from storage import LeadStore, STATUS_APPROVED, STATUS_REPLIED
+from src.inbox_listener import (GmailSyncState, enqueue_new_messages, fetch_new_messages, parse_message,
+                                triage_job_handler, triage_messages)
+
+class FakeRequest:
+    def __init__(self, fn, page=0):
+        self.fn = fn
+        self.page = page
+
+    def execute(self):
+        return self.fn(self.page)
+
+class HistoryGone(Exception):
+    """Shaped like googleapiclient's HttpError for an expired startHistoryId."""
+
+    class resp:
+        status = 404
+
+class FakeGmail:
+    """Minimal stand-in for the Gmail service object returned by googleapiclient.discovery.build."""
+
+    PAGE_SIZE = 2
+
+    def __init__(self):
+        self.history_id = 100
+        self.oldest_history_id = 100
+        self.store = {}
+        self.unread = []
+        self.changes = []
+        self.batches = 0
+        self.direct_gets = 0
+
+    def deliver(self, msg_id, sender, body, unread=True):
+        self.history_id += 1
+        data = base64.urlsafe_b64encode(body.encode()).decode()
+        self.store[msg_id] = {"id": msg_id, "payload": {"headers": [{"name": "From", "value": sender}], "body": {"data": data}}}
+        self.changes.append((self.history_id, msg_id))
+        if unread:
+            self.unread.append(msg_id)
+
+    # --- service.users() ---
+    def users(self):
+        return self
+
+    def getProfile(self, userId):
+        return FakeRequest(lambda page: {"historyId": str(self.history_id)})
+
+    def messages(self):
+        return FakeMessages(self)
+
+    def history(self):
+        return FakeHistory(self)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+class FakeMessages:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, q):
+        def page_of(page):
+            ids = self.gmail.unread[page * FakeGmail.PAGE_SIZE:(page + 1) * FakeGmail.PAGE_SIZE]
+            result = {"messages": [{"id": msg_id} for msg_id in ids]}
+            if (page + 1) * FakeGmail.PAGE_SIZE < len(self.gmail.unread):
+                result["nextPageToken"] = str(page + 1)
+            return result
+        return FakeRequest(page_of)
+
+    def list_next(self, request, results):
+        return FakeRequest(request.fn, request.page + 1) if "nextPageToken" in results else None
+
+    def get(self, userId, id):
+        def fetch(page):
+            self.gmail.direct_gets += 1
+            return self.gmail.store[id]
+        return FakeRequest(fetch)
+
+class FakeHistory:
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId, startHistoryId, historyTypes, labelId):
+        def fetch(page):
+            if int(startHistoryId) < self.gmail.oldest_history_id:
+                raise HistoryGone("startHistoryId too old")
+            return {
+                "history": [{"id": str(h), "messagesAdded": [{"message": {"id": m}}]}
+                            for h, m in self.gmail.changes if h > int(startHistoryId)],
+                "historyId": str(self.gmail.history_id),
+            }
+        return FakeRequest(fetch)
+
+    def list_next(self, request, results):
+        return None
+
+class FakeBatch:
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.gmail.batches += 1
+        for request_id, request in self.requests:
+            self.callback(request_id, request.fn(0), None)
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state = GmailSyncState(os.path.join(tmp.name, "sync.sqlite"))
+        self.addCleanup(self.state.close)
+        self.gmail = FakeGmail()
+
+    def sync(self):
+        messages, history_id = fetch_new_messages(self.gmail, self.state)
+        for msg in messages:
+            self.state.mark_processed(msg["id"])
+        self.state.history_id = history_id
+        return [msg["id"] for msg in messages]
+
+    def test_first_run_syncs_unread_then_only_new_mail(self):
+        """
+        Test that later runs only fetch mail that arrived since the saved historyId.
+        """
+        for i in range(5):
+            self.gmail.deliver(f"m{i}", "lead@example.com", "Sounds good!")
+
+        self.assertEqual(self.sync(), ["m0", "m1", "m2", "m3", "m4"])
+        self.assertEqual(self.sync(), [])
+
+        self.gmail.deliver("m5", "lead@example.com", "Let's talk")
+        self.assertEqual(self.sync(), ["m5"])
+
+    def test_bodies_are_fetched_in_batches(self):
+        """
+        Test that message bodies come from batch requests, not one round-trip each.
+        """
+        for i in range(120):
+            self.gmail.deliver(f"m{i}", "lead@example.com", "Hi")
+
+        self.assertEqual(len(self.sync()), 120)
+        self.assertEqual(self.gmail.batches, 3)
+
+    def test_processed_messages_are_never_triaged_twice(self):
+        """
+        Test that a crash before saving the historyId doesn't re-triage finished messages.
+        """
+        self.gmail.deliver("m0", "lead@example.com", "Hi")
+        self.sync()
+        self.gmail.deliver("m1", "lead@example.com", "Hi again")
+
+        messages, _ = fetch_new_messages(self.gmail, self.state)
+        self.state.mark_processed(messages[0]["id"]) # crash before history_id is saved
+
+        self.assertEqual(self.sync(), [])
+
+    def test_expired_history_falls_back_to_full_sync(self):
+        """
+        Test that an expired historyId triggers a full unread sync that still skips processed mail.
+        """
+        self.gmail.deliver("m0", "lead@example.com", "Hi")
+        self.sync()
+        self.gmail.deliver("m1", "lead@example.com", "Hi again")
+        self.gmail.oldest_history_id = self.gmail.history_id + 1
+
+        self.assertEqual(self.sync(), ["m1"])
+
+    def test_parse_message(self):
+        self.gmail.deliver("m0", "Ada <ada@example.com>", "Happy to chat")
+        self.assertEqual(parse_message(self.gmail.store["m0"]), ("Ada <ada@example.com>", "Happy to chat"))
+
+class RejectingQueue:
+    """A job queue that accepts the first job of each send and rejects the rest."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def send(self, queue, jobs):
+        jobs = list(jobs)
+        self.jobs.extend(jobs[:1])
+        if len(jobs) > 1:
+            raise EnqueueError(f"{len(jobs) - 1} of {len(jobs)} {queue} jobs could not be enqueued", 1)
+        return len(jobs)
+
+class FixedTriage:
+    """Labels each reply by its body."""
+
+    def __init__(self, labels):
+        self.labels = labels
+
+    def triage_many(self, replies):
+        return [self.labels[body] for body, _ in replies]
+
+class TestTriageJobs(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state = GmailSyncState(os.path.join(tmp.name, "sync.sqlite"))
+        self.addCleanup(self.state.close)
+        self.store = LeadStore(os.path.join(tmp.name, "leads.db"))
+        self.addCleanup(self.store.close)
+        self.gmail = FakeGmail()
+
+    def test_sync_point_holds_when_the_queue_rejects_jobs(self):
+        self.gmail.deliver("m0", "lead@example.com", "Hi")
+        self.gmail.deliver("m1", "lead@example.com", "Hi again")
+
+        self.assertEqual(enqueue_new_messages(self.gmail, self.state, RejectingQueue()), 1)
+        self.assertIsNone(self.state.history_id)
+
+    def test_replies_to_messages_sent_after_the_worker_started_are_matched(self):
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": "Ada", "profile_url": "u/ada", "email": "ada@example.com"},
+            {"full_name": "Bob", "profile_url": "u/bob", "email": "bob@example.com"},
+        ]), status=STATUS_APPROVED)
+        ReplyIndex(self.store).record_send(1, email="ada@example.com")
+        handle = triage_job_handler(self.gmail, self.store, FixedTriage({"Sure": "Interested", "Hmm": "Error"}))
+        self.gmail.deliver("m0", "Ada <ada@example.com>", "Sure")
+        self.assertEqual(handle([{"message_id": "m0"}]), [None])
+
+        ReplyIndex(self.store).record_send(2, email="bob@example.com") # sent by another worker meanwhile
+        self.gmail.deliver("m1", "Bob <bob@example.com>", "Sure")
+        self.gmail.deliver("m2", "Ada <ada@example.com>", "Hmm")
+        self.assertEqual(handle([{"message_id": "m1"}, {"message_id": "m2"}]), [None, "triage failed"])
+        self.assertEqual(self.store.get_lead(2)["status"], STATUS_REPLIED)
+
+    def deliver_nested_multipart(self, msg_id):
+        self.gmail.deliver(msg_id, "Carol <carol@example.com>", "")
+        self.gmail.store[msg_id]["payload"] = {
+            "headers": [{"name": "From", "value": "Carol <carol@example.com>"}],
+            "parts": [{"mimeType": "multipart/alternative", "body": {"size": 0}, "parts": []}],
+        }
+
+    def test_failed_triage_is_retried_and_unparseable_mail_is_skipped(self):
+        self.gmail.deliver("m0", "Ada <ada@example.com>", "Sure")
+        self.gmail.deliver("m1", "Bob <bob@example.com>", "Hmm")
+        self.deliver_nested_multipart("m2")
+        messages, _ = fetch_new_messages(self.gmail, self.state)
+
+        triage = FixedTriage({"Sure": "Interested", "Hmm": "Error"})
+        self.assertEqual(triage_messages(self.store, self.state, triage, messages), (2, 0, 1))
+        self.assertEqual([self.state.is_processed(msg_id) for msg_id in ("m0", "m1", "m2")], [True, False, True])
+
+        handle = triage_job_handler(self.gmail, self.store, triage)
+        self.assertEqual(handle([{"message_id": "m2"}, {"message_id": "m0"}]), ["could not parse message", None])
+
+if __name__ == '__main__':
+    unittest.main()
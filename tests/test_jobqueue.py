@@ -0,0 +1,241 @@
+import os
+import tempfile
+import threading
+import unittest
+from contextlib import contextmanager
+import pandas as pd
+from botocore.stub import Stubber
+import boto3
+from jobqueue import SQLiteJobQueue, SQSJobQueue, Worker, open_queue
+from outbound import OutboundScheduler
+from personalize import DraftGenerator, draft_job_handler
+from sender import send_job_handler
+from storage import LeadStore, STATUS_PENDING, STATUS_APPROVED, STATUS_SENT
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestSQLiteJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "jobs.sqlite")
+        self.clock = FakeClock()
+        self.queue = SQLiteJobQueue(self.path, visibility_timeout=60, max_attempts=3, clock=self.clock)
+        self.addCleanup(self.queue.close)
+
+    def test_leased_jobs_are_invisible_until_the_lease_expires(self):
+        self.assertEqual(self.queue.send("q", [("a", {"n": 1}), ("b", {"n": 2})]), 2)
+        first = self.queue.receive("q", max_jobs=1)
+        self.assertEqual([(job.key, job.body, job.attempts) for job in first], [("a", {"n": 1}, 1)])
+        self.assertEqual([job.key for job in self.queue.receive("q", max_jobs=5)], ["b"])
+        self.assertEqual(self.queue.receive("q"), [])
+
+        self.clock.now += 61
+        again = self.queue.receive("q", max_jobs=5)
+        self.assertEqual([(job.key, job.attempts) for job in again], [("a", 2), ("b", 2)])
+        self.assertFalse(self.queue.ack(first[0])) # that lease was lost to the redelivery
+        self.assertTrue(self.queue.ack(again[0]))
+        self.assertEqual(self.queue.counts("q"), {"visible": 0, "leased": 1, "dead": 0})
+
+    def test_keys_are_deduplicated_while_queued(self):
+        self.assertEqual(self.queue.send("q", [("a", {}), ("a", {}), (None, {}), (None, {})]), 3)
+        self.assertEqual(self.queue.send("other", [("a", {})]), 1)
+        job = next(job for job in self.queue.receive("q", max_jobs=5) if job.key == "a")
+        self.queue.ack(job)
+        self.assertEqual(self.queue.send("q", [("a", {})]), 1)
+
+    def test_jobs_are_dead_lettered_after_max_attempts_and_can_be_redriven(self):
+        self.queue.send("q", [("a", {"n": 1})])
+        for attempt in range(3):
+            job, = self.queue.receive("q")
+            self.queue.release(job, error=f"boom {attempt}")
+        self.assertEqual(self.queue.receive("q"), [])
+        self.assertEqual(self.queue.dead_letters("q"), [{"key": "a", "body": {"n": 1}, "attempts": 3, "error": "boom 2"}])
+        self.assertEqual(self.queue.redrive("q"), 1)
+        self.assertEqual([job.attempts for job in self.queue.receive("q")], [1])
+
+    def test_concurrent_workers_never_lease_the_same_job(self):
+        """
+        Test that workers in separate connections each get a disjoint share of the jobs.
+        """
+        self.queue.send("q", [(str(n), {"n": n}) for n in range(300)])
+        seen = []
+        lock = threading.Lock()
+
+        def consume():
+            with SQLiteJobQueue(self.path, visibility_timeout=600) as queue:
+                def handle(bodies):
+                    with lock:
+                        seen.extend(body["n"] for body in bodies)
+                    return [None] * len(bodies)
+                Worker(queue, "q", handle, batch_size=7).run(exit_when_idle=True)
+
+        threads = [threading.Thread(target=consume) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(seen), list(range(300)))
+        self.assertEqual(self.queue.counts("q"), {"visible": 0, "leased": 0, "dead": 0})
+
+class TestWorker(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.clock = FakeClock()
+        self.queue = SQLiteJobQueue(os.path.join(tmp.name, "jobs.sqlite"), visibility_timeout=60, max_attempts=2,
+                                    clock=self.clock)
+        self.addCleanup(self.queue.close)
+        self.store = LeadStore(os.path.join(tmp.name, "leads.db"))
+        self.addCleanup(self.store.close)
+
+    def test_finished_keys_are_skipped_on_redelivery(self):
+        """
+        Test at-least-once delivery: a job redelivered after it finished (e.g. a crash before the ack) is not run again.
+        """
+        runs = []
+
+        def handle(bodies):
+            runs.extend(bodies)
+            return [None] * len(bodies)
+
+        self.queue.send("q", [("a", {"n": 1})])
+        job, = self.queue.receive("q")
+        handle([job.body])
+        self.store.mark_jobs_done([job.key]) # ... and the worker died before acking
+        self.clock.now += 61
+
+        worker = Worker(self.queue, "q", handle, store=self.store)
+        worker.run(exit_when_idle=True)
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(worker.stats, {"received": 1, "done": 0, "skipped": 1, "failed": 0})
+        self.assertEqual(self.queue.counts("q")["visible"] + self.queue.counts("q")["leased"], 0)
+
+    def test_failures_are_retried_with_backoff_then_dead_lettered(self):
+        self.queue.send("q", [("ok", {"fail": False}), ("bad", {"fail": True})])
+        worker = Worker(self.queue, "q", lambda bodies: ["boom" if body["fail"] else None for body in bodies],
+                        store=self.store, backoff_base=10)
+        worker.run_once()
+        self.assertEqual(self.store.jobs_done(["ok", "bad"]), {"ok"})
+        self.assertEqual(worker.run_once(), 0) # backing off
+        self.clock.now += 10
+        self.assertEqual(worker.run_once(), 1)
+        self.clock.now += 20
+        worker.run_once()
+        self.assertEqual(worker.stats["failed"], 2)
+        self.assertEqual([job["key"] for job in self.queue.dead_letters("q")], ["bad"])
+
+    def test_an_exception_fails_the_whole_batch(self):
+        def handle(bodies):
+            raise RuntimeError("store unavailable")
+
+        self.queue.send("q", [("a", {}), ("b", {})])
+        worker = Worker(self.queue, "q", handle, store=self.store, batch_size=2)
+        worker.run_once()
+        self.assertEqual(worker.stats["failed"], 2)
+        self.assertEqual(self.store.jobs_done(["a", "b"]), set())
+
+    def test_personalize_jobs_draft_each_new_lead_once(self):
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead {i}", "company": "Acme", "profile_url": f"https://www.linkedin.com/in/lead-{i}"}
+            for i in range(3)
+        ]))
+        calls = []
+
+        async def complete(messages, model, max_tokens=None):
+            calls.append(messages)
+            return "Hi there", 10
+
+        generator = DraftGenerator(complete=complete, concurrency=2, rpm=10**6, tpm=10**9)
+        handle = draft_job_handler(self.store, generator)
+        self.assertEqual(handle([{"lead_id": 1}, {"lead_id": 2}]), [None, None])
+        self.assertEqual(handle([{"lead_id": 2}, {"lead_id": 3}]), [None, None])
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(self.store.count_by_status(), {STATUS_PENDING: 3})
+
+    def test_send_jobs_follow_the_delivery_journal(self):
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead {i}", "profile_url": f"https://www.linkedin.com/in/lead-{i}", "draft_msg": "Hi"}
+            for i in range(3)
+        ]), status=STATUS_APPROVED)
+        sent = []
+
+        @contextmanager
+        def channel():
+            def deliver(job):
+                sent.append(job["lead_id"])
+                return {"ok": job["lead_id"] != 2, "error": "page did not load"}
+            yield deliver
+
+        scheduler = OutboundScheduler(self.store)
+        scheduler.add_channel("linkedin", channel, [])
+        handle = send_job_handler(self.store, scheduler)
+        bodies = [{"lead_id": 1, "channel": "linkedin"}, {"lead_id": 2, "channel": "linkedin"},
+                  {"lead_id": 3, "channel": "email"}]
+        self.assertEqual(handle(bodies), [None, "send failed", "email sending is not enabled on this worker"])
+        self.assertEqual(handle(bodies[:1]), [None]) # already sent: not sent again
+        self.assertEqual(sorted(sent), [1, 2])
+        self.assertEqual(self.store.get_lead(1)["status"], STATUS_SENT)
+
+    def test_send_jobs_are_retried_when_the_channel_cannot_connect(self):
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": "Lead", "profile_url": "https://www.linkedin.com/in/lead", "draft_msg": "Hi"}
+        ]), status=STATUS_APPROVED)
+
+        @contextmanager
+        def channel():
+            raise ConnectionError("browser failed to start")
+            yield
+
+        scheduler = OutboundScheduler(self.store)
+        scheduler.add_channel("linkedin", channel, [])
+        handle = send_job_handler(self.store, scheduler)
+        self.assertEqual(handle([{"lead_id": 1, "channel": "linkedin"}]), ["send not attempted"])
+        self.assertEqual(self.store.get_lead(1)["status"], STATUS_APPROVED)
+
+class TestSQSJobQueue(unittest.TestCase):
+
+    URL = "https://sqs.us-east-1.amazonaws.com/123456789012/agent-"
+
+    def setUp(self):
+        client = boto3.client("sqs", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+        self.stubber = Stubber(client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+        self.queue = SQSJobQueue(self.URL, visibility_timeout=30, max_attempts=3, wait_seconds=5, client=client)
+
+    def test_open_queue_picks_the_backend_from_the_url(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open_queue(os.path.join(tmp, "jobs.sqlite")) as queue:
+                self.assertIsInstance(queue, SQLiteJobQueue)
+
+    def test_receive_leases_jobs_and_dead_letters_over_the_limit(self):
+        self.stubber.add_response("receive_message", {"Messages": [
+            {"MessageId": "1", "ReceiptHandle": "r1", "Body": '{"key": "a", "body": {"n": 1}}',
+             "Attributes": {"ApproximateReceiveCount": "2"}},
+            {"MessageId": "2", "ReceiptHandle": "r2", "Body": '{"key": "b", "body": {"n": 2}}',
+             "Attributes": {"ApproximateReceiveCount": "4"}},
+        ]}, {"QueueUrl": self.URL + "drafts", "MaxNumberOfMessages": 2, "VisibilityTimeout": 30, "WaitTimeSeconds": 5,
+             "MessageSystemAttributeNames": ["ApproximateReceiveCount"]})
+        self.stubber.add_response("send_message", {"MessageId": "3"},
+                                  {"QueueUrl": self.URL + "drafts-dlq", "MessageBody": '{"key": "b", "body": {"n": 2}}'})
+        self.stubber.add_response("delete_message", {}, {"QueueUrl": self.URL + "drafts", "ReceiptHandle": "r2"})
+        self.stubber.add_response("receive_message", {}, { # topping up the dead-lettered slot, without long-polling
+            "QueueUrl": self.URL + "drafts", "MaxNumberOfMessages": 1, "VisibilityTimeout": 30, "WaitTimeSeconds": 0,
+            "MessageSystemAttributeNames": ["ApproximateReceiveCount"]})
+        self.stubber.add_response("delete_message", {}, {"QueueUrl": self.URL + "drafts", "ReceiptHandle": "r1"})
+
+        jobs = self.queue.receive("drafts", max_jobs=2)
+        self.assertEqual([(job.key, job.body, job.attempts) for job in jobs], [("a", {"n": 1}, 2)])
+        self.assertTrue(self.queue.ack(jobs[0]))
+        self.stubber.assert_no_pending_responses()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+import os
+import tempfile
+import threading
+import unittest
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from unittest.mock import MagicMock, patch
+import pandas as pd
+from src.lead_gen import (ApolloCache, enrich_with_apollo, deduplicate_leads, LinkedInScraper, block_nonessential,
+                          search_page_url, leads_from_results, main)
+from storage import LeadStore
+from dedup_index import LeadIndex, normalize_profile_url
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "linkedin")
+
+class TestEnrichWithApollo(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_path = os.path.join(tmp.name, "apollo.sqlite")
+        self.client = MagicMock(workers=4)
+        self.client.lookup.side_effect = lambda name, company: "ada@acme.com" if name == "Ada Lovelace" else None
+
+    def leads(self):
+        return pd.DataFrame([
+            {"full_name": "Ada Lovelace", "company": "Acme", "email": None},
+            {"full_name": " ada  lovelace", "company": "ACME", "email": None},
+            {"full_name": "Nobody Known", "company": "Acme", "email": None},
+            {"full_name": "Has Email", "company": "Acme", "email": "has@acme.com"},
+        ])
+
+    def test_lookups_are_deduplicated_and_written_back(self):
+        """
+        Test that name/company variants share one lookup and existing emails are left alone.
+        """
+        with ApolloCache(self.cache_path) as cache:
+            df = enrich_with_apollo(self.leads(), client=self.client, cache=cache)
+
+        self.assertEqual(self.client.lookup.call_count, 2)
+        self.assertEqual(list(df['email'].fillna("")), ["ada@acme.com", "ada@acme.com", "", "has@acme.com"])
+
+    def test_negative_results_are_cached_across_runs(self):
+        """
+        Test that a second run makes no Apollo calls, including for leads without an email.
+        """
+        with ApolloCache(self.cache_path) as cache:
+            enrich_with_apollo(self.leads(), client=self.client, cache=cache)
+        self.client.lookup.reset_mock()
+
+        with ApolloCache(self.cache_path) as cache:
+            df = enrich_with_apollo(self.leads(), client=self.client, cache=cache)
+            self.assertEqual(cache.hits, 2)
+
+        self.client.lookup.assert_not_called()
+        self.assertEqual(df.loc[0, 'email'], "ada@acme.com")
+
+    def test_expired_negative_results_are_retried(self):
+        """
+        Test that negative results expire after their own (shorter) TTL.
+        """
+        with ApolloCache(self.cache_path, negative_ttl_days=0) as cache:
+            enrich_with_apollo(self.leads(), client=self.client, cache=cache)
+            self.client.lookup.reset_mock()
+            enrich_with_apollo(self.leads(), client=self.client, cache=cache)
+
+        self.client.lookup.assert_called_once_with("Nobody Known", "Acme")
+
+class TestDeduplication(unittest.TestCase):
+
+    def test_profile_url_variants_share_a_key(self):
+        """
+        Test that trailing slashes, query strings and mobile URLs normalize to one key.
+        """
+        variants = [
+            "https://www.linkedin.com/in/jane-doe-123",
+            "https://www.linkedin.com/in/jane-doe-123/",
+            "https://www.linkedin.com/in/Jane-Doe-123?miniProfileUrn=abc",
+            "https://m.linkedin.com/in/jane-doe-123",
+            "https://www.linkedin.com/mwlite/in/jane-doe-123#top",
+            "linkedin.com/in/jane-doe-123",
+        ]
+        self.assertEqual({normalize_profile_url(url) for url in variants}, {"in/jane-doe-123"})
+
+    def test_same_person_without_a_url_is_a_duplicate(self):
+        """
+        Test that a lead without a profile URL matches a name at the same company, but not at another company.
+        """
+        df = pd.DataFrame([
+            {"full_name": "José Álvarez", "headline": "SWE at Google", "company": "", "school": "", "profile_url": "https://www.linkedin.com/in/jalvarez"},
+            {"full_name": "Jose Alvarez, PhD", "headline": "Engineer", "company": "Google", "school": "", "profile_url": ""},
+            {"full_name": "J. Alvarez", "headline": "Engineer", "company": "Google", "school": "", "profile_url": None},
+            {"full_name": "Jose Alvarez", "headline": "Engineer", "company": "Meta", "school": "", "profile_url": ""},
+            {"full_name": "Someone Else", "headline": "", "company": "", "school": "", "profile_url": "https://www.linkedin.com/in/jalvarez/"},
+        ])
+        unique = deduplicate_leads(df)
+        self.assertEqual(list(unique['company']), ["", "Meta"])
+
+    def test_different_people_are_never_fuzzy_merged(self):
+        """
+        Test that fuzzy matches across different profile URLs, different first names or a shared school alone keep leads apart.
+        """
+        df = pd.DataFrame([
+            {"full_name": "John Smith", "company": "Acme", "school": "MIT", "profile_url": "https://www.linkedin.com/in/john-smith"},
+            {"full_name": "Joan Smith", "company": "Globex", "school": "MIT", "profile_url": "https://www.linkedin.com/in/joan-smith"},
+            {"full_name": "J Smith", "company": "Acme", "school": "MIT", "profile_url": "https://www.linkedin.com/in/john-smith-2"},
+            {"full_name": "Mary Smith", "company": "Acme", "school": "", "profile_url": ""},
+            {"full_name": "John Smith", "company": "Globex", "school": "MIT", "profile_url": ""},
+            {"full_name": "John Smith", "company": "", "school": "MIT", "profile_url": ""},
+        ])
+        unique = deduplicate_leads(df)
+        self.assertEqual(len(unique), 5) # only the last: same name and school, no company to contradict
+
+    def test_same_name_and_company_under_another_url_is_a_duplicate(self):
+        """
+        Test that the same person scraped twice under different profile URLs collapses to one lead.
+        """
+        df = pd.DataFrame([
+            {"full_name": "Grace Hopper", "company": "US Navy", "profile_url": "https://www.linkedin.com/in/grace-hopper"},
+            {"full_name": "Grace Hopper, PhD", "company": "US Navy", "profile_url": "https://www.linkedin.com/in/ghopper-1906"},
+            {"full_name": "Grace Hopper", "company": "Univac", "profile_url": "https://www.linkedin.com/in/grace-hopper-univac"},
+        ])
+        unique = deduplicate_leads(df)
+        self.assertEqual(list(unique['profile_url']), ["https://www.linkedin.com/in/grace-hopper",
+                                                       "https://www.linkedin.com/in/grace-hopper-univac"])
+
+    def test_persistent_index_only_keeps_unseen_leads(self):
+        """
+        Test that a later batch is checked against leads indexed on earlier runs.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.sqlite")
+            with LeadIndex(path) as index:
+                index.add_many(pd.DataFrame([{"full_name": "Ada Lovelace", "profile_url": "https://www.linkedin.com/in/ada"}]))
+            with LeadIndex(path) as index:
+                batch = pd.DataFrame([
+                    {"full_name": "Ada Lovelace", "profile_url": "https://www.linkedin.com/in/ada/?trk=x"},
+                    {"full_name": "Grace Hopper", "profile_url": "https://www.linkedin.com/in/grace"},
+                ])
+                new = deduplicate_leads(batch, index)
+                self.assertEqual(list(new['full_name']), ["Grace Hopper"])
+                self.assertEqual(len(index), 2)
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name) # leads.db, the index and the Apollo cache all default to the working directory
+
+    def lead(self, name):
+        return {"full_name": name, "company": "Acme", "profile_url": f"https://www.linkedin.com/in/{name.lower()}"}
+
+    @patch('playwright.sync_api.sync_playwright')
+    @patch('src.lead_gen.enrich_with_apollo', side_effect=lambda df: df.assign(email=df['full_name'] + "@acme.com"))
+    @patch('src.lead_gen.scrape_linkedin_search_results')
+    def test_only_new_leads_are_enriched_and_stored(self, mock_scrape, mock_enrich, _):
+        """
+        Test that seed and earlier leads are enriched and stored once, not again on every run.
+        """
+        pd.DataFrame([self.lead("Ada")]).to_csv("leads.csv", index=False)
+        mock_scrape.return_value = pd.DataFrame([self.lead("Ada"), self.lead("Grace")])
+        main([])
+        mock_scrape.return_value = pd.DataFrame([self.lead("Ada"), self.lead("Grace"), self.lead("Linus")])
+        main([])
+
+        enriched = [list(call.args[0]['full_name']) for call in mock_enrich.call_args_list]
+        self.assertEqual(enriched, [["Ada", "Grace"], ["Linus"]])
+        with LeadStore() as store:
+            self.assertEqual(sorted(store.leads()['email']), ["Ada@acme.com", "Grace@acme.com", "Linus@acme.com"])
+
+class TestScrapingHelpers(unittest.TestCase):
+
+    def test_search_page_url_sets_the_page_parameter(self):
+        url = "https://www.linkedin.com/search/results/people/?keywords=Google&schoolFilter=['1014']&page=4"
+        self.assertEqual(search_page_url(url, 1), "https://www.linkedin.com/search/results/people/?keywords=Google&schoolFilter=['1014']")
+        self.assertEqual(search_page_url(url, 2), "https://www.linkedin.com/search/results/people/?keywords=Google&schoolFilter=['1014']&page=2")
+
+    def test_leads_from_results_handles_relative_and_absolute_links(self):
+        leads = leads_from_results([
+            {"full_name": "Ada", "headline": "SWE", "href": "/in/ada"},
+            {"full_name": "Grace", "headline": "Admiral", "href": "https://www.linkedin.com/in/grace"},
+            {"full_name": "No Link", "headline": "SWE", "href": None},
+        ])
+        self.assertEqual([lead['profile_url'] for lead in leads], ["https://www.linkedin.com/in/ada", "https://www.linkedin.com/in/grace"])
+
+    def test_nonessential_requests_are_aborted(self):
+        def route(resource_type, url):
+            route = MagicMock()
+            route.request.resource_type = resource_type
+            route.request.url = url
+            block_nonessential(route)
+            return "aborted" if route.abort.called else "continued"
+
+        self.assertEqual(route("image", "https://media.licdn.com/a.jpg"), "aborted")
+        self.assertEqual(route("font", "https://static.licdn.com/f.woff2"), "aborted")
+        self.assertEqual(route("script", "https://www.googletagmanager.com/gtm.js"), "aborted")
+        self.assertEqual(route("document", "https://www.linkedin.com/search/results/people/"), "continued")
+        self.assertEqual(route("script", "https://static.licdn.com/app.js"), "continued")
+
+    def test_pages_are_handed_out_round_robin_one_per_tab(self):
+        scraper = LinkedInScraper(playwright=None, tabs=3, max_pages=2)
+        next_page = {"a": 1, "b": 1}
+        self.assertEqual(scraper._next_tasks(next_page), [("a", 1), ("b", 1), ("a", 2)])
+        self.assertEqual(scraper._next_tasks(next_page), [("b", 2)])
+        self.assertEqual(next_page, {})
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """Serves saved search pages by their ``page`` parameter and logs every path requested."""
+
+    requested = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES, **kwargs)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        self.requested.append(parts.path)
+        if parts.path.startswith("/search/"):
+            page = parse_qs(parts.query).get("page", ["1"])[0]
+            name = f"search_page_{page}.html"
+            self.path = "/" + (name if os.path.exists(os.path.join(FIXTURES, name)) else "search_empty.html")
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+def launch_browser_or_skip():
+    try:
+        from playwright.sync_api import sync_playwright
+        playwright = sync_playwright().start()
+    except Exception as e:
+        raise unittest.SkipTest(f"Playwright is not available: {e}")
+    try:
+        playwright.chromium.launch().close()
+    except Exception as e:
+        playwright.stop()
+        raise unittest.SkipTest(f"Chromium is not installed: {e}")
+    return playwright
+
+class TestScraperAgainstFixtures(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.playwright = launch_browser_or_skip()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.playwright.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FixtureHandler.requested.clear()
+
+    def scrape(self, search_urls, **kwargs):
+        with LinkedInScraper(self.playwright, login=False, base_url="https://www.linkedin.com", **kwargs) as scraper:
+            leads = list(scraper.scrape(search_urls))
+        return leads, scraper.stats
+
+    def test_walks_pages_until_the_results_run_out(self):
+        """
+        Test that every result on every page is read, stopping at the first empty page.
+        """
+        leads, stats = self.scrape(f"{self.base_url}/search/results/people/?keywords=x", tabs=2, max_pages=10)
+
+        self.assertEqual([lead['full_name'] for lead in leads],
+                         ["Ada Lovelace", "Grace Hopper", "Alan Turing", "Edsger Dijkstra", "Barbara Liskov"])
+        self.assertEqual(leads[1]['profile_url'], "https://www.linkedin.com/in/grace-hopper?miniProfileUrn=urn")
+        self.assertEqual((stats["pages"], stats["empty_pages"]), (4, 2))
+
+    def test_static_assets_and_trackers_are_never_fetched(self):
+        self.scrape(f"{self.base_url}/search/results/people/?keywords=x", tabs=1, max_pages=1)
+        self.assertIn("/search/results/people/", FixtureHandler.requested)
+        self.assertEqual([path for path in FixtureHandler.requested if path.startswith("/static/")], [])
+
+    def test_several_searches_share_the_tabs(self):
+        leads, stats = self.scrape([f"{self.base_url}/search/results/people/?keywords=a",
+                                    f"{self.base_url}/search/results/people/?keywords=b"], tabs=3, max_pages=2)
+        self.assertEqual(len(leads), 10)
+        self.assertEqual(stats["pages"], 4)
+
+if __name__ == '__main__':
+    unittest.main()
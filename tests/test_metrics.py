@@ -0,0 +1,80 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import metrics
+from metrics import Histogram, Metrics, load_events, spend_by_stage, summarize, timeseries, token_cost
+from personalize import DraftGenerator
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "metrics.sqlite")
+        self.metrics = Metrics(self.path, run_id="test", flush_every=1000, flush_seconds=3600)
+        self.addCleanup(self.metrics.close)
+
+    def test_histogram_quantiles_stay_within_a_bucket(self):
+        histogram = Histogram()
+        for ms in range(1, 101):
+            histogram.observe(ms / 1000)
+        self.assertAlmostEqual(histogram.quantile(0.5), 0.050, delta=0.015)
+        self.assertAlmostEqual(histogram.quantile(0.95), 0.095, delta=0.01)
+        self.assertLessEqual(histogram.quantile(1.0), histogram.max)
+
+    def test_timer_records_failures_and_exceptions(self):
+        """
+        Test that a timer counts raised exceptions and explicit ``ok = False`` as errors.
+        """
+        with self.metrics.timer("lead_gen", "apollo"):
+            pass
+        with self.metrics.timer("lead_gen", "apollo") as timer:
+            timer.ok = False
+        with self.assertRaises(ValueError), self.metrics.timer("lead_gen", "apollo"):
+            raise ValueError("boom")
+
+        row = self.metrics.report()[("lead_gen", "apollo")]
+        self.assertEqual((row["calls"], row["errors"]), (3, 2))
+
+    def test_events_are_buffered_then_summarized_from_disk(self):
+        """
+        Test that nothing is written until a flush, and that the dashboard helpers read it back.
+        """
+        for seconds in (0.1, 0.2, 0.3, 0.4):
+            self.metrics.observe("sender", "smtp_send", seconds)
+        self.metrics.observe("sender", "smtp_send", 1.0, ok=False)
+        self.metrics.record_usage("personalize", "gpt-4", 1000, 500)
+        self.metrics.count("personalize", "drafts", 3)
+        self.assertTrue(load_events(self.path).empty)
+
+        self.metrics.flush()
+        events = load_events(self.path)
+        self.assertEqual(len(events), 7)
+
+        summary = summarize(events).set_index(["stage", "name"]).loc[("sender", "smtp_send")]
+        self.assertEqual(summary["calls"], 5)
+        self.assertAlmostEqual(summary["error_rate"], 0.2)
+        self.assertAlmostEqual(summary["p50_ms"], 300)
+        spend = spend_by_stage(events).set_index("stage").loc["personalize"]
+        self.assertAlmostEqual(spend["spend_usd"], 0.06)
+        self.assertEqual(timeseries(events)["calls"].sum(), 5)
+
+    def test_token_cost_uses_longest_matching_model_prefix(self):
+        self.assertAlmostEqual(token_cost("gpt-4o-mini-2024-07-18", 1000, 1000), 0.00075)
+        self.assertAlmostEqual(token_cost("gpt-4-0613", 1000, 0), 0.03)
+        self.assertEqual(token_cost("local-model", 1000, 1000), 0.0)
+
+    def test_draft_generator_times_each_completion(self):
+        previous = metrics.use_metrics(self.metrics)
+        self.addCleanup(metrics.use_metrics, previous)
+
+        async def complete(messages, model, max_tokens=None):
+            return "Hi there", 42
+
+        generator = DraftGenerator(complete=complete, concurrency=2, rpm=10**6, tpm=10**9)
+        asyncio.run(generator.run([(i, {"full_name": f"Lead {i}"}) for i in range(4)]))
+        self.assertEqual(self.metrics.report()[("personalize", "openai")]["calls"], 4)
+
+if __name__ == '__main__':
+    unittest.main()
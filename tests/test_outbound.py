@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+import pandas as pd
+from storage import LeadStore, STATUS_APPROVED, STATUS_SENT, DELIVERY_DELIVERED, DELIVERY_FAILED
+from outbound import OutboundScheduler, delivery_key
+
+class FakeChannel:
+    """Records deliveries (with timestamps) and fails the lead ids it is told to."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connect(self):
+        def deliver(job):
+            with self.lock:
+                self.sent.append((job['lead_id'], time.monotonic()))
+            if job['lead_id'] in self.fail:
+                return {"ok": False, "error": "refused"}
+            return {"ok": True, "message_id": f"<{job['lead_id']}@test>"}
+        yield deliver
+
+class TestOutboundScheduler(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = LeadStore(os.path.join(tmp.name, "leads.db"))
+        self.addCleanup(self.store.close)
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead{i}", "profile_url": f"u/{i}"} for i in range(1, 9)
+        ]), status=STATUS_APPROVED)
+
+    def jobs(self, channel, lead_ids):
+        return [{"lead_id": lead_id, "channel": channel} for lead_id in lead_ids]
+
+    def test_channels_run_concurrently_at_their_quota(self):
+        """
+        Test that each channel is paced by its own bucket and the two channels overlap in time.
+        """
+        linkedin, email = FakeChannel(), FakeChannel()
+        scheduler = OutboundScheduler(self.store)
+        scheduler.add_channel("linkedin", linkedin.connect, [scheduler.quota("linkedin", 600)]) # one per 0.1s
+        scheduler.add_channel("email", email.connect, [scheduler.quota("email", 1200)], workers=2) # one per 0.05s
+
+        start = time.monotonic()
+        stats = scheduler.run(self.jobs("linkedin", [1, 2, 3, 4]) + self.jobs("email", [5, 6, 7, 8]))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual((stats["linkedin"]["sent"], stats["email"]["sent"]), (4, 4))
+        gaps = [b - a for (_, a), (_, b) in zip(linkedin.sent, linkedin.sent[1:])]
+        self.assertTrue(all(gap >= 0.08 for gap in gaps), gaps)
+        self.assertLess(elapsed, 0.5) # serial would be ~0.3s + ~0.15s plus fixed sleeps
+        self.assertEqual(self.store.count_by_status(), {STATUS_SENT: 8})
+
+    def test_shared_account_quota_limits_both_channels(self):
+        """
+        Test that two channels drawing on one account bucket share its rate.
+        """
+        a, b = FakeChannel(), FakeChannel()
+        scheduler = OutboundScheduler(self.store)
+        account = scheduler.quota("account:me", 600)
+        scheduler.add_channel("a", a.connect, [scheduler.quota("a", 60000), account])
+        scheduler.add_channel("b", b.connect, [scheduler.quota("b", 60000), account])
+
+        start = time.monotonic()
+        scheduler.run(self.jobs("a", [1, 2]) + self.jobs("b", [3, 4]))
+        self.assertGreaterEqual(time.monotonic() - start, 0.28)
+
+    def test_restart_is_idempotent(self):
+        """
+        Test that a rerun skips delivered leads, never resends one a crash left in doubt, and retries failures.
+        """
+        channel = FakeChannel(fail={2})
+        scheduler = OutboundScheduler(self.store)
+        scheduler.add_channel("email", channel.connect, [])
+        scheduler.run(self.jobs("email", [1, 2]))
+
+        # A crash after claiming lead 3 but before journaling the outcome.
+        self.store.begin_delivery(delivery_key("email", 3), 3, "email")
+
+        channel.fail.clear()
+        rerun = OutboundScheduler(self.store)
+        rerun.add_channel("email", channel.connect, [])
+        stats = rerun.run(self.jobs("email", [1, 2, 3, 4]))
+
+        self.assertEqual([lead_id for lead_id, _ in channel.sent], [1, 2, 2, 4])
+        self.assertEqual((stats["email"]["sent"], stats["email"]["skipped"], stats["email"]["in_doubt"]), (2, 1, 1))
+        self.assertEqual(self.store.delivery_states([delivery_key("email", i) for i in (1, 2, 4)]),
+                         {delivery_key("email", i): DELIVERY_DELIVERED for i in (1, 2, 4)})
+        self.assertEqual(self.store.get_lead(3)['status'], STATUS_APPROVED)
+
+    def test_failed_delivery_is_journaled_without_marking_sent(self):
+        channel = FakeChannel(fail={1})
+        scheduler = OutboundScheduler(self.store)
+        scheduler.add_channel("linkedin", channel.connect, [])
+        scheduler.run(self.jobs("linkedin", [1]))
+
+        self.assertEqual(self.store.delivery_states([delivery_key("linkedin", 1)]), {delivery_key("linkedin", 1): DELIVERY_FAILED})
+        self.assertEqual(self.store.get_lead(1)['status'], STATUS_APPROVED)
+
+    def test_jobs_left_by_a_channel_that_cannot_connect_count_as_failed(self):
+        @contextmanager
+        def connect():
+            raise ConnectionError("login page did not load")
+            yield
+
+        scheduler = OutboundScheduler(self.store)
+        scheduler.add_channel("linkedin", connect, [], workers=2)
+        stats = scheduler.run(self.jobs("linkedin", [1, 2, 3]))
+
+        self.assertEqual((stats["linkedin"]["sent"], stats["linkedin"]["failed"]), (0, 3))
+        self.assertEqual(self.store.delivery_states([delivery_key("linkedin", i) for i in (1, 2, 3)]), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import pandas as pd
+from ratelimit import TokenBucket
+from draft_cache import DraftCache
+from storage import LeadStore, STATUS_NEW, STATUS_PENDING
+import json
+from src.personalize import DraftGenerator, generate_drafts, build_messages, parse_batch_response
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class RateLimited(Exception):
+    http_status = 429
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_reserve_returns_wait_once_empty(self):
+        """
+        Test that the bucket serves its capacity immediately and then asks callers to wait.
+        """
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock=clock) # 1 token per second
+
+        self.assertEqual(bucket.reserve(60), 0.0)
+        self.assertAlmostEqual(bucket.reserve(1), 1.0)
+        clock.now += 2
+        self.assertEqual(bucket.reserve(1), 0.0)
+
+class TestDraftGenerator(unittest.TestCase):
+
+    def test_generation_is_concurrent_but_bounded(self):
+        """
+        Test that no more than `concurrency` completions are in flight at once.
+        """
+        in_flight = {"now": 0, "max": 0}
+
+        async def complete(messages, model, max_tokens=None):
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+            await asyncio.sleep(0.01)
+            in_flight["now"] -= 1
+            return "Hi " + messages[1]["content"].split()[6].strip(","), 42
+
+        generator = DraftGenerator(complete=complete, concurrency=4, rpm=100000, tpm=10**9)
+        leads_df = pd.DataFrame([{"full_name": f"Lead{i}", "headline": "SWE", "company": "Acme", "school": "MIT"} for i in range(20)])
+        leads_df['draft_msg'] = ''
+        generate_drafts(leads_df, generator)
+
+        self.assertEqual(in_flight["max"], 4)
+        self.assertEqual(list(leads_df['draft_msg']), [f"Hi Lead{i}" for i in range(20)])
+        self.assertEqual(generator.stats["tokens"], 20 * 42)
+
+    def test_rate_limit_errors_are_retried(self):
+        """
+        Test that a 429 is retried with backoff and the draft still comes back.
+        """
+        calls = []
+
+        async def complete(messages, model, max_tokens=None):
+            calls.append(model)
+            if len(calls) < 3:
+                raise RateLimited("slow down")
+            return "Hello!", None
+
+        generator = DraftGenerator(complete=complete, backoff_base=0.001)
+        draft = asyncio.run(generator.generate_one({"full_name": "Ada"}))
+
+        self.assertEqual(draft, "Hello!")
+        self.assertEqual(generator.stats["retries"], 2)
+
+    def test_prompts_are_unchanged(self):
+        """
+        Test that the engine sends the same system and user prompts as the single-lead path.
+        """
+        lead = {"full_name": "Ada", "headline": "SWE", "company": "Acme", "school": "MIT"}
+        messages = build_messages(lead)
+        self.assertIn("a SWE at Acme", messages[0]["content"])
+        self.assertIn("Write a 50-word LinkedIn DM to Ada", messages[1]["content"])
+
+class TestDraftStorage(unittest.TestCase):
+
+    def test_drafts_are_stored_in_batches_and_failures_stay_new(self):
+        """
+        Test that drafts move leads to pending review and failed leads are left for the next run.
+        """
+        async def complete(messages, model, max_tokens=None):
+            if "Lead3" in messages[1]["content"]:
+                raise ValueError("bad request")
+            return "Hi!", None
+
+        with tempfile.TemporaryDirectory() as tmp, LeadStore(os.path.join(tmp, "leads.db")) as store:
+            store.upsert_leads(pd.DataFrame([{"full_name": f"Lead{i}", "profile_url": f"u/{i}"} for i in range(5)]))
+            leads_df = store.leads(status=STATUS_NEW).set_index('id')
+            generate_drafts(leads_df, DraftGenerator(complete=complete), store=store, checkpoint_every=2)
+
+            self.assertEqual(store.count_by_status(), {STATUS_PENDING: 4, STATUS_NEW: 1})
+            self.assertEqual(list(store.leads(status=STATUS_NEW)['full_name']), ["Lead3"])
+
+class TestPrompts(unittest.TestCase):
+
+    def test_prompts_are_compact_and_lead_fields_are_budgeted(self):
+        """
+        Test that the user prompt carries no indentation padding and an overlong headline is cut.
+        """
+        lead = {"full_name": "Ada Lovelace", "headline": "Engineer | " * 100, "company": "Acme", "school": "MIT"}
+        system, user = (message["content"] for message in build_messages(lead))
+        self.assertEqual(user, " ".join(user.split()))
+        self.assertTrue(user.startswith("Write a 50-word LinkedIn DM to Ada Lovelace, a Engineer | "))
+        self.assertIn("You both attended MIT.", user)
+        self.assertLess(len(user), 400)
+        self.assertLess(len(system), 400)
+
+    def test_completions_are_capped_per_draft(self):
+        limits = []
+
+        async def complete(messages, model, max_tokens=None):
+            limits.append(max_tokens)
+            if messages[0]["content"].startswith("You are a polite new-grad SWE reaching out to professionals"):
+                return json.dumps({lead_id: "Hi" for lead_id in json.loads(messages[1]["content"])}), None
+            return "Hi", None
+
+        leads = [(i, {"full_name": f"Lead{i}", "company": "Acme"}) for i in range(3)]
+        asyncio.run(DraftGenerator(complete=complete, max_tokens=100).run(leads[:1]))
+        asyncio.run(DraftGenerator(complete=complete, max_tokens=100, batch_size=3).run(leads))
+        self.assertEqual(limits[0], 100)
+        self.assertGreater(limits[1], 3 * 100)
+
+    def test_cut_off_drafts_are_retried_with_more_room_and_never_cached(self):
+        """
+        Test that a draft stopped by the token cap is retried with twice the cap, and fails (uncached) if still cut off.
+        """
+        limits = []
+
+        async def complete(messages, model, max_tokens=None):
+            limits.append(max_tokens)
+            if "Lead0" in messages[1]["content"] and max_tokens < 200:
+                return "Hi Lead0, I saw", None, "length"
+            if "Lead1" in messages[1]["content"]:
+                return "Hi Lead1, I saw", None, "length"
+            return "Hi there", None, "stop"
+
+        leads_df = pd.DataFrame([{"full_name": f"Lead{i}", "company": "Acme"} for i in range(2)])
+        with tempfile.TemporaryDirectory() as tmp, DraftCache(os.path.join(tmp, "cache.sqlite")) as cache:
+            generator = DraftGenerator(complete=complete, cache=cache, concurrency=1, max_tokens=100, length_retries=1)
+            generate_drafts(leads_df.assign(draft_msg=''), generator)
+            self.assertEqual(limits, [100, 200, 100, 200])
+            self.assertEqual((generator.stats["completed"], generator.stats["failed"]), (1, 1))
+            self.assertEqual(generator.stats["length_limited"], 3)
+            self.assertEqual(len(cache), 1)
+
+class TestBatchMode(unittest.TestCase):
+
+    def test_batch_splits_response_and_falls_back_for_bad_entries(self):
+        """
+        Test that one request covers a batch and missing or malformed entries are retried one by one.
+        """
+        requests = []
+
+        async def complete(messages, model, max_tokens=None):
+            requests.append(messages)
+            if messages[0]["content"].startswith("You are a polite new-grad SWE reaching out to professionals"):
+                ids = list(json.loads(messages[1]["content"]))
+                reply = {lead_id: f"Batch draft {lead_id}" for lead_id in ids[:-2]}
+                reply[ids[-2]] = {"not": "a string"}
+                return "```json\n" + json.dumps(reply) + "\n```", None
+            return "Single draft", None
+
+        leads_df = pd.DataFrame([{"full_name": f"Lead{i}", "company": "Acme"} for i in range(5)])
+        leads_df['draft_msg'] = ''
+        generator = DraftGenerator(complete=complete, batch_size=5)
+        generate_drafts(leads_df, generator)
+
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(list(leads_df['draft_msg']), ["Batch draft 1", "Batch draft 2", "Batch draft 3", "Single draft", "Single draft"])
+        self.assertEqual(generator.stats["batch_fallbacks"], 2)
+
+    def test_batch_reports_tokens_saved(self):
+        """
+        Test that a fully answered batch reports fewer prompt tokens than per-lead calls.
+        """
+        async def complete(messages, model, max_tokens=None):
+            return json.dumps({lead_id: "Hi" for lead_id in json.loads(messages[1]["content"])}), None
+
+        leads = [(i, {"full_name": f"Lead{i}", "company": "Acme"}) for i in range(10)]
+        generator = DraftGenerator(complete=complete, batch_size=10)
+        asyncio.run(generator.run(leads))
+
+        self.assertEqual(generator.stats["batched_requests"], 1)
+        self.assertGreater(generator.stats["tokens_saved"], 0)
+
+    def test_parse_batch_response_ignores_garbage(self):
+        """
+        Test that unparseable replies and unknown ids produce no drafts.
+        """
+        self.assertEqual(parse_batch_response("Sorry, I can't help with that.", {"1": None}), {})
+        self.assertEqual(parse_batch_response('{"1": "Hi", "9": "Who?"}', {"1": None}), {"1": "Hi"})
+
+class TestDraftCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cache.sqlite")
+
+    def test_rerun_only_generates_changed_leads(self):
+        """
+        Test that a second run hits the cache for unchanged leads and regenerates edited ones.
+        """
+        calls = []
+
+        async def complete(messages, model, max_tokens=None):
+            calls.append(messages[1]["content"])
+            return f"Draft {len(calls)}", None
+
+        leads_df = pd.DataFrame([{"full_name": f"Lead{i}", "company": "Acme"} for i in range(5)])
+        with DraftCache(self.path) as cache:
+            generate_drafts(leads_df.assign(draft_msg=''), DraftGenerator(complete=complete, cache=cache))
+        self.assertEqual(len(calls), 5)
+
+        leads_df.loc[2, "company"] = "Globex"
+        with DraftCache(self.path) as cache:
+            generate_drafts(leads_df.assign(draft_msg=''), DraftGenerator(complete=complete, cache=cache))
+            self.assertEqual((cache.hits, cache.misses), (4, 1))
+        self.assertEqual(len(calls), 6)
+        self.assertIn("Globex", calls[-1])
+
+    def test_evicts_least_recently_used_beyond_max_entries(self):
+        """
+        Test that the cache never keeps more than max_entries drafts.
+        """
+        with DraftCache(self.path, max_entries=3, evict_every=1) as cache:
+            for i in range(5):
+                cache.put(f"key{i}", "draft")
+            self.assertEqual(len(cache), 3)
+            self.assertIsNone(cache.get("key0"))
+            self.assertEqual(cache.get("key4"), "draft")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+import pandas as pd
+from storage import LeadStore, STATUS_PENDING, STATUS_SENT
+from personalize import DraftGenerator
+from pipeline import Stage, StreamingPipeline, run_batch, dedup_stage, enrich_stage, personalize_stage
+
+def slow(seconds, transform=lambda item: item):
+    def process(items):
+        time.sleep(seconds * len(items))
+        return [transform(item) for item in items]
+    return process
+
+class TestStreamingPipeline(unittest.TestCase):
+
+    def test_items_flow_before_the_source_is_exhausted(self):
+        """
+        Test that the last stage sees the first item long before the source has produced them all.
+        """
+        first_output = []
+
+        def source():
+            for i in range(10):
+                time.sleep(0.02)
+                yield i
+
+        def sink(items):
+            if not first_output:
+                first_output.append(time.monotonic())
+            return items
+
+        pipeline = StreamingPipeline(source(), [Stage("double", slow(0, lambda i: i * 2)), Stage("sink", sink)], report_every=0)
+        start = time.monotonic()
+        stats = pipeline.run()
+
+        self.assertLess(first_output[0] - start, 0.1)
+        self.assertEqual(stats["sink"]["out"], 10)
+        self.assertEqual(stats["source"]["out"], 10)
+
+    def test_bounded_queues_apply_backpressure(self):
+        """
+        Test that a slow stage caps how far ahead the fast stages run.
+        """
+        produced = []
+
+        def source():
+            for i in range(30):
+                produced.append(i)
+                yield i
+
+        seen_ahead = []
+
+        def slow_sink(items):
+            seen_ahead.append(len(produced) - stats_out())
+            time.sleep(0.005)
+            return items
+
+        pipeline = StreamingPipeline(source(), [Stage("fast", slow(0)), Stage("slow", slow_sink)], queue_size=3, report_every=0)
+        stats_out = lambda: pipeline.stats["slow"]["in"]
+        stats = pipeline.run()
+
+        self.assertEqual(stats["slow"]["out"], 30)
+        self.assertLessEqual(stats["slow"]["max_queue"], 3)
+        self.assertLessEqual(max(seen_ahead), 3 + 3 + 2) # two full queues plus an item in each stage's hands
+
+    def test_micro_batches_and_parallel_workers(self):
+        batches = []
+        lock = threading.Lock()
+
+        def record(items):
+            with lock:
+                batches.append(len(items))
+            time.sleep(0.01)
+            return items
+
+        pipeline = StreamingPipeline(iter(range(40)), [Stage("batched", record, workers=2, batch_size=8)], report_every=0)
+        stats = pipeline.run()
+        self.assertEqual(stats["batched"]["out"], 40)
+        self.assertLess(len(batches), 40)
+        self.assertLessEqual(max(batches), 8)
+
+    def test_failures_are_counted_without_stalling(self):
+        """
+        Test that a stage that errors, or can't even start, doesn't block the stages before it.
+        """
+        def flaky(items):
+            if items[0] % 2:
+                raise ValueError("boom")
+            return items
+
+        @contextmanager
+        def broken():
+            raise ConnectionError("no database")
+            yield
+
+        pipeline = StreamingPipeline(iter(range(10)), [Stage("flaky", flaky), Stage("broken", connect=broken)],
+                                     queue_size=2, report_every=0)
+        stats = pipeline.run()
+        self.assertEqual((stats["flaky"]["out"], stats["flaky"]["errors"]), (5, 5))
+        self.assertEqual((stats["broken"]["in"], stats["broken"]["errors"]), (5, 5))
+
+    def test_batch_mode_matches_stream_mode(self):
+        stages = lambda: [Stage("even", lambda items: [i for i in items if i % 2 == 0]), Stage("square", slow(0, lambda i: i * i))]
+        self.assertEqual(run_batch(iter(range(10)), stages()), [0, 4, 16, 36, 64])
+
+class TestLeadStages(unittest.TestCase):
+
+    def test_leads_are_deduplicated_enriched_and_drafted(self):
+        """
+        Test that scraped leads end up in the store as pending drafts, with duplicates dropped.
+        """
+        async def complete(messages, model, max_tokens=None):
+            return f"Hi from {model}", 10
+
+        client = MagicMock(workers=2)
+        client.lookup.side_effect = lambda name, company: f"{name.split()[0].lower()}@acme.com"
+        leads = [
+            {"full_name": "Ada Lovelace", "headline": "SWE", "company": "Acme", "school": "", "profile_url": "https://www.linkedin.com/in/ada"},
+            {"full_name": "Ada Lovelace", "headline": "SWE", "company": "Acme", "school": "", "profile_url": "https://www.linkedin.com/in/ada/"},
+            {"full_name": "Grace Hopper", "headline": "SWE", "company": "Acme", "school": "", "profile_url": "https://www.linkedin.com/in/grace"},
+        ]
+        with tempfile.TemporaryDirectory() as tmp, LeadStore(os.path.join(tmp, "leads.db")) as store:
+            stages = [
+                dedup_stage(os.path.join(tmp, "index.sqlite")),
+                enrich_stage(store, client=client, cache_path=os.path.join(tmp, "apollo.sqlite")),
+                personalize_stage(store, generator_factory=lambda: DraftGenerator(complete=complete, model="fake")),
+            ]
+            stats = StreamingPipeline(iter(leads), stages, report_every=0).run()
+
+            drafted = store.leads(status=STATUS_PENDING)
+            self.assertEqual(stats["dedup"]["out"], 2)
+            self.assertEqual(list(drafted['email']), ["ada@acme.com", "grace@acme.com"])
+            self.assertEqual(list(drafted['draft_msg']), ["Hi from fake", "Hi from fake"])
+
+    def test_re_scraped_leads_already_contacted_are_left_alone(self):
+        """
+        Test that a re-scraped lead marked sent stays sent, whether or not the dedup index already knew it.
+        """
+        async def complete(messages, model, max_tokens=None):
+            return "New draft", 10
+
+        leads = [
+            {"full_name": "Ada Lovelace", "headline": "SWE", "company": "Acme", "school": "", "profile_url": "https://www.linkedin.com/in/ada"},
+            {"full_name": "Grace Hopper", "headline": "SWE", "company": "Acme", "school": "", "profile_url": "https://www.linkedin.com/in/grace"},
+        ]
+        for seeded in (True, False):
+            with self.subTest(seeded=seeded), tempfile.TemporaryDirectory() as tmp, \
+                    LeadStore(os.path.join(tmp, "leads.db")) as store:
+                store.upsert_leads(pd.DataFrame([dict(leads[0], draft_msg="Sent draft")]), status=STATUS_SENT)
+                stages = [
+                    dedup_stage(os.path.join(tmp, "index.sqlite"), store=store if seeded else None),
+                    enrich_stage(store),
+                    personalize_stage(store, generator_factory=lambda: DraftGenerator(complete=complete, model="fake")),
+                ]
+                stats = StreamingPipeline(iter(leads), stages, report_every=0).run()
+
+                self.assertEqual(stats["dedup"]["out"], 1 if seeded else 2)
+                ada = store.get_lead(1)
+                self.assertEqual((ada['status'], ada['draft_msg']), (STATUS_SENT, "Sent draft"))
+                self.assertEqual(list(store.leads(status=STATUS_PENDING)['full_name']), ["Grace Hopper"])
+
+if __name__ == '__main__':
+    unittest.main()
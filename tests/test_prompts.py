@@ -0,0 +1,63 @@
+import re
+import unittest
+from prompts import batch_max_tokens, compact_reply, count_tokens, strip_signature, truncate_tokens
+
+GMAIL_REPLY = """Sounds great, what times work for you next week?
+
+Thanks,
+Ada Lovelace
+Staff Engineer | Acme
++1 555 0100
+
+On Mon, Jan 1, 2024 at 9:00 AM Me <me@example.com>
+wrote:
+> Hi Ada, would you be open to a quick chat?
+"""
+OUTLOOK_REPLY = """Not right now, sorry.
+
+Sent from my iPhone
+________________________________
+From: Me <me@example.com>
+Sent: Monday, January 1, 2024 9:00 AM
+Subject: Quick question
+"""
+
+class TestCompaction(unittest.TestCase):
+
+    def test_replies_lose_quoted_history_signature_and_whitespace(self):
+        self.assertEqual(compact_reply(GMAIL_REPLY), "Sounds great, what times work for you next week? Thanks,")
+        self.assertEqual(compact_reply(OUTLOOK_REPLY), "Not right now, sorry.")
+        self.assertEqual(compact_reply("  Yes!\n\n\n  Let's talk.  "), "Yes! Let's talk.")
+
+    def test_text_after_a_sign_off_is_kept_when_it_reads_like_the_reply(self):
+        """
+        Test that only short, capitalized, unpunctuated name/title lines under a "Thanks," count as a signature.
+        """
+        body = "Happy to help.\nThanks,\nDo you have time on Friday? I'm free after 2."
+        self.assertEqual(strip_signature(body), body)
+        self.assertEqual(strip_signature("Thanks!\nAda"), "Thanks!\nAda")
+        self.assertEqual(compact_reply("Thanks,\nnot interested"), "Thanks, not interested")
+        self.assertEqual(compact_reply("Thanks,\nbusy this month, ping me next quarter"),
+                         "Thanks, busy this month, ping me next quarter")
+        self.assertEqual(compact_reply("Best,\nAda Lovelace\nHead of Sales at Acme\nada@acme.com"), "Best,")
+
+    def test_tails_matching_a_keep_pattern_are_kept(self):
+        keep = [re.compile(r"^\s*sure\b", re.IGNORECASE | re.MULTILINE)]
+        self.assertEqual(compact_reply("Thanks,\nSure", keep=keep), "Thanks, Sure")
+        self.assertEqual(compact_reply("Thanks,\nSure"), "Thanks,")
+
+    def test_truncation_respects_the_budget(self):
+        text = " ".join(f"word{n}" for n in range(500))
+        truncated = truncate_tokens(text, 50)
+        self.assertLessEqual(count_tokens(truncated), 50)
+        self.assertTrue(text.startswith(truncated))
+        self.assertGreater(count_tokens(truncated), 25)
+        self.assertEqual(truncate_tokens("short reply", 50), "short reply")
+        self.assertEqual(truncate_tokens(text, None), text)
+
+    def test_batch_caps_grow_with_the_batch(self):
+        self.assertGreater(batch_max_tokens(4, 20), 20 * 4)
+        self.assertLess(batch_max_tokens(4, 1), batch_max_tokens(4, 2))
+
+if __name__ == '__main__':
+    unittest.main()
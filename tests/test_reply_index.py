@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import pandas as pd
+from storage import LeadStore, STATUS_SENT, STATUS_REPLIED, STATUS_BOUNCED
+from reply_index import ReplyIndex, normalize_email, referenced_message_ids
+from src.inbox_listener import record_reply
+from triage import INTERESTED, AUTO_REPLY, BOUNCE
+
+def gmail_message(sender, thread_id="t1", **headers):
+    header_list = [{"name": "From", "value": sender}] + [
+        {"name": name.replace("_", "-").title(), "value": value} for name, value in headers.items()
+    ]
+    return {"id": "m1", "threadId": thread_id, "payload": {"headers": header_list, "body": {"data": ""}}}
+
+class TestReplyIndex(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "leads.db")
+        self.store = LeadStore(self.path)
+        self.addCleanup(self.store.close)
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": "Ada", "profile_url": "u/ada", "email": "Ada.Lovelace@gmail.com"},
+            {"full_name": "Grace", "profile_url": "u/grace", "email": "grace@navy.mil"},
+        ]))
+        self.store.set_status([1, 2], STATUS_SENT)
+
+    def test_addresses_and_reference_headers_normalize(self):
+        self.assertEqual(normalize_email("Ada <ada.lovelace+jobs@googlemail.com>"), "adalovelace@gmail.com")
+        self.assertEqual(normalize_email("GRACE@Navy.mil"), "grace@navy.mil")
+        self.assertEqual(referenced_message_ids("<b@x>", "<a@x> <b@x>"), ["b@x", "a@x"])
+
+    def test_replies_match_by_message_id_thread_or_sender(self):
+        """
+        Test that a reply resolves through its threading headers, its Gmail thread or its sender.
+        """
+        index = ReplyIndex(self.store)
+        index.record_send(2, email="grace@navy.mil", message_id="<abc@example.com>")
+
+        self.assertEqual(index.match("assistant@navy.mil", in_reply_to="<abc@example.com>", thread_id="t9"), 2)
+        self.assertEqual(index.match("someone@else.com", thread_id="t9"), 2)
+        self.assertEqual(index.match("Ada Lovelace <adalovelace@gmail.com>"), 1)
+        self.assertIsNone(index.match("stranger@example.com", thread_id="t0"))
+
+    def test_sends_are_visible_to_a_later_index(self):
+        """
+        Test that keys recorded while sending persist for the listener's next run.
+        """
+        ReplyIndex(self.store).record_send(1, message_id="<first@example.com>")
+        with LeadStore(self.path) as other:
+            self.assertEqual(ReplyIndex(other).match("x@y.com", references="<first@example.com>"), 1)
+
+    def test_record_reply_writes_status_back(self):
+        """
+        Test that human replies mark the lead replied, bounces mark it bounced and auto-replies change nothing.
+        """
+        index = ReplyIndex(self.store)
+        self.assertEqual(record_reply(self.store, index, gmail_message("ada.lovelace@gmail.com"), INTERESTED), 1)
+        self.assertEqual(record_reply(self.store, index, gmail_message("grace@navy.mil", "t2"), AUTO_REPLY), 2)
+
+        ada, grace = self.store.get_lead(1), self.store.get_lead(2)
+        self.assertEqual((ada['status'], ada['reply_category']), (STATUS_REPLIED, INTERESTED))
+        self.assertIsNotNone(ada['replied_at'])
+        self.assertEqual(grace['status'], STATUS_SENT)
+
+        index.record_send(2, message_id="<g@example.com>")
+        bounce = gmail_message("mailer-daemon@googlemail.com", "t3", references="<g@example.com>")
+        record_reply(self.store, index, bounce, BOUNCE)
+        self.assertEqual(self.store.get_lead(2)['status'], STATUS_BOUNCED)
+        self.assertEqual(self.store.count_by_reply_category(), {INTERESTED: 1})
+
+    def test_older_databases_gain_the_reply_columns(self):
+        path = os.path.join(os.path.dirname(self.path), "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE leads (id INTEGER PRIMARY KEY AUTOINCREMENT, full_name TEXT, headline TEXT, company TEXT,"
+                     " school TEXT, mutual_group TEXT, profile_url TEXT UNIQUE, email TEXT, last_contact TEXT,"
+                     " status TEXT NOT NULL DEFAULT 'new', draft_msg TEXT)")
+        conn.commit()
+        conn.close()
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT INTO leads (full_name, profile_url, email, status) VALUES ('Ada', 'u/ada', 'Ada.L@gmail.com', 'sent')")
+        conn.commit()
+        conn.close()
+        with LeadStore(path) as store:
+            self.assertIn("reply_category", store.leads().columns)
+            self.assertEqual(ReplyIndex(store).match("adal+x@googlemail.com"), 1)
+
+    def test_matching_looks_up_one_reply_without_loading_the_table(self):
+        """
+        Test that a match queries the reply's own keys instead of reading every contacted lead or stored key.
+        """
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead{i}", "profile_url": f"u/{i}", "email": f"lead{i}@example.com"} for i in range(50)
+        ]), status=STATUS_SENT)
+        self.store.update_leads(3, email="New.Address@Example.com")
+        index = ReplyIndex(self.store)
+        self.store.leads = None # any full read would now fail
+        self.store.reply_keys = lambda keys=None: [] if keys is None else LeadStore.reply_keys(self.store, keys)
+
+        self.assertEqual(index.match("lead7@example.com"), 10) # ids 1-2 are Ada and Grace
+        self.assertEqual(index.match("new.address@example.com", thread_id="t5"), 3)
+        self.assertEqual(index.match("someone@else.com", thread_id="t5"), 3)
+        self.assertIsNone(index.match("lead7@example.org"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,23 @@
+import socket
+from email import message_from_bytes
 import unittest
 from unittest.mock import patch, MagicMock
 import pandas as pd
-from src.sender import send_linkedin_message # Assuming sender.py is in src
+from src.sender import build_scheduler, send_linkedin_message, linkedin_channel, LinkedInSessionPool, EmailTransport # Assuming sender.py is in src
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
 
 class TestSender(unittest.TestCase):
 
-    @patch('src.sender.sync_playwright')
-    def test_send_linkedin_message_success(self, mock_sync_playwright):
+    def test_send_linkedin_message_success(self):
         """
         Test that send_linkedin_message returns True on success.
         """
         # Mock Playwright's context manager and objects
         mock_playwright = MagicMock()
-        mock_sync_playwright.return_value.__enter__.return_value = mock_playwright
         
         mock_browser = MagicMock()
         mock_context = MagicMock()
@@ -30,14 +35,12 @@ class TestSender(unittest.TestCase):
         mock_page.fill.assert_called()
         mock_page.click.assert_called()
 
-    @patch('src.sender.sync_playwright')
-    def test_send_linkedin_message_failure(self, mock_sync_playwright):
+    def test_send_linkedin_message_failure(self):
         """
         Test that send_linkedin_message returns False on failure.
         """
         # Mock Playwright to raise an exception
         mock_playwright = MagicMock()
-        mock_sync_playwright.return_value.__enter__.return_value = mock_playwright
         
         mock_browser = MagicMock()
         mock_context = MagicMock()
@@ -54,5 +57,128 @@ class TestSender(unittest.TestCase):
 
         self.assertFalse(result)
 
+    def test_session_pool_reuses_one_browser(self):
+        """
+        Test that a pool launches the browser once and serves every send from its pages.
+        """
+        mock_playwright = MagicMock()
+        mock_browser = mock_playwright.chromium.launch.return_value
+        mock_page = mock_browser.new_context.return_value.new_page.return_value
+        mock_page.url = "https://www.linkedin.com/feed/"
+
+        with LinkedInSessionPool(mock_playwright, size=2, state_file=None) as pool:
+            for i in range(5):
+                self.assertTrue(pool.send(f"http://linkedin.com/in/test{i}", "Test message"))
+
+        mock_playwright.chromium.launch.assert_called_once()
+        self.assertEqual(mock_browser.new_context.call_count, 2)
+        mock_browser.close.assert_called_once()
+        # Already logged in, so the login form is never touched
+        self.assertNotIn('input[name="session_key"]', [c.args[0] for c in mock_page.fill.call_args_list])
+
+    @patch('src.sender.LINKEDIN_POOL_SIZE', 3)
+    @patch('src.sender.LinkedInSessionPool')
+    @patch('playwright.sync_api.sync_playwright')
+    def test_linkedin_sends_use_one_page_per_worker(self, mock_sync_playwright, mock_pool):
+        """
+        Test that LINKEDIN_POOL_SIZE sets the LinkedIn workers, and each worker (or one-off send) opens one page.
+        """
+        self.assertEqual(build_scheduler(MagicMock(), "linkedin").channels["linkedin"]["workers"], 3)
+        with linkedin_channel():
+            pass
+        send_linkedin_message(MagicMock(), "http://linkedin.com/in/test", "Hi")
+        self.assertEqual([c.kwargs["size"] for c in mock_pool.call_args_list], [1, 1])
+
+    def test_session_pool_logs_in_when_redirected(self):
+        """
+        Test that the pool fills the login form when the saved session is not valid.
+        """
+        mock_playwright = MagicMock()
+        mock_page = mock_playwright.chromium.launch.return_value.new_context.return_value.new_page.return_value
+        mock_page.url = "https://www.linkedin.com/login"
+
+        with LinkedInSessionPool(mock_playwright, size=1, state_file=None):
+            pass
+
+        self.assertIn('input[name="session_key"]', [c.args[0] for c in mock_page.fill.call_args_list])
+
+
+class RecordingHandler:
+    """aiosmtpd handler that remembers which connection each message arrived on."""
+
+    def __init__(self):
+        self.messages = []
+        self.message_ids = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session.peer, envelope.rcpt_tos))
+        self.message_ids.append(message_from_bytes(envelope.content)["Message-ID"])
+        return '250 OK'
+
+
+@unittest.skipUnless(Controller, "aiosmtpd is not installed")
+class TestEmailTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+    def make_transport(self, **kwargs):
+        return EmailTransport(
+            user="me@example.com", host="127.0.0.1", port=self.port,
+            smtp_ssl=False, smtp_starttls=False, smtp_skip_login=True, **kwargs
+        )
+
+    def test_send_batch_reuses_one_connection(self):
+        """
+        Test that a batch is delivered over a single SMTP session.
+        """
+        batch = [(f"lead{i}@example.com", "Hi", "Body") for i in range(20)]
+        with self.make_transport() as transport:
+            results = transport.send_batch(batch)
+
+        self.assertTrue(all(r["ok"] for r in results))
+        self.assertEqual([r["to"] for r in results], [b[0] for b in batch])
+        self.assertEqual(len(self.handler.messages), 20)
+        self.assertEqual(len({peer for peer, _ in self.handler.messages}), 1)
+
+    def test_send_batch_reconnects_after_drop(self):
+        """
+        Test that a dropped connection is re-opened and the batch still completes.
+        """
+        with self.make_transport() as transport:
+            transport.send_batch([("a@example.com", "Hi", "Body")])
+            transport.clients[0].smtp.close()
+            results = transport.send_batch([("b@example.com", "Hi", "Body"), ("c@example.com", "Hi", "Body")])
+
+        self.assertTrue(all(r["ok"] for r in results))
+        self.assertEqual(len(self.handler.messages), 3)
+
+    def test_send_batch_reports_per_recipient_failures(self):
+        """
+        Test that a refused recipient fails on its own without stopping the batch.
+        """
+        with self.make_transport(pool_size=2) as transport:
+            results = transport.send_batch([("ok@example.com", "Hi", "Body"), ("not an address", "Hi", "Body")])
+
+        self.assertTrue(results[0]["ok"])
+        self.assertFalse(results[1]["ok"])
+        self.assertIsNotNone(results[1]["error"])
+
+    def test_results_carry_the_sent_message_id(self):
+        """
+        Test that each result has the unique Message-ID that went out, for matching replies later.
+        """
+        with self.make_transport() as transport:
+            results = transport.send_batch([("a@example.com", "Hi", "Body"), ("a@example.com", "Hi", "Body")])
+
+        self.assertEqual([r["message_id"] for r in results], self.handler.message_ids)
+        self.assertEqual(len(set(self.handler.message_ids)), 2)
+
 if __name__ == '__main__':
     unittest.main()
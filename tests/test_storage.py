@@ -0,0 +1,272 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import unittest
+import uuid
+import pandas as pd
+from storage import (LeadStore, POSTGRES_SCHEMA, import_all_csvs, export_all_csvs, load_df, save_df, lead_file_format,
+                     STATUS_NEW, STATUS_PENDING, STATUS_APPROVED, STATUS_REJECTED, STATUS_SENT, STATUS_REPLIED)
+
+class TestLeadStore(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.store = LeadStore(os.path.join(self.dir, "leads.db"))
+        self.addCleanup(self.store.close)
+
+    def test_upsert_keeps_status_and_existing_values(self):
+        """
+        Test that re-upserting a lead updates its data without resetting its status or blanking fields.
+        """
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": "Ada", "profile_url": "https://www.linkedin.com/in/ada", "email": "ada@acme.com"},
+            {"full_name": "Grace", "profile_url": "https://www.linkedin.com/in/grace", "email": None},
+        ]))
+        ada_id = int(self.store.leads().iloc[0]['id'])
+        self.store.set_status(ada_id, STATUS_APPROVED)
+
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": "Ada Lovelace", "profile_url": "https://www.linkedin.com/in/ada", "email": None},
+        ]))
+
+        leads = self.store.leads()
+        self.assertEqual(len(leads), 2)
+        ada = self.store.get_lead(ada_id)
+        self.assertEqual((ada['full_name'], ada['email'], ada['status']), ("Ada Lovelace", "ada@acme.com", STATUS_APPROVED))
+        self.assertEqual(self.store.count_by_status(), {STATUS_APPROVED: 1, STATUS_NEW: 1})
+
+    def test_reads_by_status_with_pagination(self):
+        """
+        Test that reads can be restricted to one status, a few columns and a page.
+        """
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead{i}", "profile_url": f"https://www.linkedin.com/in/{i}"} for i in range(10)
+        ]))
+        self.store.set_drafts({lead_id: "Hi" for lead_id in range(1, 8)})
+
+        page = self.store.leads(status=STATUS_PENDING, columns=["full_name"], limit=3, offset=3)
+        self.assertEqual(list(page.columns), ["id", "full_name"])
+        self.assertEqual(list(page['full_name']), ["Lead3", "Lead4", "Lead5"])
+
+    def test_drafts_only_move_new_leads_to_review(self):
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead{i}", "profile_url": f"https://www.linkedin.com/in/{i}"} for i in range(2)
+        ]))
+        self.store.set_status(1, STATUS_SENT, draft_msg="Sent")
+        self.assertEqual(self.store.set_drafts({1: "Again", 2: "Hi"}), 1)
+        self.assertEqual((self.store.get_lead(1)['status'], self.store.get_lead(1)['draft_msg']), (STATUS_SENT, "Sent"))
+        self.assertEqual(self.store.get_lead(2)['status'], STATUS_PENDING)
+
+    def test_funnel_counters_follow_every_write(self):
+        """
+        Test that the materialized status and reply counters match a full recount after inserts, updates and deletes.
+        """
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead{i}", "profile_url": f"https://www.linkedin.com/in/{i}"} for i in range(6)
+        ]))
+        version = self.store.version()
+        self.store.set_drafts({1: "Hi", 2: "Hi", 3: "Hi"})
+        self.store.set_status([2, 3], STATUS_REPLIED, reply_category="interested")
+        self.store.set_status(3, STATUS_REPLIED, reply_category="busy")
+        self.store.update_leads(4, draft_msg="edited") # no status change, but still a new version
+        self.store._execute("DELETE FROM leads WHERE id = ?", (5,))
+
+        self.assertGreater(self.store.version(), version)
+        self.assertEqual(self.store.count_by_status(), {STATUS_NEW: 2, STATUS_PENDING: 1, STATUS_REPLIED: 2})
+        self.assertEqual(self.store.count_by_reply_category(), {"interested": 1, "busy": 1})
+        recount = self.store.leads(columns=["status"])['status'].value_counts().to_dict()
+        self.assertEqual(self.store.count_by_status(), recount)
+
+    def test_counters_are_backfilled_for_older_databases(self):
+        path = os.path.join(self.dir, "old.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE leads (id INTEGER PRIMARY KEY AUTOINCREMENT, full_name TEXT, headline TEXT, company TEXT,"
+                     " school TEXT, mutual_group TEXT, profile_url TEXT UNIQUE, email TEXT, last_contact TEXT,"
+                     " status TEXT NOT NULL DEFAULT 'new', draft_msg TEXT)")
+        conn.executemany("INSERT INTO leads (full_name, profile_url, status) VALUES (?, ?, ?)",
+                         [("A", "u/a", STATUS_NEW), ("B", "u/b", STATUS_SENT), ("C", "u/c", STATUS_SENT)])
+        conn.commit()
+        conn.close()
+
+        with LeadStore(path) as store:
+            self.assertEqual(store.count_by_status(), {STATUS_NEW: 1, STATUS_SENT: 2})
+
+    def test_filtered_pages_and_counts(self):
+        """
+        Test server-side filtering by status, reply category and search text, newest first, with matching counts.
+        """
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead{i}", "company": "Acme" if i % 2 else "Globex", "profile_url": f"https://www.linkedin.com/in/{i}"}
+            for i in range(10)
+        ]))
+        self.store.set_status([2, 4, 6], STATUS_REPLIED, reply_category="interested")
+
+        page = self.store.leads(search="acme", columns=["full_name"], limit=2, offset=1, newest_first=True)
+        self.assertEqual(list(page['full_name']), ["Lead7", "Lead5"])
+        self.assertEqual(self.store.count_leads(search="ACME"), 5)
+        self.assertEqual(self.store.count_leads(status=STATUS_REPLIED, reply_category="interested"), 3)
+        self.assertEqual(self.store.count_leads(status=[STATUS_NEW, STATUS_REPLIED]), 10)
+        self.assertEqual(self.store.count_leads(status=STATUS_REPLIED, search="globex"), 0)
+
+    def test_batch_review_skips_leads_decided_elsewhere(self):
+        """
+        Test that a page of review decisions is applied in one write, keeps unedited drafts and never
+        overrides a lead that left "pending" in the meantime.
+        """
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": f"Lead{i}", "profile_url": f"https://www.linkedin.com/in/{i}"} for i in range(5)
+        ]))
+        self.store.set_drafts({lead_id: f"Hi {lead_id}" for lead_id in range(1, 6)})
+        self.store.set_status(3, STATUS_APPROVED, draft_msg="approved elsewhere")
+
+        applied = self.store.review({
+            1: (STATUS_APPROVED, None), 2: (STATUS_APPROVED, "Edited"), 3: (STATUS_REJECTED, None), 4: (STATUS_REJECTED, None),
+        })
+
+        self.assertEqual(applied, 3)
+        drafts = self.store.leads(columns=["status", "draft_msg"]).set_index("id")
+        self.assertEqual(drafts.loc[1].tolist(), [STATUS_APPROVED, "Hi 1"])
+        self.assertEqual(drafts.loc[2].tolist(), [STATUS_APPROVED, "Edited"])
+        self.assertEqual(drafts.loc[3].tolist(), [STATUS_APPROVED, "approved elsewhere"])
+        self.assertEqual(drafts.loc[4, "status"], STATUS_REJECTED)
+        self.assertEqual(list(self.store.leads(status=STATUS_PENDING, after_id=2)['id']), [5])
+
+    def test_csv_import_export_round_trip(self):
+        """
+        Test that the old CSV hand-off files import with the right statuses and export back.
+        """
+        pd.DataFrame([
+            {"full_name": "A", "profile_url": "u/a"}, {"full_name": "B", "profile_url": "u/b"},
+            {"full_name": "C", "profile_url": "u/c"},
+        ]).to_csv(os.path.join(self.dir, "leads_processed.csv"), index=False)
+        pd.DataFrame([{"full_name": "B", "profile_url": "u/b", "draft_msg": "Hi B"}]).to_csv(
+            os.path.join(self.dir, "outbox.csv"), index=False)
+        pd.DataFrame([{"full_name": "C", "profile_url": "u/c", "draft_msg": "Hi C"}]).to_csv(
+            os.path.join(self.dir, "sent.csv"), index=False)
+
+        import_all_csvs(self.store, self.dir)
+        self.assertEqual(self.store.count_by_status(), {STATUS_NEW: 1, STATUS_APPROVED: 1, STATUS_SENT: 1})
+
+        export_all_csvs(self.store, self.dir)
+        outbox = pd.read_csv(os.path.join(self.dir, "outbox.csv"))
+        self.assertEqual(list(outbox['draft_msg']), ["Hi B"])
+
+    def test_parquet_export_round_trip(self):
+        """
+        Test that Parquet hand-off files are preferred on import and keep categorical columns.
+        """
+        self.store.upsert_leads(pd.DataFrame([
+            {"full_name": "A", "company": "Acme", "profile_url": "u/a"}, {"full_name": "B", "company": "Acme", "profile_url": "u/b"},
+        ]))
+        self.store.set_status(2, STATUS_APPROVED)
+        export_all_csvs(self.store, self.dir, file_format="parquet")
+        self.assertEqual(lead_file_format(os.path.join(self.dir, "outbox.parquet")), "parquet")
+
+        copy = LeadStore(os.path.join(self.dir, "copy.db"))
+        self.addCleanup(copy.close)
+        import_all_csvs(copy, self.dir)
+        self.assertEqual(copy.count_by_status(), {STATUS_NEW: 1, STATUS_APPROVED: 1})
+
+    def test_load_df_detects_format_and_projects_columns(self):
+        leads = pd.DataFrame([
+            {"full_name": "A", "company": "Acme", "status": STATUS_NEW, "profile_url": "u/a"},
+            {"full_name": "B", "company": "Acme", "status": STATUS_SENT, "profile_url": "u/b"},
+        ])
+        for name in ("leads.csv", "leads.parquet", "leads.feather"):
+            path = os.path.join(self.dir, name)
+            save_df(leads, path)
+            # A misleading extension doesn't matter: the format is read from the file itself.
+            os.replace(path, path + ".dat")
+            df = load_df(path + ".dat", columns=["full_name", "company", "school"])
+            self.assertEqual(list(df.columns), ["full_name", "company"], name)
+            self.assertIsInstance(df['company'].dtype, pd.CategoricalDtype, name)
+            self.assertEqual(list(df['full_name']), ["A", "B"], name)
+
+# A scratch Postgres database for the tests below, e.g. postgresql://postgres@/postgres?host=/tmp/pgdata
+POSTGRES_URL = os.getenv("LEADS_TEST_POSTGRES_URL")
+
+class TestPostgresSchema(unittest.TestCase):
+
+    def test_schema_file_matches_what_the_store_applies(self):
+        schema_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql", "schema.sql")
+        with open(schema_path) as f:
+            self.assertEqual(f.read(), POSTGRES_SCHEMA)
+
+@unittest.skipUnless(POSTGRES_URL, "LEADS_TEST_POSTGRES_URL is not set")
+class TestPostgresLeadStore(unittest.TestCase):
+
+    def setUp(self):
+        import psycopg2
+        self.schema = f"test_{uuid.uuid4().hex[:12]}"
+        self.admin = psycopg2.connect(POSTGRES_URL)
+        self.admin.autocommit = True
+        self.admin.cursor().execute(f"CREATE SCHEMA {self.schema}")
+        self.addCleanup(self.admin.close)
+        self.addCleanup(lambda: self.admin.cursor().execute(f"DROP SCHEMA {self.schema} CASCADE"))
+        separator = "&" if "?" in POSTGRES_URL else "?"
+        self.url = f"{POSTGRES_URL}{separator}options=-csearch_path%3D{self.schema}"
+
+    def test_existing_databases_are_migrated_and_backfilled_on_open(self):
+        """
+        Test that a database created before the counters (leads table only) gets them, filled from its rows.
+        """
+        cursor = self.admin.cursor()
+        cursor.execute(f"SET search_path TO {self.schema}")
+        cursor.execute("CREATE TABLE leads (id SERIAL PRIMARY KEY, full_name VARCHAR(255), headline TEXT,"
+                       " company VARCHAR(255), school VARCHAR(255), mutual_group VARCHAR(255),"
+                       " profile_url VARCHAR(255) UNIQUE, email VARCHAR(255), last_contact TIMESTAMP,"
+                       " status VARCHAR(50) NOT NULL DEFAULT 'new', draft_msg TEXT)")
+        cursor.execute("INSERT INTO leads (full_name, profile_url, status) VALUES"
+                       " ('A', 'u/a', 'new'), ('B', 'u/b', 'sent'), ('C', 'u/c', 'sent')")
+
+        with LeadStore(self.url) as store:
+            self.assertEqual(store.count_by_status(), {STATUS_NEW: 1, STATUS_SENT: 2})
+            version = store.version()
+            store.set_status(1, STATUS_REPLIED, reply_category="interested")
+            self.assertGreater(store.version(), version)
+            self.assertEqual(store.count_by_reply_category(), {"interested": 1})
+        with LeadStore(self.url) as store: # reopening changes nothing
+            self.assertEqual(store.count_by_status(), {STATUS_SENT: 2, STATUS_REPLIED: 1})
+            self.assertEqual(store.jobs_done(["a"]), set())
+
+    def test_concurrent_writers_keep_the_counters_exact(self):
+        """
+        Test that workers moving leads between different statuses at once neither deadlock nor lose counts.
+        """
+        with LeadStore(self.url) as store:
+            store.upsert_leads(pd.DataFrame([
+                {"full_name": f"Lead{i}", "profile_url": f"https://www.linkedin.com/in/{i}"} for i in range(400)
+            ]))
+            store.set_status(list(range(1, 401, 3)), STATUS_PENDING)
+            store.set_status(list(range(2, 401, 3)), STATUS_APPROVED)
+        errors = []
+
+        def work(ids, steps):
+            try:
+                with LeadStore(self.url) as store:
+                    for status in steps:
+                        store.set_status(ids, status)
+            except Exception as e:
+                errors.append(e)
+
+        cycles = [[STATUS_SENT, STATUS_APPROVED, STATUS_PENDING], [STATUS_APPROVED, STATUS_PENDING, STATUS_NEW],
+                  [STATUS_NEW, STATUS_SENT, STATUS_APPROVED], [STATUS_PENDING, STATUS_NEW, STATUS_SENT]] * 2
+        threads = [
+            threading.Thread(target=work, args=(random.Random(n).sample(range(1 + n, 401, 8), 50), steps * 3))
+            for n, steps in enumerate(cycles)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        with LeadStore(self.url) as store:
+            self.assertEqual(store.count_by_status(),
+                             {STATUS_PENDING: 100, STATUS_NEW: 100, STATUS_APPROVED: 100, STATUS_SENT: 100})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+import unittest
+from triage import (ReplyTriage, TriageCache, classify_headers, classify_text,
+                    AUTO_REPLY, BOUNCE, BUSY, DECLINE, INTERESTED, FOLLOW_UP, ERROR)
+
+AMBIGUOUS = "Thanks for the note. Can you tell me a bit more about what you're working on and what you'd want to cover?"
+
+class FakeLLM:
+    """Answers batch prompts with a JSON map and single prompts with a number."""
+
+    def __init__(self, answer="4"):
+        self.answer = answer
+        self.requests = []
+        self.max_tokens = []
+
+    def __call__(self, messages, model, max_tokens=None):
+        self.requests.append(messages)
+        self.max_tokens.append(max_tokens)
+        if messages[0]["role"] == "system":
+            ids = json.loads(messages[1]["content"])
+            return json.dumps({reply_id: self.answer for reply_id in ids})
+        return self.answer
+
+class TestLocalTiers(unittest.TestCase):
+
+    def test_headers_catch_bounces_and_auto_replies(self):
+        self.assertEqual(classify_headers({"From": "Mail Delivery Subsystem <mailer-daemon@googlemail.com>"}), BOUNCE)
+        self.assertEqual(classify_headers({"Subject": "Automatic reply: Quick question"}), AUTO_REPLY)
+        self.assertEqual(classify_headers({"Auto-Submitted": "auto-replied"}), AUTO_REPLY)
+        self.assertIsNone(classify_headers({"From": "ada@acme.com", "Subject": "Re: Quick question", "Auto-Submitted": "no"}))
+
+    def test_short_clear_replies_are_confident(self):
+        """
+        Test that short, one-sided replies are labelled locally and mixed or open ones are not.
+        """
+        self.assertEqual(classify_text("Not interested, thanks.")[0], DECLINE)
+        self.assertEqual(classify_text("Sure, happy to chat! Here's my calendly: calendly.com/ada")[0], INTERESTED)
+        self.assertEqual(classify_text("Swamped this month, reach out next quarter.")[0], BUSY)
+        self.assertGreaterEqual(classify_text("Not interested.")[1], 0.8)
+        self.assertLess(classify_text(AMBIGUOUS)[1], 0.8)
+        self.assertLess(classify_text("Happy to chat but not interested in referrals")[1], 0.8)
+
+    def test_quoted_history_is_ignored(self):
+        body = "No thanks.\n\nOn Mon, Jan 1, 2024 at 9:00 AM Me <me@x.com> wrote:\n> Happy to chat? Would love to connect"
+        self.assertEqual(classify_text(body)[0], DECLINE)
+
+    def test_short_replies_after_a_sign_off_are_not_taken_for_a_signature(self):
+        self.assertEqual(classify_text("Thanks,\nnot interested")[0], DECLINE)
+        self.assertEqual(classify_text("Thanks,\nbusy this month, ping me next quarter")[0], BUSY)
+        self.assertEqual(classify_text("Thanks,\nNot Interested")[0], DECLINE)
+
+class TestReplyTriage(unittest.TestCase):
+
+    def test_only_ambiguous_replies_reach_the_llm_in_batches(self):
+        """
+        Test that local tiers handle the clear cases and the rest go to the LLM a batch at a time.
+        """
+        llm = FakeLLM(answer="1")
+        triage = ReplyTriage(complete=llm, batch_size=2)
+        replies = [
+            ("I am currently out of the office until Monday.", {}),
+            ("", {"From": "postmaster@acme.com"}),
+            ("Not interested.", {}),
+            (AMBIGUOUS, {}),
+            (AMBIGUOUS + " Also, which team are you on?", {}),
+            ("Interesting, what's the context here?", {}),
+        ]
+        categories = triage.triage_many(replies)
+
+        self.assertEqual(categories, [AUTO_REPLY, BOUNCE, DECLINE, INTERESTED, INTERESTED, INTERESTED])
+        self.assertEqual(len(llm.requests), 2)
+        report = triage.report()
+        self.assertEqual(report["headers"]["count"], 1)
+        self.assertEqual(report["local"]["count"], 2)
+        self.assertEqual(report["llm"]["count"], 3)
+        self.assertAlmostEqual(report["llm"]["fraction"], 0.5)
+
+    def test_llm_labels_are_cached_by_body(self):
+        """
+        Test that a repeated body (even with different quoting/whitespace) is answered from the cache.
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "triage.sqlite")
+            llm = FakeLLM(answer="2")
+            with TriageCache(path) as cache:
+                ReplyTriage(complete=llm, cache=cache).triage(AMBIGUOUS)
+            with TriageCache(path) as cache:
+                triage = ReplyTriage(complete=llm, cache=cache)
+                category = triage.triage("  " + AMBIGUOUS + "\n\n> quoted earlier message")
+
+        self.assertEqual(category, BUSY)
+        self.assertEqual(len(llm.requests), 1)
+        self.assertEqual(triage.report()["cache"]["count"], 1)
+
+    def test_unparseable_batch_falls_back_to_single_requests(self):
+        """
+        Test that replies missing from a bad batch answer are retried one at a time, and errors aren't cached.
+        """
+        calls = []
+
+        def complete(messages, model, max_tokens=None):
+            calls.append(messages)
+            if messages[0]["role"] == "system":
+                return "I can't do that"
+            return "4=needs-follow-up" if len(calls) == 2 else "no idea"
+
+        triage = ReplyTriage(complete=complete)
+        categories = triage.triage_many([(AMBIGUOUS, {}), ("What's this about?", {})])
+        self.assertEqual(categories, [FOLLOW_UP, ERROR])
+        self.assertEqual(len(calls), 3)
+
+    def test_llm_gets_compact_bodies_and_a_tight_answer_budget(self):
+        """
+        Test that signatures, quoted history and text past the input budget never reach the LLM.
+        """
+        llm = FakeLLM(answer="2")
+        triage = ReplyTriage(complete=llm, input_tokens=30, max_tokens=4)
+        body = (AMBIGUOUS + "\n\nBest,\nAda Lovelace\nStaff Engineer | Acme\n\nSent from my iPhone\n\n"
+                "On Mon, Jan 1, 2024 at 9:00 AM Me <me@x.com> wrote:\n> Hi Ada, " + "long pitch " * 200)
+        self.assertEqual(triage.triage(body), BUSY)
+        prompt = llm.requests[0][0]["content"]
+        self.assertNotIn("Ada Lovelace", prompt)
+        self.assertNotIn("long pitch", prompt)
+        self.assertIn(AMBIGUOUS[:60], prompt)
+        self.assertEqual(llm.max_tokens, [4])
+        self.assertGreater(triage.tokens["trimmed"], 400)
+
+        triage.triage_many([(AMBIGUOUS + " One.", {}), (AMBIGUOUS + " Two.", {})])
+        self.assertGreater(llm.max_tokens[-1], 2 * 4)
+
+if __name__ == '__main__':
+    unittest.main()